@@ -0,0 +1,248 @@
+"""
+Shared parts of the upload benchmarks: synthetic sequence data, a latency-adding TCP proxy, a
+stand-in for the pseudo_id manager, timing and the JSON report.
+"""
+import gzip
+import json
+import os
+import platform
+import queue
+import random
+import socket
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+MB = 1024 * 1024
+
+FAST5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+
+
+def write_fastq_gz(path: Path, size: int, read_length: int = 150):
+    """ Writes gzipped FASTQ records of random reads until the compressed file reaches size bytes """
+    rng = random.Random(path.name)
+    quality = "F" * read_length
+    # reads are drawn from a pool; the pool is large enough to keep gzip from finding repeats
+    pool = ["".join(rng.choices("ACGT", k=read_length)) for _ in range(4096)]
+    with open(path, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=1) as gz:
+        n = 0
+        while raw.tell() < size:
+            block = []
+            for seq in rng.choices(pool, k=2000):
+                n += 1
+                block.append(f"@SYNTH:1:FC:1:1:{n}:1 1:N:0:1\n{seq}\n+\n{quality}\n")
+            gz.write("".join(block).encode('ascii'))
+
+
+def write_fast5(path: Path, size: int):
+    """ Writes an HDF5 signature followed by random bytes, which, like raw signal data, does not compress """
+    with open(path, 'wb') as fh:
+        fh.write(FAST5_SIGNATURE)
+        remaining = size - len(FAST5_SIGNATURE)
+        while remaining > 0:
+            chunk = os.urandom(min(remaining, 4 * MB))
+            fh.write(chunk)
+            remaining -= len(chunk)
+
+
+def make_dataset(root: Path, name: str, samples: int, files_per_sample: int, size: int, kind: str) -> list:
+    """
+    Creates, or reuses, a synthetic data set of samples with files_per_sample files of about size
+    bytes each.
+    :param root: data directory
+    :param name: data set name, a sub-directory of root
+    :param kind: 'fastq' (gzipped) or 'fast5'
+    :return: list of (internal_lab_id, [Path])
+    """
+    directory = Path(root, name)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    dataset = []
+    for s in range(1, samples + 1):
+        lid = f"{name}-{s:04d}"
+        files = []
+        for f in range(1, files_per_sample + 1):
+            if kind == 'fast5':
+                path = Path(directory, f"{lid}_{f:04d}.fast5")
+            else:
+                path = Path(directory, f"{lid}_S{s}_L001_R{f}_001.fastq.gz")
+
+            if not path.is_file() or abs(path.stat().st_size - size) > max(size // 10, 64 * 1024):
+                if kind == 'fast5':
+                    write_fast5(path, size)
+                else:
+                    write_fastq_gz(path, size)
+            files.append(path)
+        dataset.append((lid, files))
+
+    return dataset
+
+
+def dataset_dataframe(dataset: list, kind: str):
+    """ Dataframe with the columns the UploadEngine reads, one row per sample """
+    import pandas as pd
+
+    rows = []
+    for n, (lid, files) in enumerate(dataset, start=1):
+        names = [file.name for file in files]
+        rows.append({'internal_lab_id': lid,
+                     'pseudo_id': f"BENCH-{n:06d}",
+                     'fastq': names if kind != 'fast5' else [],
+                     'fast5': names if kind == 'fast5' else [],
+                     'seq_path': str(files[0].parent)})
+
+    return pd.DataFrame(rows)
+
+
+def write_metafile(path: Path, dataset: list):
+    with open(path, 'w', encoding='utf-8') as fh:
+        json.dump([{'internal_lab_id': lid} for lid, _ in dataset], fh)
+
+
+class NullPseudoIDManager:
+    """ Takes the place of PseudoIDManager in benchmark runs; pseudo_ids are not stored """
+    def __init__(self):
+        self.committed = []
+
+    def write_pidlids_to_csv(self, pidlids: list, tag: str):
+        self.committed.extend(pidlids)
+
+    def check_pidlids(self, pidlids: list, tag: str):
+        return [], []
+
+
+class Measurement:
+    """ Wall clock and process CPU time (all threads) of a block """
+    def __enter__(self):
+        self.wall0 = time.perf_counter()
+        self.cpu0 = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.wall0
+        self.cpu_seconds = time.process_time() - self.cpu0
+
+    def result(self, files: int, nbytes: int, **fields) -> dict:
+        result = dict(fields)
+        result.update({'files': files,
+                       'bytes': nbytes,
+                       'seconds': round(self.seconds, 3),
+                       'mb_per_s': round(nbytes / MB / self.seconds, 2) if self.seconds > 0 else None,
+                       'seconds_per_file': round(self.seconds / files, 4) if files else None,
+                       'cpu_seconds': round(self.cpu_seconds, 3),
+                       'cpu_percent': round(100 * self.cpu_seconds / self.seconds, 1) if self.seconds > 0 else None})
+        return result
+
+
+class _DelayedPipe:
+    """ Forwards one direction of a connection, holding each chunk back for delay seconds """
+    def __init__(self, src: socket.socket, dst: socket.socket, delay: float):
+        self.src = src
+        self.dst = dst
+        self.delay = delay
+        self.chunks = queue.Queue()
+
+        threading.Thread(target=self._read, daemon=True).start()
+        threading.Thread(target=self._write, daemon=True).start()
+
+    def _read(self):
+        try:
+            for data in iter(lambda: self.src.recv(256 * 1024), b''):
+                self.chunks.put((time.monotonic() + self.delay, data))
+        except OSError:
+            pass
+        self.chunks.put((time.monotonic() + self.delay, b''))
+
+    def _write(self):
+        try:
+            for due, data in iter(self.chunks.get, None):
+                wait = due - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                if not data:
+                    self.dst.shutdown(socket.SHUT_WR)
+                    return
+                self.dst.sendall(data)
+        except OSError:
+            pass
+
+
+class LatencyProxy:
+    """
+    TCP proxy on localhost that adds a round-trip time of latency seconds to every connection to
+    host:port, half on each direction, to mimic a WAN link. Throughput is not limited: chunks are
+    delayed, not serialized.
+    """
+    def __init__(self, host: str, port: int, latency: float):
+        self.target = (host, port)
+        self.delay = latency / 2
+        self.server = socket.create_server(('127.0.0.1', 0))
+        self.port = self.server.getsockname()[1]
+        self.connections = []
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                return
+
+            upstream = socket.create_connection(self.target)
+            for sock in [client, upstream]:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.connections += [client, upstream]
+            _DelayedPipe(client, upstream, self.delay)
+            _DelayedPipe(upstream, client, self.delay)
+
+    def close(self):
+        self.server.close()
+        for sock in self.connections:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def write_report(path: Path, benchmark: str, params: dict, results: list):
+    """
+    Writes the results as JSON, with enough context (versions, host, parameters) to compare runs
+    across releases.
+    """
+    report = {'benchmark': benchmark,
+              'time': datetime.now().isoformat(timespec='seconds'),
+              'git_revision': _git_revision(),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'cpu_count': os.cpu_count(),
+              'params': params,
+              'results': results}
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as fh:
+        json.dump(report, fh, indent=2, default=str)
+
+
+def _git_revision():
+    head = Path(__file__).resolve().parent.parent / '.git' / 'HEAD'
+    try:
+        ref = head.read_text().strip()
+        if ref.startswith('ref: '):
+            return Path(head.parent, ref[5:]).read_text().strip()
+        return ref
+    except OSError:
+        return None
+
+
+def print_results(results: list):
+    for r in results:
+        print(f"{r['mode']:>10} {r['scenario']:>6}: {r['files']:5d} files {r['bytes'] / MB:10.1f} MB "
+              f"{r['seconds']:8.2f} s {r['mb_per_s'] or 0:8.2f} MB/s "
+              f"{r['seconds_per_file'] or 0:7.4f} s/file  cpu {r['cpu_percent'] or 0:5.1f} %")
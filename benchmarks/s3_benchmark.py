@@ -0,0 +1,195 @@
+"""
+S3 upload benchmark against a local moto server.
+
+Generates synthetic sequence files and uploads them with Boto3FileUploadWorker, one file at a time,
+and with the UploadEngine, reporting throughput, per-file overhead and client CPU use. moto runs in
+a separate process, so that the CPU figures are those of the uploader only. --latency-ms puts a
+proxy adding that round-trip time in front of the server.
+
+Run from the repository root:
+
+    python -m benchmarks.s3_benchmark --files 4 --size-mb 256 --latency-ms 40 --output results/s3.json
+
+Requires moto with its server extra (pip install -r benchmarks/requirements.txt).
+"""
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+import boto3
+
+from benchmarks.common import MB, make_dataset, dataset_dataframe, write_metafile, NullPseudoIDManager, \
+    Measurement, LatencyProxy, free_port, write_report, print_results
+from gms_uploader.modules.upload.connections import S3Connection
+from gms_uploader.modules.upload.support_classes import Boto3FileUploadWorker, S3_PART_CONCURRENCY
+from gms_uploader.modules.upload.multipart import MultipartJournal
+from gms_uploader.modules.upload.tuning import S3TransferTuner
+from gms_uploader.modules.upload.progress import ProgressAggregator
+from gms_uploader.modules.upload.checksums import ChecksumStore
+from gms_uploader.modules.upload.engine import UploadEngine
+
+BUCKET = 'benchmark'
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="s3_benchmark", description=__doc__.split("\n\n")[0])
+    parser.add_argument('--files', type=int, default=4, help="number of large files (default 4)")
+    parser.add_argument('--size-mb', type=float, default=64, help="size of each large file in MB (default 64)")
+    parser.add_argument('--small-files', type=int, default=50,
+                        help="number of small files for the per-file overhead, 0 to skip (default 50)")
+    parser.add_argument('--small-size-kb', type=float, default=64, help="size of each small file in kB (default 64)")
+    parser.add_argument('--kind', choices=['fastq', 'fast5'], default='fastq',
+                        help="gzipped FASTQ (compressible text) or fast5 (random bytes)")
+    parser.add_argument('--mode', choices=['worker', 'engine', 'both'], default='both',
+                        help="Boto3FileUploadWorker one file at a time, the UploadEngine, or both")
+    parser.add_argument('--max-concurrent', type=int, default=4, help="max_concurrent_files of the UploadEngine")
+    parser.add_argument('--latency-ms', type=float, default=0, help="added round-trip time in ms (default 0)")
+    parser.add_argument('--cred-option', action='append', default=[], metavar='KEY=VALUE',
+                        help="extra credentials json entry, e.g. s3_part_size_mb=16; may be repeated")
+    parser.add_argument('--data-dir', type=Path,
+                        help="where to keep the synthetic files between runs, default a temporary directory")
+    parser.add_argument('--output', type=Path, help="JSON report path")
+    return parser.parse_args(argv)
+
+
+def parse_cred_options(options: list) -> dict:
+    cred = {}
+    for option in options:
+        key, _, value = option.partition('=')
+        try:
+            cred[key] = float(value) if '.' in value else int(value)
+        except ValueError:
+            cred[key] = value
+
+    return cred
+
+
+def start_moto(port: int) -> subprocess.Popen:
+    server = subprocess.Popen([sys.executable, '-m', 'moto.server', '-H', '127.0.0.1', '-p', str(port)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    client = boto3.client('s3', endpoint_url=f"http://127.0.0.1:{port}", region_name='us-east-1',
+                          aws_access_key_id='testing', aws_secret_access_key='testing')
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            client.create_bucket(Bucket=BUCKET)
+            return server
+        except Exception:
+            if server.poll() is not None or time.monotonic() > deadline:
+                server.kill()
+                raise RuntimeError("moto server did not start, is moto[server] installed?")
+            time.sleep(0.2)
+
+
+def run_workers(cred: dict, dataset: list, tag: str, workdir: Path) -> Measurement:
+    """ Uploads the files one after another, each with its own Boto3FileUploadWorker """
+    connection = S3Connection(cred, S3_PART_CONCURRENCY)
+    tuner = S3TransferTuner(cred, connection.max_pool_connections, S3_PART_CONCURRENCY)
+    journal = MultipartJournal(Path(workdir, tag + ".json"))
+    progress = ProgressAggregator()
+    checksums = ChecksumStore()
+
+    files = [file for _, sample_files in dataset for file in sample_files]
+    for file in files:
+        progress.register(file.name, file.stat().st_size)
+
+    try:
+        with Measurement() as measurement:
+            for file in files:
+                Boto3FileUploadWorker(cred, tag, file, progress, checksums, connection, journal, tuner).run()
+    finally:
+        connection.close()
+
+    return measurement
+
+
+def run_engine(cred: dict, dataset: list, kind: str, tag: str, workdir: Path) -> Measurement:
+    """ Uploads the data set, meta file, manifest and upload complete file with the UploadEngine """
+    metafile = Path(workdir, tag + "_meta.json")
+    write_metafile(metafile, dataset)
+    completefile = Path(workdir, tag + "_upload_complete.txt")
+    completefile.write_text("complete")
+
+    engine = UploadEngine(cred, tag, dataset_dataframe(dataset, kind), metafile, completefile,
+                          NullPseudoIDManager(), sync_mode=False)
+    try:
+        with Measurement() as measurement:
+            engine.start()
+            all_done = None
+            while all_done is None:
+                for event in engine.process_events(timeout=0.5):
+                    if event[0] == 'complete':
+                        all_done = event[1]
+    finally:
+        engine.close()
+
+    if not all_done:
+        raise RuntimeError(f"upload failed: {engine.failed}")
+
+    return measurement
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+
+    tmp = tempfile.TemporaryDirectory(prefix="gms-bench-")
+    data_dir = args.data_dir if args.data_dir is not None else Path(tmp.name, 'data')
+    workdir = Path(tmp.name, 'work')
+    workdir.mkdir(parents=True)
+
+    scenarios = {'large': make_dataset(data_dir, f"large-{args.kind}", args.files, 1,
+                                       int(args.size_mb * MB), args.kind)}
+    if args.small_files > 0:
+        scenarios['small'] = make_dataset(data_dir, f"small-{args.kind}", args.small_files, 1,
+                                          int(args.small_size_kb * 1024), args.kind)
+
+    port = free_port()
+    server = start_moto(port)
+    proxy = LatencyProxy('127.0.0.1', port, args.latency_ms / 1000) if args.latency_ms > 0 else None
+
+    cred = {'target_label': 'benchmark',
+            'protocol': 'S3',
+            'endpoint': f"http://127.0.0.1:{proxy.port if proxy else port}",
+            'bucket': BUCKET,
+            'aws_access_key_id': 'testing',
+            'aws_secret_access_key': 'testing',
+            'max_concurrent_files': args.max_concurrent}
+    cred.update(parse_cred_options(args.cred_option))
+
+    modes = ['worker', 'engine'] if args.mode == 'both' else [args.mode]
+    results = []
+    stamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+
+    try:
+        for scenario, dataset in scenarios.items():
+            nbytes = sum(file.stat().st_size for _, files in dataset for file in files)
+            nfiles = sum(len(files) for _, files in dataset)
+            for mode in modes:
+                tag = f"bench-{mode}-{scenario}-{stamp}"
+                if mode == 'worker':
+                    measurement = run_workers(cred, dataset, tag, workdir)
+                else:
+                    measurement = run_engine(cred, dataset, args.kind, tag, workdir)
+                results.append(measurement.result(nfiles, nbytes, mode=mode, scenario=scenario))
+    finally:
+        if proxy is not None:
+            proxy.close()
+        server.terminate()
+        server.wait()
+
+    print_results(results)
+
+    if args.output is not None:
+        params = {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()}
+        write_report(args.output, 's3', params, results)
+
+    tmp.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
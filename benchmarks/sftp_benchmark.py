@@ -0,0 +1,175 @@
+"""
+SFTP upload benchmark against a local paramiko SFTP server.
+
+Starts benchmarks/sftp_server.py in a separate process and measures, for ParamikoFileUploadWorker:
+connection setup (transport, key exchange, authentication and first channel), the overhead per file
+on a set of small files, and large-file throughput in each transfer mode ('default' putfo,
+'pipelined', and 'pipelined' over several channels). --latency-ms puts a proxy adding that
+round-trip time in front of the server.
+
+Run from the repository root:
+
+    python -m benchmarks.sftp_benchmark --files 2 --size-mb 256 --latency-ms 40 --output results/sftp.json
+
+Requires paramiko (pip install -r benchmarks/requirements.txt).
+"""
+import argparse
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+from benchmarks.common import MB, make_dataset, Measurement, LatencyProxy, write_report, print_results
+from gms_uploader.modules.upload.connections import SFTPConnectionPool
+from gms_uploader.modules.upload.support_classes import ParamikoFileUploadWorker
+from gms_uploader.modules.upload.progress import ProgressAggregator
+from gms_uploader.modules.upload.checksums import ChecksumStore
+
+USER = 'bench'
+PASSWORD = 'bench'
+
+# name: credentials entries of the transfer mode
+TRANSFER_MODES = {'default': {'sftp_transfer_mode': 'default'},
+                  'pipelined': {'sftp_transfer_mode': 'pipelined'},
+                  'streams': {'sftp_transfer_mode': 'pipelined'}}
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="sftp_benchmark", description=__doc__.split("\n\n")[0])
+    parser.add_argument('--files', type=int, default=2, help="number of large files (default 2)")
+    parser.add_argument('--size-mb', type=float, default=64, help="size of each large file in MB (default 64)")
+    parser.add_argument('--small-files', type=int, default=50,
+                        help="number of small files for the per-file overhead, 0 to skip (default 50)")
+    parser.add_argument('--small-size-kb', type=float, default=64, help="size of each small file in kB (default 64)")
+    parser.add_argument('--kind', choices=['fastq', 'fast5'], default='fastq',
+                        help="gzipped FASTQ (compressible text) or fast5 (random bytes)")
+    parser.add_argument('--transfer-modes', nargs='+', choices=list(TRANSFER_MODES), default=list(TRANSFER_MODES),
+                        help="transfer modes for the large files (default all)")
+    parser.add_argument('--streams', type=int, default=4, help="channels of the 'streams' mode (default 4)")
+    parser.add_argument('--read-buffer-kb', type=int, default=1024, help="sftp_read_buffer_kb (default 1024)")
+    parser.add_argument('--connect-trials', type=int, default=5,
+                        help="number of connections for the setup time, 0 to skip (default 5)")
+    parser.add_argument('--latency-ms', type=float, default=0, help="added round-trip time in ms (default 0)")
+    parser.add_argument('--data-dir', type=Path,
+                        help="where to keep the synthetic files between runs, default a temporary directory")
+    parser.add_argument('--output', type=Path, help="JSON report path")
+    return parser.parse_args(argv)
+
+
+def start_server(root: Path):
+    """ :return: server process, port """
+    server = subprocess.Popen([sys.executable, '-m', 'benchmarks.sftp_server', '--root', str(root),
+                               '--user', USER, '--password', PASSWORD],
+                              stdout=subprocess.PIPE, text=True)
+    line = server.stdout.readline()
+    if not line.strip().isdigit():
+        server.kill()
+        raise RuntimeError("SFTP server did not start")
+
+    return server, int(line)
+
+
+def measure_connect(cred: dict, trials: int) -> Measurement:
+    """ Opens trials new connections, each with its first channel, one after another """
+    with Measurement() as measurement:
+        for n in range(trials):
+            pool = SFTPConnectionPool(cred, f"connect-{n}", 1)
+            try:
+                pool.release(pool.acquire())
+            finally:
+                pool.close()
+
+    return measurement
+
+
+def run_workers(cred: dict, dataset: list, tag: str) -> Measurement:
+    """ Uploads the files one after another on one connection pool, as the UploadEngine does with one slot """
+    pool = SFTPConnectionPool(cred, tag, max(1, int(cred.get('sftp_streams', 1))))
+    progress = ProgressAggregator()
+    checksums = ChecksumStore()
+
+    files = [file for _, sample_files in dataset for file in sample_files]
+    for file in files:
+        progress.register(file.name, file.stat().st_size)
+
+    try:
+        # the first channel opens the connection and creates the tag directory, not part of the transfers
+        pool.release(pool.acquire())
+        with Measurement() as measurement:
+            for file in files:
+                ParamikoFileUploadWorker(cred, tag, file, progress, checksums, pool).run()
+    finally:
+        pool.close()
+
+    return measurement
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+
+    tmp = tempfile.TemporaryDirectory(prefix="gms-bench-")
+    data_dir = args.data_dir if args.data_dir is not None else Path(tmp.name, 'data')
+    root = Path(tmp.name, 'sftp-root')
+    Path(root, 'upload').mkdir(parents=True)
+
+    large = make_dataset(data_dir, f"large-{args.kind}", args.files, 1, int(args.size_mb * MB), args.kind)
+    small = None
+    if args.small_files > 0:
+        small = make_dataset(data_dir, f"small-{args.kind}", args.small_files, 1,
+                             int(args.small_size_kb * 1024), args.kind)
+
+    server, port = start_server(root)
+    proxy = LatencyProxy('127.0.0.1', port, args.latency_ms / 1000) if args.latency_ms > 0 else None
+
+    cred = {'target_label': 'benchmark',
+            'protocol': 'SFTP',
+            'target_host': '127.0.0.1',
+            'port': proxy.port if proxy else port,
+            'usr': USER,
+            'psw': PASSWORD,
+            'base_path': '/upload',
+            'sftp_read_buffer_kb': args.read_buffer_kb}
+
+    results = []
+    stamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+
+    def size_of(dataset):
+        return sum(file.stat().st_size for _, files in dataset for file in files), \
+            sum(len(files) for _, files in dataset)
+
+    try:
+        if args.connect_trials > 0:
+            measurement = measure_connect(cred, args.connect_trials)
+            results.append(measurement.result(args.connect_trials, 0, mode='connect', scenario='setup'))
+
+        if small is not None:
+            nbytes, nfiles = size_of(small)
+            measurement = run_workers(dict(cred, **TRANSFER_MODES['default']), small, f"small-{stamp}")
+            results.append(measurement.result(nfiles, nbytes, mode='default', scenario='small'))
+
+        nbytes, nfiles = size_of(large)
+        for mode in args.transfer_modes:
+            mode_cred = dict(cred, **TRANSFER_MODES[mode])
+            if mode == 'streams':
+                mode_cred['sftp_streams'] = args.streams
+            measurement = run_workers(mode_cred, large, f"{mode}-{stamp}")
+            results.append(measurement.result(nfiles, nbytes, mode=mode, scenario='large'))
+    finally:
+        if proxy is not None:
+            proxy.close()
+        server.terminate()
+        server.wait()
+
+    print_results(results)
+
+    if args.output is not None:
+        params = {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()}
+        write_report(args.output, 'sftp', params, results)
+
+    tmp.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+"""
+Minimal SFTP server on localhost, built on paramiko, serving a local directory with password
+authentication. Used by the SFTP benchmark, which starts it in a separate process:
+
+    python -m benchmarks.sftp_server --root /tmp/sftp-root --user bench --password bench
+
+The port is printed on stdout once the server accepts connections.
+"""
+import argparse
+import os
+import socket
+import sys
+import threading
+from pathlib import Path
+import paramiko
+
+
+class BenchServer(paramiko.ServerInterface):
+    def __init__(self, user: str, password: str):
+        self.user = user
+        self.password = password
+
+    def check_auth_password(self, username, password):
+        if username == self.user and password == self.password:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+
+class LocalSFTPHandle(paramiko.SFTPHandle):
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        try:
+            LocalSFTPServer.set_attributes(self.filename, attr)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+
+class LocalSFTPServer(paramiko.SFTPServerInterface):
+    """ Serves the directory root as / """
+    def __init__(self, server, *args, root: str = '.', **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.root = root
+
+    def _local(self, path) -> str:
+        return os.path.join(self.root, self.canonicalize(path).lstrip('/'))
+
+    def canonicalize(self, path):
+        return os.path.normpath('/' + str(path)).replace('\\', '/')
+
+    @staticmethod
+    def set_attributes(path, attr):
+        if attr._flags & attr.FLAG_PERMISSIONS:
+            os.chmod(path, attr.st_mode)
+        if attr._flags & attr.FLAG_AMTIME:
+            os.utime(path, (attr.st_atime, attr.st_mtime))
+        if attr._flags & attr.FLAG_SIZE:
+            with open(path, 'r+b') as fh:
+                fh.truncate(attr.st_size)
+
+    def list_folder(self, path):
+        local = self._local(path)
+        try:
+            entries = []
+            for name in os.listdir(local):
+                attr = paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(local, name)))
+                attr.filename = name
+                entries.append(attr)
+            return entries
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self._local(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def lstat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.lstat(self._local(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def open(self, path, flags, attr):
+        local = self._local(path)
+        try:
+            fd = os.open(local, flags | getattr(os, 'O_BINARY', 0), 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+        if flags & os.O_WRONLY:
+            mode = 'ab' if flags & os.O_APPEND else 'wb'
+        elif flags & os.O_RDWR:
+            mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+        else:
+            mode = 'rb'
+
+        handle = LocalSFTPHandle(flags)
+        handle.filename = local
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(self._local(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        try:
+            os.rename(self._local(oldpath), self._local(newpath))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(self._local(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def rmdir(self, path):
+        try:
+            os.rmdir(self._local(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def chattr(self, path, attr):
+        try:
+            self.set_attributes(self._local(path), attr)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+
+def serve_connection(sock: socket.socket, host_key, root: str, user: str, password: str):
+    transport = paramiko.Transport(sock)
+    transport.add_server_key(host_key)
+    transport.set_subsystem_handler('sftp', paramiko.SFTPServer, LocalSFTPServer, root=root)
+    transport.start_server(server=BenchServer(user, password))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="sftp_server", description="Local SFTP server for benchmarks.")
+    parser.add_argument('--root', type=Path, required=True, help="directory served as /")
+    parser.add_argument('--port', type=int, default=0, help="port, default any free port")
+    parser.add_argument('--user', default='bench')
+    parser.add_argument('--password', default='bench')
+    args = parser.parse_args(argv)
+
+    args.root.mkdir(parents=True, exist_ok=True)
+    host_key = paramiko.RSAKey.generate(2048)
+
+    server = socket.create_server(('127.0.0.1', args.port))
+    print(server.getsockname()[1], flush=True)
+
+    while True:
+        sock, _ = server.accept()
+        threading.Thread(target=serve_connection,
+                         args=(sock, host_key, str(args.root.resolve()), args.user, args.password),
+                         daemon=True).start()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
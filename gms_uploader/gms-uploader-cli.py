@@ -0,0 +1,299 @@
+"""
+Headless upload for scheduled submissions. Uses the settings saved by GMS-uploader (submitter, lab,
+pseudo_id file, metadata output path, credentials path) and runs the same validation, pseudo_id
+generation and upload as the upload button, without a Qt event loop.
+
+Progress is written to stdout as JSON lines, all other output goes to stderr.
+
+Exit codes:
+    0  all files uploaded, pseudo_ids stored
+    1  upload finished with failed files, pseudo_ids not stored (except for samples completed
+       with --order sample)
+    2  usage, settings or credentials error
+    3  metadata did not pass validation, or the submission was declined
+    4  interrupted, files in flight were completed
+
+Interrupted runs are kept in the upload journal of the metadata output path; --list-resumable
+shows them and --resume TAG sends their remaining files.
+"""
+import sys
+import os
+import json
+import time
+import argparse
+import contextlib
+from pathlib import Path
+import pandas as pd
+import yaml
+from modules.settings.settings import SettingsManager
+from modules.pseudo_id.pseudo_id import PseudoIDManager
+
+from gms_uploader.modules.credentials.credentials import CredManager
+from gms_uploader.modules.extra.auxiliary_functions import combine_csv
+from gms_uploader.modules.seq_files.seq_files import verify_files, extract_metadata_from_filenames
+from gms_uploader.modules.upload.submission import prepare_submission, SubmissionError
+from gms_uploader.modules.upload.engine import UploadEngine, ResumeError
+from gms_uploader.modules.upload.journal import UploadJournal, get_journal_path, RESUMABLE_STATES
+
+
+EXIT_OK = 0
+EXIT_UPLOAD_FAILED = 1
+EXIT_USAGE = 2
+EXIT_INVALID = 3
+EXIT_INTERRUPTED = 4
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="gms-uploader-cli",
+                                     description="Validate and upload sequence data and metadata without the GUI.")
+    parser.add_argument('--session', type=Path,
+                        help="saved metadata file (.pkl) from GMS-uploader")
+    parser.add_argument('--seq', type=Path, nargs='+', default=[],
+                        help="sequence files or directories to add, parsed as in the sequence file dialog")
+    parser.add_argument('--csv', type=Path,
+                        help="metadata csv combined into the samples on internal_lab_id")
+    parser.add_argument('--target',
+                        help="target_label of the credentials to use, default is the target selected in GMS-uploader")
+    parser.add_argument('--sync', dest='sync', action='store_const', const=True, default=None,
+                        help="skip files already at the target, default from 'sync_mode' in the credentials json")
+    parser.add_argument('--no-sync', dest='sync', action='store_const', const=False,
+                        help="upload all files, also those already at the target")
+    parser.add_argument('--order', choices=UploadEngine.QUEUE_ORDERS,
+                        help="order of the sequence files: as in the metadata, largest first, or sample by "
+                             "sample storing each pseudo_id as the sample completes, "
+                             "default from 'queue_order' in the credentials json")
+    parser.add_argument('--bundle', choices=['off', 'tar', 'tar.gz'],
+                        help="send the files of samples with at least 'bundle_min_files' files as one tar "
+                             "archive per sample, default from 'bundle_mode' in the credentials json")
+    parser.add_argument('--limit-mbps', type=float,
+                        help="bandwidth limit in Mbit/s for the whole run, 0 for none, "
+                             "replaces 'bandwidth_limit_mbps' and 'bandwidth_schedule' in the credentials json")
+    parser.add_argument('--accept-stored-lids', action='store_true',
+                        help="upload even if internal_lab_ids are already in the pseudo_id file")
+    parser.add_argument('--progress-interval', type=float, default=5.0,
+                        help="seconds between progress lines, 0 disables them (default 5)")
+    parser.add_argument('--resume', metavar='TAG',
+                        help="continue an interrupted upload from the upload journal, sending only the files "
+                             "not uploaded yet, to the target and with the bundle mode of the original run")
+    parser.add_argument('--list-resumable', action='store_true',
+                        help="list the interrupted uploads in the upload journal and exit")
+
+    args = parser.parse_args(argv)
+
+    if args.session is None and not args.seq and args.resume is None and not args.list_resumable:
+        parser.error("one of --session, --seq, --resume or --list-resumable is required")
+
+    return args
+
+
+class JsonLines:
+    """ Writes one JSON object per line to a stream """
+    def __init__(self, stream):
+        self.stream = stream
+
+    def emit(self, event: str, **fields):
+        fields = dict(event=event, time=time.time(), **fields)
+        self.stream.write(json.dumps(fields, default=str) + "\n")
+        self.stream.flush()
+
+
+def load_dataframe(args, conf: dict) -> pd.DataFrame:
+    """
+    Builds the metadata dataframe from a saved session and/or sequence files, then combines the csv.
+    :return: dataframe
+    """
+    if args.session is not None:
+        df = pd.read_pickle(args.session)
+    else:
+        df = pd.DataFrame(columns=list(conf['model_fields'].keys()))
+
+    if args.seq:
+        files = verify_files(args.seq, conf['seq_files'])
+        new_df = pd.DataFrame(extract_metadata_from_filenames(files, conf['seq_files']))
+        df = df.append(new_df)
+        if df['internal_lab_id'].duplicated().any():
+            raise SubmissionError("Duplicate SampleIDs present in imported data.")
+
+        df = df.fillna('')
+        df.reset_index(drop=True, inplace=True)
+
+    if args.csv is not None:
+        combine_csv(df, args.csv)
+
+    if df.empty:
+        raise SubmissionError("No samples to upload.")
+
+    return df
+
+
+def run_upload(engine: UploadEngine, out: JsonLines, interval: float) -> int:
+    """
+    Runs the engine to completion on this thread.
+    :return: exit code
+    """
+    stats = engine.progress.totals()
+    out.emit('start', tag=engine.tag, target=engine.cred['target_label'], protocol=engine.cred['protocol'],
+             files=len(engine.files()), bytes=stats[1])
+
+    interrupted = False
+    reported = set()
+    last_progress = time.monotonic()
+    engine.start()
+
+    while True:
+        try:
+            events = engine.process_events(timeout=0.5)
+        except KeyboardInterrupt:
+            if interrupted:
+                raise
+            interrupted = True
+            out.emit('interrupt', active=sorted(engine.active))
+            engine.stop()
+            continue
+
+        for event in events:
+            if event[0] == 'finished':
+                filename, error = event[1], event[2]
+                if error is not None:
+                    out.emit('file', file=filename, status='failed', error=str(error))
+                elif engine.progress.is_skipped(filename):
+                    out.emit('file', file=filename, status='skipped')
+                else:
+                    out.emit('file', file=filename, status='uploaded')
+
+                lid = engine.fname2lid[filename]
+                if lid in engine.committed and lid not in reported:
+                    reported.add(lid)
+                    out.emit('sample', internal_lab_id=lid, status='committed')
+
+            elif event[0] == 'retry':
+                out.emit('file', file=event[1], status='retrying', error=str(event[2]), delay=round(event[3], 1))
+
+            elif event[0] == 'paused':
+                out.emit('end', tag=engine.tag, status='interrupted', committed=sorted(engine.committed),
+                         summary=None)
+                return EXIT_INTERRUPTED
+
+            elif event[0] == 'complete':
+                status = 'complete' if event[1] else 'failed'
+                out.emit('end', tag=engine.tag, status=status, failed=engine.failed,
+                         committed=sorted(engine.committed), summary=engine.summaryfile)
+                return EXIT_OK if event[1] else EXIT_UPLOAD_FAILED
+
+        if interval > 0 and time.monotonic() - last_progress >= interval:
+            last_progress = time.monotonic()
+            out.emit('progress', **engine.telemetry.tick())
+
+
+def resume_upload(args, run: dict, settm, conf: dict, out: JsonLines) -> int:
+    """
+    Continues a run from the upload journal.
+    :return: exit code
+    """
+    credm = CredManager(settm)
+    cred = credm.get_value(run['target_label'])
+    if not isinstance(cred, dict):
+        out.emit('error', message=f"No valid credentials for target '{run['target_label']}'.")
+        return EXIT_USAGE
+
+    pidm = PseudoIDManager(conf['tr']['lab_to_code'], settm)
+
+    try:
+        engine = UploadEngine(cred, run['tag'], run['df'], run['metafile'], run['completefile'], pidm,
+                              sync_mode=args.sync, order=args.order, resume=True)
+    except (OSError, ResumeError) as e:
+        out.emit('error', message=f"Upload of tag '{run['tag']}' can not be resumed: {e}")
+        return EXIT_USAGE
+
+    if args.limit_mbps is not None:
+        engine.limiter.set_limit(args.limit_mbps)
+    try:
+        return run_upload(engine, out, args.progress_interval)
+    finally:
+        engine.close()
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    out = JsonLines(sys.stdout)
+
+    # paths given on the command line are relative to the caller, config and resources to the app
+    for name in ['session', 'csv']:
+        if getattr(args, name) is not None:
+            setattr(args, name, getattr(args, name).resolve())
+    args.seq = [path.resolve() for path in args.seq]
+    os.chdir(Path(__file__).resolve().parent)
+
+    with contextlib.redirect_stdout(sys.stderr):
+        with Path('config', 'config.yaml').open(encoding='utf8') as fp:
+            conf = yaml.safe_load(fp)
+
+        try:
+            settm = SettingsManager(conf, headless=True)
+        except ValueError as e:
+            out.emit('error', message=str(e))
+            return EXIT_USAGE
+
+        if args.list_resumable or args.resume is not None:
+            metadata_dir = settm.get_valid_metadata_dir()
+            if metadata_dir is None or not get_journal_path(metadata_dir).is_file():
+                out.emit('error', message="No upload journal in the metadata output path.")
+                return EXIT_USAGE
+
+            journal = UploadJournal(get_journal_path(metadata_dir))
+            try:
+                if args.list_resumable:
+                    for run in journal.resumable_runs():
+                        out.emit('resumable', **run)
+                    return EXIT_OK
+
+                run = journal.get_run(args.resume)
+            except ResumeError as e:
+                out.emit('error', message=f"Upload of tag '{args.resume}' can not be resumed: {e}")
+                return EXIT_USAGE
+            finally:
+                journal.close()
+
+            if run is None or run['state'] not in RESUMABLE_STATES:
+                out.emit('error', message=f"No interrupted upload with tag '{args.resume}'.")
+                return EXIT_USAGE
+
+            return resume_upload(args, run, settm, conf, out)
+
+        credm = CredManager(settm)
+        target = args.target if args.target is not None else credm.get_current_target_label()
+        cred = credm.get_value(target)
+        if not isinstance(cred, dict):
+            out.emit('error', message=f"No valid credentials for target '{target}'.")
+            return EXIT_USAGE
+
+        pidm = PseudoIDManager(conf['tr']['lab_to_code'], settm)
+
+        try:
+            df = load_dataframe(args, conf)
+            submission = prepare_submission(df, conf, settm, pidm,
+                                            confirm=lambda text: args.accept_stored_lids)
+        except SubmissionError as e:
+            out.emit('error', message=str(e), errors=e.errors)
+            return EXIT_INVALID if e.errors else EXIT_USAGE
+
+        if submission is None:
+            out.emit('error', message="Submission declined: internal_lab_id(s) already stored in pseudo_id file "
+                                      "(use --accept-stored-lids), or pseudo_ids could not be generated.")
+            return EXIT_INVALID
+
+        tag, json_file = submission
+        complete_file = Path(conf['upload_complete_file']['filepath'])
+
+        engine = UploadEngine(cred, tag, df, json_file, complete_file, pidm,
+                              sync_mode=args.sync, order=args.order, bundle_mode=args.bundle)
+        if args.limit_mbps is not None:
+            engine.limiter.set_limit(args.limit_mbps)
+        try:
+            return run_upload(engine, out, args.progress_interval)
+        finally:
+            engine.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
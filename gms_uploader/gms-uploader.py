@@ -11,19 +11,24 @@ from gms_uploader.modules.models.pandasmodel import PandasModel
 from gms_uploader.modules.delegates.delegates import ComboBoxDelegate, \
     DateAutoCorrectDelegate, AgeDelegate, IconCheckBoxDelegate
 from gms_uploader.modules.fx.fx_manager import FxManager
-from gms_uploader.modules.dialogs.dialogs import ValidationDialog, MsgAlert, MsgOKCancel
+from gms_uploader.modules.dialogs.dialogs import ValidationDialog, MsgAlert, MsgOKCancel, MsgResume
 from gms_uploader.modules.models.sortfilterproxymodel import MultiSortFilterProxyModel
-from gms_uploader.modules.extra.auxiliary_functions import to_list, get_pd_row_index, \
-    date_validate, age_validate, add_gridlayout_row, update_df
+from gms_uploader.modules.extra.auxiliary_functions import to_list, \
+    date_validate, age_validate, add_gridlayout_row, update_df, combine_csv
 from gms_uploader.modules.credentials.credentials import CredManager
-from gms_uploader.modules.validate.validate import validate
+from gms_uploader.modules.seq_files.importer import SeqFileImporter
+from gms_uploader.modules.seq_files.index import get_index_path
+from gms_uploader.modules.seq_files.browser import SampleBrowser
+from gms_uploader.modules.seq_files.watcher import RunWatcher
+from gms_uploader.modules.upload.submission import prepare_submission, SubmissionError
 from gms_uploader.modules.upload.uploader import Uploader
+from gms_uploader.modules.upload.engine import ResumeError
+from gms_uploader.modules.upload.journal import UploadJournal, get_journal_path, RUN_DISCARDED
 import pandas as pd
 from datetime import datetime
 from pathlib import Path
 import yaml
 import json
-import csv
 from gms_uploader.ui.mw import Ui_MainWindow
 import qdarktheme
 import resources
@@ -60,6 +65,9 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.pidm = PseudoIDManager(self.conf['tr']['lab_to_code'], self.settm)
 
         self.fx_config = None
+        self.seq_importer = None
+        self.pending_imports = []
+        self.run_watcher = None
 
         self.tableView_columns = list(self.conf['model_fields'].keys())
 
@@ -110,6 +118,8 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.ui_init()
         self.setup_complete = True
 
+        QTimer.singleShot(0, self.offer_resume)
+
     # setup and init-related functions
 
     def ui_init(self):
@@ -176,6 +186,8 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.pushButton_drop.clicked.connect(self.drop_rows)
         self.pushButton_clear.clicked.connect(self.clear_table)
         self.action_select_seq_files.triggered.connect(self.get_seq_files)
+        self.action_browse_samples.triggered.connect(self.browse_samples)
+        self.action_watch_runs.toggled.connect(self.set_watch_runs)
         self.action_upload_meta_seqs.triggered.connect(self.upload)
         self.action_save_meta.triggered.connect(self.save_metadata_file)
         self.action_open_meta.triggered.connect(self.open_metadata_file)
@@ -190,6 +202,8 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.action_show_prefs.setIcon(QIcon(':/cog'))  #:/icons/AppIcons/cog-outline_mdi.svg'))
         self.action_upload_meta_seqs.setIcon(QIcon(':/icons/AppIcons/tray-arrow-up_mdi.svg'))
         self.action_select_seq_files.setIcon(QIcon(':/icons/AppIcons/folder-open-outline-dna_mdi.svg'))
+        self.action_browse_samples.setIcon(QIcon(':/icons/AppIcons/dna_mdi.svg'))
+        self.action_watch_runs.setIcon(QIcon(':/icons/StyleLightIcons/restart_alt_24dp.svg'))
         self.action_import_csv.setIcon(QIcon(':/import-csv'))  #':/icons/AppIcons/import-csv_own.svg'))
         self.action_import_fx.setIcon(QIcon(':/import-fx'))  #':/icons/AppIcons/content-import-fx_own.svg'))
         self.action_paste_fx.setIcon(QIcon(':/paste-fx')) #':/icons/AppIcons/content-paste-fx_own.svg'))
@@ -483,118 +497,165 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         else:
             df.loc[insert_loc + 1] = row
 
-    def verify_files(self, files):
+    def add_files_metadata_to_model(self, data, merge_lids=()):
         """
-        Ensures that all filespaths in a list exist and have correct suffixes, corresponding to
-        raw sequence data files. Only correct files are returned. If a path is a dir, paths for files in that directory are listed,
-        verified and returned.
-        :param files: list of filepaths and/or dirpaths
-        :return: list of verified filepaths
+        Creates new pandas df, from files and metadata, check for duplicates
+        and merge with existing df dataset and create new model.
+        :param data: list of dicts containing metadata and filenames
+        :param merge_lids: internal_lab_ids whose files are added to the existing row instead, if
+                           they are in the same seq_path
+        :return: list of internal_lab_ids left out as duplicates
         """
-        verified_files = []
-        for file in files:
-            f = Path(file)
-            if f.is_dir():
-                for type in self.conf['seq_files']:
-                    ext = self.conf['seq_files'][type]['ext']
-                    for fp in f.rglob(ext):
-                        if Path(fp).exists():
-                            verified_files.append(fp)
-
+        new_data = []
+        duplicates = []
+        lids = set(self.df['internal_lab_id'])
+        for row in data:
+            lid = row['internal_lab_id']
+            if lid in merge_lids and self.merge_seq_files(lid, row):
+                continue
+
+            if lid in lids:
+                duplicates.append(lid)
             else:
-                for type in self.conf['seq_files']:
-                    ext = self.conf['seq_files'][type]['ext']
-                    if f.match(ext) and f.exists():
-                        verified_files.append(f)
-
-        return verified_files
-
-    def extract_metadata_from_filenames(self, files):
-        """
-        Extract metadata from sequence data filenames
-        :param files: list of filepaths
-        :return: list of dicts with metadata from filenames
-        """
-
-        _data = {}
-        for file in files:
-            seq_path = file.parent
-            filename = file.name
-            filename_obj = Path(filename)
+                new_data.append(row)
+                lids.add(lid)
 
-            sample = filename.split('_')[0]
+        new_df = pd.DataFrame(new_data)
 
-            if sample not in _data:
-                _data[sample] = {}
-                _data[sample]['seq_path'] = str(seq_path)
-
-            if filename_obj.match(self.conf['seq_files']['fastq_gz']['ext']):
-
-                f = file.stem.split('.')[0]
-                lane = f.split('_')[-1]
+        if not new_df.empty:
+            self.df = self.df.append(new_df)
+            self.df = self.df.fillna('')
+            self.rem_tb_bkg()
+            self.set_datastatus_empty(False)
 
-                _data[sample]['lane'] = lane
+        if data:
+            self.update_model()
 
-                if 'fastq' not in _data[sample]:
-                    _data[sample]['fastq'] = []
+        return duplicates
 
-                fastq_list = _data[sample]['fastq']
-                fastq_list.append(filename)
+    def merge_seq_files(self, lid, row) -> bool:
+        """
+        Adds the sequence data files of row to the existing row of sample lid. Files are stored
+        by name under one seq_path per sample, so files from another directory are not merged.
+        :param lid: internal_lab_id
+        :param row: dict containing metadata and filenames
+        :return: True if merged, False if row has another seq_path
+        """
+        i_row = list(self.df['internal_lab_id']).index(lid)
+        if self.df.iat[i_row, self.df.columns.get_loc('seq_path')] != row.get('seq_path'):
+            return False
 
-            elif filename_obj.match(self.conf['seq_files']['fast5']['ext']):
-                if 'fast5' not in _data[sample]:
-                    _data[sample]['fast5'] = []
+        for key in self.conf['seq_files']:
+            for field in self.conf['seq_files'][key]['fields']:
+                if row.get(field):
+                    i_col = self.df.columns.get_loc(field)
+                    current = self.df.iat[i_row, i_col]
+                    current = current if isinstance(current, list) else []
+                    self.df.iat[i_row, i_col] = sorted(current + row[field])
 
-                fast5_list = _data[sample]['fast5']
-                fast5_list.append(filename)
+        return True
 
-        filename_metadata = []
-        for sample in _data:
-            row = dict()
-            row['mark'] = 0 # add mark column
-            row['internal_lab_id'] = sample
-            for key in _data[sample]:
-                value = _data[sample][key]
-                if isinstance(value, list):
-                    sorted_files = sorted(value)
-                    row[key] = sorted_files
-                else:
-                    row[key] = value
+    def import_seq_files(self, files):
+        """
+        Scans files and directories for sequence data on a background thread. Samples are added
+        to the model batch by batch while a progress dialog is shown; cancelling removes the
+        samples added by the import.
+        :param files: list of filepaths and/or dirpaths
+        :return: None
+        """
+        if self.seq_importer is not None:
+            self.pending_imports.append(files)
+            return
+
+        self.seq_importer = SeqFileImporter(files, self.conf['seq_files'])
+        self.imported_lids = set()
+        self.import_duplicates = []
+
+        self.import_progress = QProgressDialog("Scanning for sequence data files...", "Cancel", 0, 0, self)
+        self.import_progress.setWindowTitle("Import sequence data")
+        self.import_progress.setWindowModality(Qt.WindowModal)
+        self.import_progress.setMinimumDuration(500)
+        self.import_progress.canceled.connect(self.seq_importer.cancel)
+
+        self.import_timer = QTimer(self)
+        self.import_timer.setInterval(200)
+        self.import_timer.timeout.connect(self.poll_import)
+
+        self.seq_importer.start()
+        self.import_timer.start()
+
+    def poll_import(self):
+        for event in self.seq_importer.process_events():
+            if event[0] == 'samples':
+                rows = event[1]
+                lids = set(self.df['internal_lab_id'])
+                duplicates = self.add_files_metadata_to_model(rows, merge_lids=self.imported_lids)
+                self.import_duplicates.extend(duplicates)
+                self.imported_lids.update(set(self.df['internal_lab_id']) - lids)
+
+            elif event[0] == 'progress':
+                _, directories, files, samples = event
+                self.import_progress.setLabelText(f"Scanning for sequence data files...\n"
+                                                  f"{directories} directories, {files} files, "
+                                                  f"{samples} samples")
+
+            elif event[0] == 'finished':
+                self.finish_import(event[1], event[2])
+
+    def finish_import(self, cancelled, error):
+        self.import_timer.stop()
+        self.import_progress.reset()
+        self.import_progress.deleteLater()
+        self.seq_importer = None
+
+        if cancelled and self.imported_lids:
+            self.df = self.df[~self.df['internal_lab_id'].isin(self.imported_lids)]
+            self.update_model()
+            if self.df.empty:
+                self.set_datastatus_empty(True)
 
-            filename_metadata.append(row)
+        elif error is not None:
+            msg = MsgAlert(f"Import of sequence data failed: {error}")
+            msg.exec()
 
-        return filename_metadata
+        if self.import_duplicates and not cancelled:
+            msg_box = QMessageBox()
+            msg_box.setText("Duplicate SampleIDs present in imported data.")
+            msg_box.setDetailedText("\n".join(sorted(set(self.import_duplicates))))
+            msg_box.exec()
 
-    def find_duplicates(self, df1, df2):
-        """
-        Checks if the same internal_lab_id are present in two dataframes
-        :param df1: dataframe1
-        :param df2: dataframe2
-        :return: Bool
-        """
-        df3 = df1.append(df2)
-        return df3['internal_lab_id'].duplicated().any()
+        if self.pending_imports:
+            self.import_seq_files(self.pending_imports.pop(0))
 
-    def add_files_metadata_to_model(self, data):
+    def set_watch_runs(self, checked):
         """
-        Creates new pandas df, from files and metadata, check for duplicates
-        and merge with existing df dataset and create new model.
-        :param data: list of dicts containing metadata and filenames
+        Starts or stops watching seq_base_path for new run folders. The samples of a run are
+        imported once its folder has stopped growing. Watch mode is off at every start.
+        :param checked: action state
         :return: None
         """
-        new_df = pd.DataFrame(data)
+        if not checked:
+            if self.run_watcher is not None:
+                self.run_watcher.stop()
+                self.run_watcher.deleteLater()
+                self.run_watcher = None
+            return
 
-        if not new_df.empty:
-            if not self.find_duplicates(self.df, new_df):
-                self.df = self.df.append(new_df)
-                self.df = self.df.fillna('')
-                self.update_model()
-                self.rem_tb_bkg()
-                self.set_datastatus_empty(False)
-            else:
-                msg_box = QMessageBox()
-                msg_box.setText("Duplicate SampleIDs present in imported data.")
-                msg_box.exec()
+        p_str = self.settm.get_value('entered_value', 'seq_base_path')
+        if not p_str or not Path(p_str).is_dir():
+            msg = MsgAlert("Set a valid seq_base_path in the preferences to watch for new runs.")
+            msg.exec()
+            self.action_watch_runs.setChecked(False)
+            return
+
+        self.run_watcher = RunWatcher(Path(p_str), self.conf['seq_files'], self.conf.get('watch_runs'), self)
+        self.run_watcher.status_changed.connect(self.statusBar().showMessage)
+        self.run_watcher.run_completed.connect(self.stage_run)
+        self.run_watcher.start()
+
+    def stage_run(self, folder):
+        self.statusBar().showMessage(f"importing run {Path(folder).name}", 10000)
+        self.import_seq_files([folder])
 
     # set path functions
 
@@ -1006,78 +1067,76 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         if not isinstance(cred, dict):
             return False
 
-        metadata_dir = self.settm.get_valid_metadata_dir()
-        if metadata_dir is None:
-            msg = MsgAlert("Metadata output path is not valid.")
-            msg.exec()
-            return False
-
-        pseudo_id_file = self.pidm.get_file()
-        if pseudo_id_file is None:
-            msg = MsgAlert("Path for pseudo_id file is not valid.")
-            msg.exec()
+        try:
+            submission = prepare_submission(self.df, self.conf, self.settm, self.pidm, confirm=self.confirm_lids)
+        except SubmissionError as e:
+            if e.errors:
+                v_dialog = ValidationDialog(e.errors)
+                v_dialog.exec()
+            else:
+                msg = MsgAlert(str(e))
+                msg.exec()
             return False
 
-        if not self.pidm.validate_lab_code():
-            msg = MsgAlert("pseudo_id file is not empty and lab_code does not "
-                           "exist in pseudo_id file. lab_code has been changed. "
-                           "Exiting.")
-            msg.exec()
+        if submission is None:
             return False
 
+        tag, json_file = submission
+        complete_file = Path(self.conf['upload_complete_file']['filepath'])
 
-        self.df['lab'] = self.settm.get_value('select_single', 'lab')
-        self.df['host'] = self.settm.get_value('select_single', 'host')
-        self.df['seq_technology'] = self.settm.get_value('select_single', 'seq_technology')
-
-        df2 = self.df.fillna('')
-        errors = validate(df2)
-
-        if errors:
-            v_dialog = ValidationDialog(errors)
-            v_dialog.exec()
-            return False
-
-        self.df['lab_code'] = self.df['lab'].apply(lambda x: self.conf['tr']['lab_to_code'][x])
-        self.df['region_code'] = self.df['region'].apply(lambda x: self.conf['tr']['region_to_code'][x])
-
-        lids = list(self.df['internal_lab_id'])
-
-        print(f"validate lids: {self.pidm.validate_lids(lids)}")
-
-        if not self.pidm.validate_lids(lids):
-            msg = MsgOKCancel("internal_lab_id(s) already stored in pseudo_id file.\n"
-                              "Continue to upload anyway?")
-            ret = msg.exec()
-
-            if ret != QMessageBox.Ok:
-                return False
-
-        pseudo_ids = self.pidm.generate_pids_from_lids(self.df['internal_lab_id'].tolist())
-
-        print(pseudo_ids)
-
-        if pseudo_ids is None:
-            return False
-
-        self.df['pseudo_id'] = pseudo_ids
-
-        meta_fields = [field for field in self.conf['model_fields'] if self.conf['model_fields'][field]['to_meta']]
-        df_submit = self.df[meta_fields]
-
-        now = datetime.now()
-        tag = now.strftime("%Y-%m-%dT%H.%M.%S")
-
-        json_file = Path(metadata_dir, tag + "_meta.json")
+        uploader = Uploader(cred, tag, self.df, json_file, complete_file, self.pidm)
+        uploader.exec()
 
-        with open(json_file, 'w', encoding='utf-8') as outfile:
-            df_submit.to_json(outfile, orient="records", force_ascii=False)
+    def offer_resume(self):
+        """
+        Offers to resume each upload in the journal of the metadata output path that was interrupted,
+        crashed or ended with failed files. Discarded runs are not offered again.
+        """
+        metadata_dir = self.settm.get_valid_metadata_dir()
+        if metadata_dir is None or not get_journal_path(metadata_dir).is_file():
+            return
+
+        journal = UploadJournal(get_journal_path(metadata_dir))
+        try:
+            for run in journal.resumable_runs():
+                msg = MsgResume(f"Upload of tag {run['tag']} to {run['target_label']} was not completed,\n"
+                                f"{run['finished'] or 0} of {run['files']} files were uploaded.\n"
+                                f"Resume it now? Only the remaining files are sent.")
+                answer = msg.exec()
+                if answer == QMessageBox.Yes:
+                    try:
+                        stored = journal.get_run(run['tag'])
+                    except ResumeError as e:
+                        msg = MsgAlert(f"Upload of tag {run['tag']} can not be resumed: {e}")
+                        msg.exec()
+                        continue
+                    self.resume_upload(stored)
+                elif answer == QMessageBox.Discard:
+                    journal.set_run_state(run['tag'], RUN_DISCARDED)
+        finally:
+            journal.close()
+
+    def resume_upload(self, run: dict):
+        cred = self.credm.get_value(run['target_label'])
+        if not isinstance(cred, dict):
+            msg = MsgAlert(f"No valid credentials for target {run['target_label']}.")
+            msg.exec()
+            return
 
-        complete_file = Path(self.conf['upload_complete_file']['filepath'])
+        try:
+            uploader = Uploader(cred, run['tag'], run['df'], run['metafile'], run['completefile'], self.pidm,
+                                resume=True)
+        except (OSError, ResumeError) as e:
+            msg = MsgAlert(f"Upload of tag {run['tag']} can not be resumed: {e}")
+            msg.exec()
+            return
 
-        uploader = Uploader(cred, tag, self.df, json_file, complete_file, self.pidm)
         uploader.exec()
 
+    def confirm_lids(self, text):
+        msg = MsgOKCancel(text)
+        return msg.exec() == QMessageBox.Ok
+
     def save_metadata_file(self):
         now = datetime.now()
         dt_str = now.strftime("%Y-%m-%dT%H.%M.%S")
@@ -1140,9 +1199,24 @@ class MainWindow(QMainWindow, Ui_MainWindow):
                                            "Sequence files (*.fast5 *.fastq.gz *.fastq *.fq.gz *.fq",
                                            options=QFileDialog.DontUseNativeDialog)
 
-        verified_files = self.verify_files(files)
-        file_metadata = self.extract_metadata_from_filenames(verified_files)
-        self.add_files_metadata_to_model(file_metadata)
+        if files:
+            self.import_seq_files(files)
+
+    def browse_samples(self):
+        """
+        Opens the sample browser on the seq_base_path, listed from the local index, and imports
+        the files of the selected samples.
+        """
+        p_str = self.settm.get_value('entered_value', 'seq_base_path')
+        if not p_str or not Path(p_str).is_dir():
+            msg = MsgAlert("Set a valid seq_base_path in the preferences to browse samples.")
+            msg.exec()
+            return
+
+        index_dir = Path(QStandardPaths.writableLocation(QStandardPaths.GenericCacheLocation), __title__)
+        browser = SampleBrowser(get_index_path(index_dir), Path(p_str).resolve(), self.conf['seq_files'])
+        if browser.exec() == QDialog.Accepted and browser.selected_files:
+            self.import_seq_files(browser.selected_files)
 
     def get_csv_file_combine(self):
 
@@ -1162,17 +1236,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
 
         if filepath:
-
-            colnames = list(self.df.columns)
-
-            with open(filepath, encoding='utf-8-sig') as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    r = get_pd_row_index(self.df, row['internal_lab_id'], 'internal_lab_id')
-                    for key, value in row.items():
-                        if key in colnames:
-                            self.df.at[r, key] = value
-
+            combine_csv(self.df, filepath)
             self.update_model()
 
     def str_to_pd(self):
@@ -1245,9 +1309,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             for url in event.mimeData().urls():
                 files.append(str(url.toLocalFile()))
 
-            verified_files = self.verify_files(files)
-            file_metadata = self.extract_metadata_from_filenames(verified_files)
-            self.add_files_metadata_to_model(file_metadata)
+            self.import_seq_files(files)
 
         else:
             event.ignore()
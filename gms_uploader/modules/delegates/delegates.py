@@ -1,5 +1,5 @@
 from PySide6.QtWidgets import QStyledItemDelegate, QLineEdit, QComboBox, QCompleter, QStyle, \
-    QStyleOptionButton, QApplication, QItemDelegate
+    QStyleOptionButton, QStyleOptionProgressBar, QApplication, QItemDelegate
 from PySide6.QtCore import Qt, QEvent, QPoint, QRect, QSize
 from PySide6.QtGui import QIntValidator, QIcon
 from datetime import datetime
@@ -246,3 +246,31 @@ class IconCheckBoxDelegate(QStyledItemDelegate):
         The user wanted to change the old state in the opposite.
         '''
         model.setData(index, 1 if int(index.data()) == 0 else 0, Qt.EditRole)
+
+
+class ProgressBarDelegate(QStyledItemDelegate):
+    """
+    Paints the percentage (0-100) in a cell as a progress bar. Unlike a QProgressBar set with
+    setCellWidget, nothing is created per row, so views with thousands of rows stay fast.
+    """
+    def __init__(self, parent=None):
+        super(ProgressBarDelegate, self).__init__(parent)
+
+    def createEditor(self, parent, option, index):
+        return None
+
+    def paint(self, painter, option, index):
+        value = index.data(Qt.DisplayRole)
+
+        _bar = QStyleOptionProgressBar()
+        _bar.rect = option.rect.adjusted(1, 2, -1, -2)
+        _bar.state = option.state | QStyle.State_Horizontal
+        _bar.minimum = 0
+        _bar.maximum = 100
+        _bar.progress = int(value or 0)
+        _bar.text = f"{_bar.progress}%"
+        _bar.textVisible = True
+        _bar.textAlignment = Qt.AlignRight | Qt.AlignVCenter
+
+        style = option.widget.style() if option.widget is not None else QApplication.style()
+        style.drawControl(QStyle.CE_ProgressBar, _bar, painter, option.widget)
@@ -47,3 +47,14 @@ class MsgOKCancel(QMessageBox):
 
 
 
+class MsgResume(QMessageBox):
+    def __init__(self, msg):
+        super().__init__()
+        self.setMinimumWidth(700)
+        self.setIcon(QMessageBox.Question)
+        self.setStandardButtons(QMessageBox.Yes | QMessageBox.Discard | QMessageBox.Cancel)
+        self.button(QMessageBox.Yes).setText("Resume")
+        self.button(QMessageBox.Cancel).setText("Later")
+        self.setText(msg)
+        self.setWindowTitle("Interrupted upload")
+        self.setWindowIcon(QIcon(':/img/GMS-logo.png'))
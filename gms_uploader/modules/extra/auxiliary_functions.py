@@ -1,3 +1,4 @@
+import csv
 from datetime import datetime
 from PySide6.QtWidgets import *
 
@@ -154,3 +155,27 @@ def update_df(df_old, df_new, key='internal_lab_id'):
 
 
 
+
+
+def combine_csv(df, filepath):
+    """
+    Updates rows in a dataframe with values from a metadata csv file, matched on internal_lab_id.
+    Only columns present in the dataframe are used, csv rows for unknown samples are ignored.
+    :param df: pandas dataframe, updated in place
+    :param filepath: path to csv file
+    :return: dataframe
+    """
+    colnames = list(df.columns)
+
+    with open(filepath, encoding='utf-8-sig') as csvfile:
+        reader = csv.DictReader(csvfile)
+        for row in reader:
+            r = get_pd_row_index(df, row['internal_lab_id'], 'internal_lab_id')
+            if r is None:
+                continue
+
+            for key, value in row.items():
+                if key in colnames:
+                    df.at[r, key] = value
+
+    return df
@@ -0,0 +1,90 @@
+from array import array
+from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex
+
+
+class UploadTableModel(QAbstractTableModel):
+    """
+    Files of an upload run for the Uploader dialog: name, size, status (rate, skipped, failed,
+    retry) and progress, held in flat lists and an array rather than one item or widget per cell.
+    The progress column holds the percentage and is painted by ProgressBarDelegate. Updates are
+    applied in batches and announced with one dataChanged per batch, so the view only repaints
+    the visible rows.
+    """
+    COLUMNS = ["file", "size", "rate", "progress"]
+    PROGRESS_COLUMN = 3
+
+    def __init__(self, names: list, sizes: list, parent=None):
+        super().__init__(parent)
+        self._names = list(names)
+        self._sizes = [str(round(size / (1024 * 1024), 2)) + " MB" for size in sizes]
+        self._status = [""] * len(self._names)
+        self._tooltips = [None] * len(self._names)
+        self._progress = array('b', [0] * len(self._names))
+        self._rows = {name: row for row, name in enumerate(self._names)}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._names)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.COLUMNS[section]
+
+        return None
+
+    def flags(self, index):
+        return Qt.ItemIsEnabled
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        row = index.row()
+        column = index.column()
+
+        if role == Qt.DisplayRole:
+            if column == 0:
+                return self._names[row]
+            if column == 1:
+                return self._sizes[row]
+            if column == 2:
+                return self._status[row]
+            if column == self.PROGRESS_COLUMN:
+                return self._progress[row]
+
+        if role == Qt.ToolTipRole and column == 2:
+            return self._tooltips[row]
+
+        if role == Qt.TextAlignmentRole and column == 1:
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+
+        return None
+
+    def set_status(self, name: str, text: str, tooltip: str = None):
+        row = self._rows[name]
+        self._status[row] = text
+        self._tooltips[row] = tooltip
+        index = self.index(row, 2)
+        self.dataChanged.emit(index, index)
+
+    def update_progress(self, percentages: dict, statuses: dict):
+        """
+        Applies a batch of progress changes.
+        :param percentages: dict of filename to percentage
+        :param statuses: dict of filename to status text, for the files whose text changed
+        """
+        rows = []
+        for name, pct in percentages.items():
+            row = self._rows[name]
+            self._progress[row] = pct
+            rows.append(row)
+
+        for name, text in statuses.items():
+            row = self._rows[name]
+            self._status[row] = text
+            rows.append(row)
+
+        if rows:
+            self.dataChanged.emit(self.index(min(rows), 2), self.index(max(rows), self.PROGRESS_COLUMN))
@@ -87,9 +87,7 @@ class PseudoIDManager:
                 pids.append(self._mk_pid(i))
 
         else:
-            last_row = self._df.iloc[-1]
-
-            first_num = last_row['pid_num'] + 1
+            first_num = int(self._df['pid_num'].max()) + 1
             last_num = first_num + size
 
             for i in range(first_num, last_num):
@@ -130,6 +128,38 @@ class PseudoIDManager:
             print(self._df)
             self._df.to_csv(self._file, index=False)
 
+    def check_pidlids(self, pidlids: list, tag: str):
+        """
+        Checks pseudo_ids generated for an upload against the pseudo_id file, as read now, e.g.
+        before an interrupted upload is resumed
+        :param pidlids: list of pseudo_id and internal_lab_id tuples (pseudo_id, internal_lab_id)
+        :param tag: tag string of the upload
+        :return: list of internal_lab_ids already stored with their pseudo_id for this tag, and list
+                 of pseudo_ids stored for other samples or tags
+        """
+        self._read_csv()
+        self._set_lids()
+        self._set_pids()
+
+        stored = []
+        taken = []
+        if self._df is None:
+            return stored, taken
+
+        rows = {}
+        for _, row in self._df.iterrows():
+            rows.setdefault(str(row['pseudo_id']), []).append((str(row['internal_lab_id']), str(row['tag'])))
+
+        for pid, lid in pidlids:
+            if str(pid) not in rows:
+                continue
+            if rows[str(pid)] == [(str(lid), str(tag))]:
+                stored.append(lid)
+            else:
+                taken.append(pid)
+
+        return stored, taken
+
     def validate_lab_code(self) -> bool:
 
         if self._df is None:
@@ -190,8 +220,7 @@ class PseudoIDManager:
             return first_pid
         else:
             print("df is nonempty")
-            last_row = self._df.iloc[-1]
-            num = last_row['pid_num'] + 1
+            num = int(self._df['pid_num'].max()) + 1
             first_pid = self._mk_pid(num)
             return first_pid
 
@@ -0,0 +1,147 @@
+import queue
+import threading
+from datetime import datetime
+from pathlib import Path
+from PySide6.QtCore import Qt, QTimer, QSortFilterProxyModel
+from PySide6.QtGui import QIcon, QStandardItemModel, QStandardItem
+from PySide6.QtWidgets import QDialog, QAbstractItemView, QHeaderView
+from gms_uploader.modules.seq_files.index import SeqFileIndex
+from gms_uploader.ui.sample_browser_dialog import Ui_Dialog
+import resources
+
+
+class SampleBrowser(QDialog, Ui_Dialog):
+    """
+    Lists the samples under the data root from the SeqFileIndex, so that the dialog opens without
+    waiting on the file share. The index is refreshed on a background thread while the dialog is
+    open, and the list is reloaded when the refresh changed anything. After the dialog is accepted,
+    selected_files holds the files of the selected samples.
+    """
+    COLUMNS = ["sample", "files", "size (MB)", "lanes", "seq_path", "modified"]
+
+    def __init__(self, index_path: Path, root: Path, seq_files_conf: dict):
+        super(SampleBrowser, self).__init__()
+        self.setupUi(self)
+        self.setWindowTitle("Browse samples")
+        self.setWindowIcon(QIcon(':/img/GMS-logo.png'))
+
+        self.index_path = index_path
+        self.root = root
+        self.seq_files_conf = seq_files_conf
+        self.index = SeqFileIndex(index_path, seq_files_conf)
+        self.selected_files = []
+
+        self.model = QStandardItemModel(0, len(self.COLUMNS), self)
+        self.model.setHorizontalHeaderLabels(self.COLUMNS)
+        self.proxy = QSortFilterProxyModel(self)
+        self.proxy.setSourceModel(self.model)
+        self.proxy.setFilterCaseSensitivity(Qt.CaseInsensitive)
+        self.proxy.setFilterKeyColumn(0)
+
+        self.label_root.setText(f"{root}")
+        self.tableView.setModel(self.proxy)
+        self.tableView.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.tableView.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.tableView.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.tableView.setSortingEnabled(True)
+        self.tableView.sortByColumn(0, Qt.AscendingOrder)
+        self.tableView.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.tableView.horizontalHeader().setStretchLastSection(True)
+
+        self.lineEdit_filter.textChanged.connect(self.proxy.setFilterFixedString)
+        self.tableView.doubleClicked.connect(self.import_selected)
+        self.pushButton_import.clicked.connect(self.import_selected)
+        self.pushButton_close.clicked.connect(self.reject)
+
+        self.load()
+        self.tableView.resizeColumnsToContents()
+
+        self.refresh_cancelled = threading.Event()
+        self.refresh_result = queue.Queue()
+        self.refresh_thread = threading.Thread(target=self.refresh, daemon=True)
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(200)
+        self.refresh_timer.timeout.connect(self.poll_refresh)
+
+        last = self.index.last_refresh(root)
+        self.set_status("refreshing index..." if last is None else
+                        f"index of {datetime.fromtimestamp(last):%Y-%m-%d %H:%M}, refreshing...")
+        self.refresh_thread.start()
+        self.refresh_timer.start()
+
+    def load(self):
+        """ Fills the table from the index, keeping the selection """
+        selected = self.selected_samples()
+
+        self.model.removeRows(0, self.model.rowCount())
+        for sample in self.index.samples(self.root):
+            row = [QStandardItem(sample['sample'])]
+            for value in [sample['files'], round(sample['size'] / (1024 * 1024), 1)]:
+                item = QStandardItem()
+                item.setData(value, Qt.DisplayRole)
+                row.append(item)
+            row.append(QStandardItem(sample['lanes'] or ''))
+            seq_path = sample['seq_path'] if sample['dirs'] == 1 else f"{sample['seq_path']} (+{sample['dirs'] - 1})"
+            row.append(QStandardItem(seq_path))
+            row.append(QStandardItem(f"{datetime.fromtimestamp(sample['mtime']):%Y-%m-%d %H:%M}"))
+            self.model.appendRow(row)
+
+        selection = self.tableView.selectionModel()
+        for i in range(self.proxy.rowCount()):
+            index = self.proxy.index(i, 0)
+            if index.data() in selected:
+                selection.select(index, selection.Select | selection.Rows)
+
+    def selected_samples(self) -> set:
+        return {index.data() for index in self.tableView.selectionModel().selectedRows(0)}
+
+    def set_status(self, text: str):
+        self.label_status.setText(f"{self.model.rowCount()} samples, {text}")
+
+    def refresh(self):
+        """ Runs on the refresh thread, with its own index connection """
+        index = SeqFileIndex(self.index_path, self.seq_files_conf)
+        try:
+            result = index.refresh(self.root, self.refresh_cancelled)
+        except Exception as e:
+            result = {'error': str(e)}
+        finally:
+            index.close()
+
+        self.refresh_result.put(result)
+
+    def poll_refresh(self):
+        try:
+            result = self.refresh_result.get_nowait()
+        except queue.Empty:
+            return
+
+        self.refresh_timer.stop()
+        if 'error' in result:
+            self.set_status(f"refresh failed: {result['error']}")
+            return
+
+        if result['rescanned'] or result['removed']:
+            self.load()
+
+        if result['failed']:
+            self.set_status(f"index incomplete, {result['failed']} directories could not be read, "
+                            f"{result['rescanned']} rescanned")
+            return
+
+        self.set_status(f"index up to date, {result['directories']} directories, "
+                        f"{result['rescanned']} rescanned")
+
+    def import_selected(self):
+        samples = self.selected_samples()
+        if not samples:
+            return
+
+        self.selected_files = self.index.sample_files(self.root, samples)
+        self.accept()
+
+    def done(self, result):
+        self.refresh_cancelled.set()
+        self.refresh_timer.stop()
+        self.index.close()
+        super().done(result)
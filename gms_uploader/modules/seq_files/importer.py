@@ -0,0 +1,93 @@
+import queue
+import threading
+import time
+from gms_uploader.modules.seq_files.scanner import SeqFileScanner
+from gms_uploader.modules.seq_files.seq_files import extract_metadata_from_filenames
+
+
+class SeqFileImporter:
+    """
+    Finds sequence data files and groups them into samples on a background thread, so that the
+    main window stays responsive while large run directories are scanned. Like the UploadEngine it
+    does not depend on Qt; results are put on a queue and collected with process_events:
+
+        ('samples', rows)                          rows as from extract_metadata_from_filenames
+        ('progress', directories, files, samples)  counts so far
+        ('finished', cancelled, error)             error is None or a message
+
+    Samples are sent in batches, at most every BATCH_INTERVAL seconds, with one row per sample and
+    directory. A sample whose files are spread over several directories comes in more than one row,
+    with the same internal_lab_id; as a row has a single seq_path, the caller can not merge such
+    rows and reports them as duplicates.
+    """
+    BATCH_INTERVAL = 0.5
+
+    def __init__(self, paths, seq_files_conf: dict):
+        """
+        :param paths: list of filepaths and/or dirpaths
+        :param seq_files_conf: 'seq_files' section of the config
+        """
+        self.paths = list(paths)
+        self.seq_files_conf = seq_files_conf
+        self.scanner = SeqFileScanner(seq_files_conf)
+        self.events = queue.Queue()
+        self.files = 0
+        self.samples = set()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def cancel(self):
+        """ Stops the scan; no samples are sent after this call, only the 'finished' event """
+        self.scanner.cancel()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.scanner.cancelled.is_set()
+
+    def process_events(self) -> list:
+        """ :return: events put on the queue since the last call, without waiting """
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def _run(self):
+        error = None
+        batch = []
+        last = time.monotonic()
+        try:
+            for files in self.scanner.iter_scan(self.paths):
+                batch.extend(files)
+                if time.monotonic() - last >= self.BATCH_INTERVAL:
+                    self._send(batch)
+                    batch = []
+                    last = time.monotonic()
+
+            self._send(batch)
+        except Exception as e:
+            error = str(e)
+
+        self.events.put(('finished', self.cancelled, error))
+
+    def _send(self, files: list):
+        if self.cancelled:
+            return
+
+        if files:
+            directories = {}
+            for file in files:
+                directories.setdefault(file.parent, []).append(file)
+
+            rows = []
+            for directory_files in directories.values():
+                rows.extend(extract_metadata_from_filenames(directory_files, self.seq_files_conf))
+
+            self.files += len(files)
+            self.samples.update(row['internal_lab_id'] for row in rows)
+            self.events.put(('samples', rows))
+
+        self.events.put(('progress', self.scanner.directories, self.files, len(self.samples)))
@@ -0,0 +1,223 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+from gms_uploader.modules.seq_files.scanner import SeqFileScanner, SCAN_WORKERS
+from gms_uploader.modules.seq_files.seq_files import parse_seq_filename
+
+
+INDEX_NAME = "seq_file_index.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    root TEXT NOT NULL,
+    parent TEXT,
+    mtime_ns INTEGER NOT NULL,
+    scanned REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL REFERENCES dirs(path) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    field TEXT NOT NULL,
+    sample TEXT NOT NULL,
+    lane TEXT
+);
+CREATE INDEX IF NOT EXISTS dirs_root ON dirs(root);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs(parent);
+CREATE INDEX IF NOT EXISTS files_dir ON files(dir);
+CREATE INDEX IF NOT EXISTS files_sample ON files(sample);
+"""
+
+
+def get_index_path(data_dir: Path) -> Path:
+    return Path(data_dir, INDEX_NAME)
+
+
+class SeqFileIndex:
+    """
+    Local SQLite index of the sequence data files under a data root (seq_base_path): path, size,
+    mtime, field (fastq or fast5), sample and lane of every file, and the mtime of every directory.
+    Samples can be listed from the index without touching the file share.
+
+    refresh() brings the index up to date incrementally: every directory is stat'ed, on a thread
+    pool, but only directories whose mtime changed since the last refresh are listed again; for the
+    others the subdirectories and files are taken from the index. A directory's mtime changes when
+    entries are added, removed or renamed, not when a file is rewritten in place, so the size of a
+    file overwritten under the same name is refreshed with its directory only.
+
+    An index connection must be used by the thread that opened it; the main window reads and a
+    background thread refreshes, each with its own SeqFileIndex.
+    """
+    def __init__(self, path: Path, seq_files_conf: dict):
+        """
+        :param path: index path
+        :param seq_files_conf: 'seq_files' section of the config
+        """
+        self.path = path
+        self.seq_files_conf = seq_files_conf
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(path))
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.executescript(SCHEMA)
+        self._check_patterns()
+
+    def close(self):
+        self.db.close()
+
+    def _check_patterns(self):
+        """ Empties the index if it was built with other seq_files patterns """
+        patterns = json.dumps(sorted(self.seq_files_conf[seq_type]['ext'] for seq_type in self.seq_files_conf))
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'patterns'").fetchone()
+        if row is None or row['value'] != patterns:
+            with self.db:
+                self.db.execute("DELETE FROM files")
+                self.db.execute("DELETE FROM dirs")
+                self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('patterns', ?)", (patterns,))
+
+    def last_refresh(self, root: Path):
+        """ :return: time of the last refresh of root, or None if root is not indexed """
+        row = self.db.execute("SELECT scanned FROM dirs WHERE path = ?", (str(root),)).fetchone()
+        return row['scanned'] if row is not None else None
+
+    def samples(self, root: Path) -> list:
+        """
+        :return: list of dicts with sample, files, size, lanes (comma separated), seq_path (the
+                 first directory holding files of the sample), dirs (number of directories) and
+                 mtime (newest file, in seconds), ordered by sample
+        """
+        rows = self.db.execute("SELECT f.sample, COUNT(*) AS files, SUM(f.size) AS size, "
+                               "GROUP_CONCAT(DISTINCT f.lane) AS lanes, MIN(f.dir) AS seq_path, "
+                               "COUNT(DISTINCT f.dir) AS dirs, MAX(f.mtime_ns) / 1e9 AS mtime "
+                               "FROM files f JOIN dirs d ON d.path = f.dir "
+                               "WHERE d.root = ? GROUP BY f.sample ORDER BY f.sample",
+                               (str(root),)).fetchall()
+        return [dict(row) for row in rows]
+
+    def sample_files(self, root: Path, samples) -> list:
+        """ :return: sorted list of the filepaths of samples under root """
+        samples = list(samples)
+        paths = []
+        # stay below SQLite's limit on host parameters
+        for i in range(0, len(samples), 500):
+            chunk = samples[i:i + 500]
+            rows = self.db.execute(f"SELECT f.path FROM files f JOIN dirs d ON d.path = f.dir "
+                                   f"WHERE d.root = ? AND f.sample IN ({', '.join('?' * len(chunk))})",
+                                   (str(root), *chunk)).fetchall()
+            paths.extend(Path(row['path']) for row in rows)
+
+        return sorted(paths)
+
+    def refresh(self, root: Path, cancelled: threading.Event = None, max_workers: int = SCAN_WORKERS) -> dict:
+        """
+        Updates the index of root. Directories that were listed are written even if the refresh
+        is cancelled; directories no longer present are only removed after a complete refresh. A
+        directory that cannot be stat'ed or listed, e.g. when the share does not respond, keeps its
+        rows, its indexed subdirectories are checked as usual and the refresh is incomplete.
+        :param root: data root
+        :param cancelled: event that stops the refresh when set
+        :param max_workers: number of directories checked concurrently
+        :return: dict with the number of directories checked, rescanned, removed and failed, and
+                 whether the refresh completed
+        """
+        root = str(root)
+        cancelled = cancelled if cancelled is not None else threading.Event()
+        cached = {row['path']: row['mtime_ns'] for row in
+                  self.db.execute("SELECT path, mtime_ns FROM dirs WHERE root = ?", (root,))}
+        children = {}
+        for row in self.db.execute("SELECT path, parent FROM dirs WHERE root = ?", (root,)):
+            children.setdefault(row['parent'], []).append(row['path'])
+
+        scanner = SeqFileScanner(self.seq_files_conf)
+        visited = set()
+        changed = []
+        failed = []
+        complete = True
+
+        def check(directory: str, parent: str):
+            """
+            :return: directory, parent, mtime and None if unchanged or (files, subdirectories); mtime
+                     is None if the directory is gone, listing is an OSError if it could not be read
+            """
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+                if cached.get(directory) == mtime:
+                    return directory, parent, mtime, None
+
+                return directory, parent, mtime, scanner.list_directory(directory)
+            except (FileNotFoundError, NotADirectoryError):
+                return directory, parent, None, None
+            except OSError as e:
+                return directory, parent, cached.get(directory), e
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            pending = {pool.submit(check, root, None)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                if cancelled.is_set():
+                    for future in pending:
+                        future.cancel()
+                    complete = False
+                    break
+
+                for future in done:
+                    directory, parent, mtime, listing = future.result()
+                    if isinstance(listing, OSError):
+                        failed.append(directory)
+                        complete = False
+                    elif mtime is None:
+                        continue
+
+                    visited.add(directory)
+                    if listing is None or isinstance(listing, OSError):
+                        subdirectories = children.get(directory, [])
+                    else:
+                        files, subdirectories = listing
+                        changed.append((directory, parent, mtime, files))
+
+                    pending.update(pool.submit(check, subdirectory, directory) for subdirectory in subdirectories)
+
+        removed = set(cached) - visited if complete else set()
+        self._write(root, changed, removed)
+        if complete:
+            self._set_refreshed(root)
+
+        return {'directories': len(visited), 'rescanned': len(changed), 'removed': len(removed),
+                'failed': len(failed), 'complete': complete}
+
+    def _write(self, root: str, changed: list, removed: set):
+        now = time.time()
+        with self.db:
+            for directory, parent, mtime, files in changed:
+                self.db.execute("DELETE FROM files WHERE dir = ?", (directory,))
+                self.db.execute("INSERT OR REPLACE INTO dirs (path, root, parent, mtime_ns, scanned) "
+                                "VALUES (?, ?, ?, ?, ?)", (directory, root, parent, mtime, now))
+                rows = []
+                for path, stat in files.items():
+                    parsed = parse_seq_filename(path.name, self.seq_files_conf)
+                    if parsed is None:
+                        continue
+                    field, sample, lane = parsed
+                    rows.append((str(path), directory, path.name, stat.st_size, stat.st_mtime_ns, field, sample, lane))
+
+                self.db.executemany("INSERT OR REPLACE INTO files (path, dir, name, size, mtime_ns, field, sample, "
+                                    "lane) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+            self.db.executemany("DELETE FROM dirs WHERE path = ?", [(directory,) for directory in removed])
+
+    def _set_refreshed(self, root: str):
+        """ The root records when the index was last brought up to date """
+        with self.db:
+            self.db.execute("UPDATE dirs SET scanned = ? WHERE path = ?", (time.time(), root))
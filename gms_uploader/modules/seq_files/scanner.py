@@ -0,0 +1,127 @@
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from fnmatch import translate
+from pathlib import Path
+
+SCAN_WORKERS = 8
+
+
+class SeqFileScanner:
+    """
+    Finds raw sequence data files in a set of files and directories. Directories are walked once
+    with os.scandir, matching the file names against all 'ext' patterns of the seq_files config in
+    the same pass, and subdirectories are listed in parallel on a thread pool, which hides the
+    round-trip time of each directory listing on network shares. The stat results of the found
+    files are kept in stats, which the RunWatcher uses to tell whether a run is still growing;
+    verify_files and the importer only pass on the paths. iter_scan hands out the files directory
+    by directory and a scan can be stopped from another thread with cancel().
+    """
+    def __init__(self, seq_files_conf: dict, max_workers: int = SCAN_WORKERS):
+        """
+        :param seq_files_conf: 'seq_files' section of the config
+        :param max_workers: number of directories listed concurrently
+        """
+        patterns = [seq_files_conf[seq_type]['ext'] for seq_type in seq_files_conf]
+        # case-insensitive where the file system is, like Path.match
+        flags = re.IGNORECASE if os.path.normcase('A') == 'a' else 0
+        self.pattern = re.compile("|".join(translate(pattern) for pattern in patterns), flags)
+        self.max_workers = max_workers
+        self.stats = {}
+        self.directories = 0
+        self.cancelled = threading.Event()
+
+    def match(self, name: str) -> bool:
+        return self.pattern.match(name) is not None
+
+    def scan(self, paths) -> list:
+        """
+        :param paths: list of filepaths and/or dirpaths
+        :return: sorted list of matching filepaths that exist
+        """
+        for _ in self.iter_scan(paths):
+            pass
+
+        return sorted(self.stats)
+
+    def iter_scan(self, paths):
+        """
+        Scans paths, yielding the matching files as they are found: first the given files, then
+        the files of each directory as its listing completes. Stops early once cancel() is called.
+        :param paths: list of filepaths and/or dirpaths
+        :return: generator of lists of filepaths
+        """
+        files = []
+        directories = []
+        for path in paths:
+            path = Path(path)
+            if path.is_dir():
+                directories.append(str(path))
+            elif self.match(path.name):
+                try:
+                    self.stats[path] = path.stat()
+                except OSError:
+                    continue
+                files.append(path)
+
+        if files:
+            yield files
+
+        if directories:
+            yield from self._walk(directories)
+
+    def cancel(self):
+        """ Stops a running scan after the directory listings in progress; may be called from any thread """
+        self.cancelled.set()
+
+    def _walk(self, directories: list):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            pending = {pool.submit(self.scan_directory, directory) for directory in directories}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                if self.cancelled.is_set():
+                    for future in pending:
+                        future.cancel()
+                    return
+
+                for future in done:
+                    files, subdirectories = future.result()
+                    self.directories += 1
+                    self.stats.update(files)
+                    pending.update(pool.submit(self.scan_directory, subdirectory)
+                                   for subdirectory in subdirectories)
+                    if files:
+                        yield list(files)
+
+    def scan_directory(self, directory: str):
+        """
+        Lists one directory, as list_directory, but a directory that cannot be listed is taken
+        as empty.
+        :return: dict of Path to stat result of the matching files, list of subdirectories
+        """
+        try:
+            return self.list_directory(directory)
+        except OSError:
+            return {}, []
+
+    def list_directory(self, directory: str):
+        """
+        Lists one directory. Symlinked directories are not followed, as with Path.rglob; files that
+        cannot be stat'ed, e.g. broken symlinks, are left out. Raises OSError if the directory
+        itself cannot be listed.
+        :return: dict of Path to stat result of the matching files, list of subdirectories
+        """
+        files = {}
+        subdirectories = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.path)
+                    elif self.match(entry.name):
+                        files[Path(entry.path)] = entry.stat()
+                except OSError:
+                    continue
+
+        return files, subdirectories
@@ -0,0 +1,86 @@
+from pathlib import Path
+from gms_uploader.modules.seq_files.scanner import SeqFileScanner
+
+
+def verify_files(files, seq_files_conf: dict) -> list:
+    """
+    Ensures that all filespaths in a list exist and have correct suffixes, corresponding to
+    raw sequence data files. Only correct files are returned. If a path is a dir, paths for files in that directory are listed,
+    verified and returned.
+    :param files: list of filepaths and/or dirpaths
+    :param seq_files_conf: 'seq_files' section of the config
+    :return: list of verified filepaths
+    """
+    return SeqFileScanner(seq_files_conf).scan(files)
+
+
+def parse_seq_filename(filename: str, seq_files_conf: dict):
+    """
+    Parses a sequence data filename
+    :param filename: name of the file
+    :param seq_files_conf: 'seq_files' section of the config
+    :return: tuple of field ('fastq' or 'fast5'), sample and lane (None for fast5),
+             or None if the name is not a sequence data filename
+    """
+    filename_obj = Path(filename)
+    sample = filename.split('_')[0]
+
+    if filename_obj.match(seq_files_conf['fastq_gz']['ext']):
+        f = filename_obj.stem.split('.')[0]
+        return 'fastq', sample, f.split('_')[-1]
+
+    if filename_obj.match(seq_files_conf['fast5']['ext']):
+        return 'fast5', sample, None
+
+    return None
+
+
+def extract_metadata_from_filenames(files, seq_files_conf: dict) -> list:
+    """
+    Extract metadata from sequence data filenames
+    :param files: list of filepaths
+    :param seq_files_conf: 'seq_files' section of the config
+    :return: list of dicts with metadata from filenames
+    """
+
+    _data = {}
+    for file in files:
+        seq_path = file.parent
+        filename = file.name
+
+        sample = filename.split('_')[0]
+
+        if sample not in _data:
+            _data[sample] = {}
+            _data[sample]['seq_path'] = str(seq_path)
+
+        parsed = parse_seq_filename(filename, seq_files_conf)
+        if parsed is None:
+            continue
+
+        field, _, lane = parsed
+
+        if lane is not None:
+            _data[sample]['lane'] = lane
+
+        if field not in _data[sample]:
+            _data[sample][field] = []
+
+        _data[sample][field].append(filename)
+
+    filename_metadata = []
+    for sample in _data:
+        row = dict()
+        row['mark'] = 0 # add mark column
+        row['internal_lab_id'] = sample
+        for key in _data[sample]:
+            value = _data[sample][key]
+            if isinstance(value, list):
+                sorted_files = sorted(value)
+                row[key] = sorted_files
+            else:
+                row[key] = value
+
+        filename_metadata.append(row)
+
+    return filename_metadata
@@ -0,0 +1,163 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from PySide6.QtCore import QObject, QTimer, QFileSystemWatcher, Signal
+from gms_uploader.modules.seq_files.scanner import SeqFileScanner
+
+
+class RunWatcher(QObject):
+    """
+    Watches the data root (seq_base_path) for new run folders and emits run_completed with the
+    path of a folder once it has stopped growing: it holds sequence data files and their number,
+    total size and newest mtime have not changed for settle_seconds.
+
+    Folders present when watching starts are left alone; the root is listed for them on the worker
+    thread too, and watching begins once the listing is in. Changes reported by QFileSystemWatcher are
+    debounced; as file shares often do not report changes made by other hosts, the root is also
+    surveyed every poll_seconds. Surveys list the root and walk the candidate run folders on a
+    worker thread, one survey at a time, so the main window never waits on the file share.
+    """
+    run_completed = Signal(str)
+    status_changed = Signal(str)
+
+    def __init__(self, root: Path, seq_files_conf: dict, watch_conf: dict = None, parent=None):
+        """
+        :param root: data root
+        :param seq_files_conf: 'seq_files' section of the config
+        :param watch_conf: 'watch_runs' section of the config, with debounce_seconds, poll_seconds
+                           and settle_seconds
+        """
+        super().__init__(parent)
+        watch_conf = watch_conf or {}
+        self.root = str(root)
+        self.seq_files_conf = seq_files_conf
+        self.settle_seconds = watch_conf.get('settle_seconds', 300)
+
+        self.known = set()
+        self.runs = {}
+        self.staged = set()
+        self.listing = None
+        self.survey = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.changed)
+
+        self.debounce_timer = QTimer(self)
+        self.debounce_timer.setSingleShot(True)
+        self.debounce_timer.setInterval(int(watch_conf.get('debounce_seconds', 5) * 1000))
+        self.debounce_timer.timeout.connect(self.start_survey)
+
+        self.poll_timer = QTimer(self)
+        self.poll_timer.setInterval(int(watch_conf.get('poll_seconds', 30) * 1000))
+        self.poll_timer.timeout.connect(self.start_survey)
+
+        self.result_timer = QTimer(self)
+        self.result_timer.setInterval(500)
+        self.result_timer.timeout.connect(self.collect_survey)
+
+        self.listing_timer = QTimer(self)
+        self.listing_timer.setInterval(500)
+        self.listing_timer.timeout.connect(self.collect_listing)
+
+    def start(self):
+        self.listing = self.executor.submit(self.list_folders)
+        self.listing_timer.start()
+        self.status_changed.emit(f"listing {self.root}")
+
+    def collect_listing(self):
+        """ Takes the folders present at start as known and begins watching """
+        if not self.listing.done():
+            return
+
+        self.listing_timer.stop()
+        listing, self.listing = self.listing, None
+        if listing.cancelled():
+            return
+
+        self.known = set(listing.result())
+        self.watcher.addPath(self.root)
+        self.poll_timer.start()
+        self.status_changed.emit(f"watching {self.root} for new runs")
+
+    def stop(self):
+        self.debounce_timer.stop()
+        self.poll_timer.stop()
+        self.result_timer.stop()
+        self.listing_timer.stop()
+        if self.watcher.directories():
+            self.watcher.removePaths(self.watcher.directories())
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.status_changed.emit("")
+
+    def changed(self, path):
+        """ Restarts the debounce timer, so that a burst of changes leads to one survey """
+        self.debounce_timer.start()
+
+    def list_folders(self) -> list:
+        try:
+            with os.scandir(self.root) as entries:
+                return [entry.path for entry in entries if entry.is_dir(follow_symlinks=False)]
+        except OSError:
+            return []
+
+    def signature(self, folder: str):
+        """
+        :return: number, total size and newest mtime of the sequence data files in folder, or None
+                 if there are none
+        """
+        scanner = SeqFileScanner(self.seq_files_conf)
+        scanner.scan([folder])
+        stats = scanner.stats
+        if not stats:
+            return None
+
+        return len(stats), sum(stat.st_size for stat in stats.values()), \
+            max(stat.st_mtime_ns for stat in stats.values())
+
+    def run_survey(self, ignore: set):
+        """ Runs on the worker thread. :return: dict of candidate run folder to signature """
+        signatures = {}
+        for folder in self.list_folders():
+            if folder not in ignore:
+                signatures[folder] = self.signature(folder)
+
+        return signatures
+
+    def start_survey(self):
+        if self.survey is not None:
+            return
+
+        self.survey = self.executor.submit(self.run_survey, self.known | self.staged)
+        self.result_timer.start()
+
+    def collect_survey(self):
+        if not self.survey.done():
+            return
+
+        self.result_timer.stop()
+        survey, self.survey = self.survey, None
+        if survey.cancelled() or survey.exception() is not None:
+            return
+
+        now = time.monotonic()
+        signatures = survey.result()
+        for folder in list(self.runs):
+            if folder not in signatures:
+                del self.runs[folder]
+
+        for folder, signature in signatures.items():
+            previous = self.runs.get(folder)
+            if previous is None or signature is None or previous[0] != signature:
+                self.runs[folder] = (signature, now)
+            elif now - previous[1] >= self.settle_seconds:
+                del self.runs[folder]
+                self.staged.add(folder)
+                self.run_completed.emit(folder)
+
+        growing = [Path(folder).name for folder in self.runs]
+        if growing:
+            self.status_changed.emit(f"watching {self.root}, waiting for {', '.join(sorted(growing))}")
+        else:
+            self.status_changed.emit(f"watching {self.root} for new runs")
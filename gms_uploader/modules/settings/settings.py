@@ -8,7 +8,12 @@ from gms_uploader.modules.dialogs.dialogs import MsgAlert
 
 class SettingsManager:
     """ Class for managing settings"""
-    def __init__(self, conf):
+    def __init__(self, conf, headless=False):
+        """
+        :param conf: config dict
+        :param headless: raise ValueError on incompatible saved settings instead of resetting them,
+                         used by the command line which can not show the alert
+        """
         self._qsettings = QSettings("Genomic Medicine Sweden", "GMS-uploader")
         self.conf = conf
 
@@ -17,6 +22,9 @@ class SettingsManager:
         # self._qsettings.clear()
 
         if not self._validate_settings():
+            if headless:
+                raise ValueError("Incompatible saved settings, start GMS-uploader to re-initialize them.")
+
             msg = MsgAlert("Incompatible saved settings: (re-)initializing...")
             msg.exec()
 
@@ -0,0 +1,237 @@
+import json
+import math
+import tarfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from gms_uploader.modules.upload.checksums import MultiHasher, HashingReader, CHECKSUM_ALGORITHMS
+from gms_uploader.modules.upload.multipart import get_part_size
+
+# bundle_mode: (suffix, tarfile stream mode)
+BUNDLE_MODES = {'tar': ('.tar', 'w|'),
+                'tar.gz': ('.tar.gz', 'w|gz')}
+
+
+class Bundle:
+    """
+    The sequence files of one sample, uploaded as a single tar archive that is built while it is
+    sent, without a local copy. An index of the members, <bundle>.index.json, is uploaded next to it.
+    """
+    def __init__(self, lid: str, files: list, mode: str):
+        suffix, self.tar_mode = BUNDLE_MODES[mode]
+        self.lid = lid
+        self.files = files
+        self.mode = mode
+        self.name = str(lid) + suffix
+        self.index_name = self.name + ".index.json"
+        self.size = sum(file.stat().st_size for file in files)
+
+    def max_archive_size(self) -> int:
+        """ Upper bound of the archive size: data, one pax and one ustar header per member, padding and end blocks """
+        blocks = sum(3 + math.ceil(file.stat().st_size / tarfile.BLOCKSIZE) for file in self.files)
+        return (blocks + 2) * tarfile.BLOCKSIZE + tarfile.RECORDSIZE
+
+
+def get_bundle_mode(cred: dict) -> str:
+    """
+    :param cred: credentials dict
+    :return: 'bundle_mode' from the credentials json if it is one of BUNDLE_MODES, otherwise 'off'
+    """
+    mode = str(cred.get('bundle_mode', 'off'))
+    return mode if mode in BUNDLE_MODES else 'off'
+
+
+class _MemberReader(HashingReader):
+    """ Hashes a member while tarfile copies it, and reports the bytes read """
+    def __init__(self, fh, on_read):
+        super().__init__(fh)
+        self.on_read = on_read
+
+    def read(self, size=-1) -> bytes:
+        data = super().read(size)
+        if data:
+            self.on_read(len(data))
+        return data
+
+
+class _HashingWriter:
+    """ Passes the archive stream on to the sink, hashing and counting it """
+    def __init__(self, sink):
+        self.sink = sink
+        self.hasher = MultiHasher()
+        self.size = 0
+
+    def write(self, data) -> int:
+        self.hasher.update(data)
+        self.size += len(data)
+        self.sink.write(data)
+        return len(data)
+
+
+def write_bundle(bundle: Bundle, sink, on_read) -> dict:
+    """
+    Streams the members of a bundle as a tar archive into sink, reading each file once.
+    :param bundle: Bundle
+    :param sink: object with a write(bytes) method
+    :param on_read: called with the number of member bytes read, for progress and rate limiting
+    :return: index dict: archive size and checksums, and for every member its name, size, checksums
+             and the offset of its data in the (uncompressed) tar stream
+    """
+    out = _HashingWriter(sink)
+    members = []
+
+    with tarfile.open(fileobj=out, mode=bundle.tar_mode, format=tarfile.PAX_FORMAT) as tar:
+        for file in bundle.files:
+            stat = file.stat()
+            info = tarfile.TarInfo(file.name)
+            info.size = stat.st_size
+            info.mtime = int(stat.st_mtime)
+            info.mode = 0o644
+
+            with open(file, 'rb') as fh:
+                reader = _MemberReader(fh, on_read)
+                tar.addfile(info, reader)
+
+            padded = math.ceil(info.size / tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+            member = {'name': file.name,
+                      'offset': tar.offset - padded,
+                      'size': info.size}
+            member.update(reader.hexdigests())
+            members.append(member)
+
+    index = {'bundle': bundle.name,
+             'internal_lab_id': bundle.lid,
+             'format': bundle.mode,
+             'size': out.size,
+             'algorithms': CHECKSUM_ALGORITHMS,
+             'members': members}
+    index.update(out.hasher.hexdigests())
+
+    return index
+
+
+def index_to_bytes(index: dict) -> bytes:
+    return json.dumps(index, indent=2).encode('utf-8')
+
+
+def add_member_checksums(checksums, index: dict):
+    """
+    Adds the checksums of the members in a bundle index to the run's ChecksumStore, so that they
+    end up in the meta file and the manifest like those of files sent one by one.
+    """
+    for member in index['members']:
+        checksums.add(member['name'], {algorithm: member[algorithm] for algorithm in CHECKSUM_ALGORITHMS})
+
+
+class S3StreamWriter:
+    """
+    Writable sink that uploads a stream of unknown length to S3: data is cut into parts of
+    part_size and sent as a multipart upload, up to max_concurrency parts at a time. A stream that
+    ends before the first part is full is sent with a single put_object. Not resumable, but with a
+    retrier (Retrier) a part that fails with a transient error is sent again after a backoff.
+    """
+    def __init__(self, connection, key: str, size_hint: int, part_size: int, max_concurrency: int,
+                 metadata: dict, tuner=None, retrier=None):
+        self.client = connection.client
+        self.bucket = connection.bucket
+        self.key = key
+        self.part_size = get_part_size(size_hint, part_size)
+        self.metadata = metadata
+        self.tuner = tuner
+        self.retrier = retrier
+
+        self.max_concurrency = max(1, max_concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        self.slots = threading.BoundedSemaphore(self.max_concurrency)
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.futures = []
+        self.errors = []
+
+    def write(self, data) -> int:
+        self.buffer += data
+        while len(self.buffer) >= self.part_size:
+            part = bytes(self.buffer[:self.part_size])
+            del self.buffer[:self.part_size]
+            self._submit(part)
+
+        return len(data)
+
+    def _submit(self, data: bytes):
+        if self.upload_id is None:
+            resp = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key, Metadata=self.metadata)
+            self.upload_id = resp['UploadId']
+
+        self.slots.acquire()
+        if self.errors:
+            self.slots.release()
+            raise self.errors[0]
+
+        num = len(self.futures) + 1
+        future = self.executor.submit(self._upload_part, num, data)
+        future.add_done_callback(self._part_done)
+        self.futures.append(future)
+
+    def _part_done(self, future):
+        if future.exception() is not None:
+            self.errors.append(future.exception())
+        self.slots.release()
+
+    def _upload_part(self, num: int, data: bytes):
+        if self.retrier is not None:
+            return self.retrier.call(self._send_part, num, data)
+
+        return self._send_part(num, data)
+
+    def _send_part(self, num: int, data: bytes):
+        t0 = time.monotonic()
+        resp = self.client.upload_part(Bucket=self.bucket,
+                                       Key=self.key,
+                                       UploadId=self.upload_id,
+                                       PartNumber=num,
+                                       Body=data)
+
+        if self.tuner is not None:
+            self.tuner.record(len(data), time.monotonic() - t0)
+
+        return {'PartNumber': num, 'ETag': resp['ETag']}
+
+    def close(self):
+        """ Sends what is left and completes the upload """
+        try:
+            if self.upload_id is None:
+                self._call(self.client.put_object, Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer),
+                           Metadata=self.metadata)
+                return
+
+            if self.buffer:
+                self._submit(bytes(self.buffer))
+                self.buffer = bytearray()
+
+            parts = [future.result() for future in self.futures]
+            self.client.complete_multipart_upload(Bucket=self.bucket,
+                                                  Key=self.key,
+                                                  UploadId=self.upload_id,
+                                                  MultipartUpload={'Parts': parts})
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self.executor.shutdown(wait=True)
+
+    def _call(self, func, **kwargs):
+        if self.retrier is not None:
+            return self.retrier.call(func, **kwargs)
+
+        return func(**kwargs)
+
+    def abort(self):
+        if self.upload_id is None:
+            return
+
+        self.executor.shutdown(wait=True)
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        except ClientError:
+            pass
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import threading
+from pathlib import Path
+
+
+CHECKSUM_ALGORITHMS = ['md5', 'sha256']
+READ_SIZE = 1024 * 1024
+
+
+class MultiHasher:
+    """ Feeds the same bytes to all checksum algorithms """
+    def __init__(self):
+        self._hashes = {name: hashlib.new(name) for name in CHECKSUM_ALGORITHMS}
+
+    def update(self, data: bytes):
+        for h in self._hashes.values():
+            h.update(data)
+
+    def hexdigests(self) -> dict:
+        return {name: h.hexdigest() for name, h in self._hashes.items()}
+
+
+class HashingReader:
+    """
+    Read-only file wrapper that hashes every byte read through it, so that a transfer which
+    reads the file sequentially also produces its checksums, without a second pass over the file.
+    """
+    def __init__(self, fh):
+        self._fh = fh
+        self.hasher = MultiHasher()
+
+    def read(self, size=-1) -> bytes:
+        data = self._fh.read(size)
+        self.hasher.update(data)
+        return data
+
+    def hexdigests(self) -> dict:
+        return self.hasher.hexdigests()
+
+
+def hash_file(file: Path) -> dict:
+    """
+    Checksums of a file that was not streamed (e.g. skipped in sync mode).
+    :param file: local file
+    :return: dict of algorithm to hex digest
+    """
+    hasher = MultiHasher()
+    with open(file, 'rb') as fh:
+        for block in iter(lambda: fh.read(READ_SIZE), b''):
+            hasher.update(block)
+
+    return hasher.hexdigests()
+
+
+class ChecksumStore:
+    """ Checksums of the files in an upload run, reported by the workers """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checksums = {}
+
+    def add(self, filename: str, checksums: dict):
+        with self._lock:
+            self._checksums[filename] = dict(checksums)
+
+    def get(self, filename: str) -> dict:
+        with self._lock:
+            return self._checksums.get(filename)
+
+    def write_manifest(self, path: Path, tag: str, files: list, fname2lid: dict, fname2bundle: dict = None):
+        """
+        Writes the per-tag manifest: one entry per sequence file with sample, size and checksums.
+        :param path: manifest json path
+        :param tag: upload tag
+        :param files: list of sequence file paths
+        :param fname2lid: dict of filename to internal_lab_id
+        :param fname2bundle: dict of filename to the bundle (tar object) it was sent in, if any
+        """
+        fname2bundle = fname2bundle or {}
+        entries = []
+        for file in files:
+            entry = {'file': file.name,
+                     'internal_lab_id': fname2lid.get(file.name),
+                     'size': file.stat().st_size}
+            if file.name in fname2bundle:
+                entry['bundle'] = fname2bundle[file.name]
+            entry.update(self.get(file.name) or {})
+            entries.append(entry)
+
+        with open(path, 'w', encoding='utf-8') as outfile:
+            json.dump({'tag': tag, 'algorithms': CHECKSUM_ALGORITHMS, 'files': entries}, outfile, indent=2)
+
+    def add_to_metafile(self, metafile: Path, fname2lid: dict):
+        """
+        Adds a 'checksums' field, filename to checksums, to each sample record in the meta json.
+        :param metafile: meta json path (list of records, as written by the main window)
+        :param fname2lid: dict of filename to internal_lab_id
+        """
+        with open(metafile, 'r', encoding='utf-8') as fh:
+            records = json.load(fh)
+
+        for record in records:
+            lid = record.get('internal_lab_id')
+            record['checksums'] = {fname: self.get(fname) for fname, _lid in fname2lid.items()
+                                   if _lid == lid and self.get(fname) is not None}
+
+        with open(metafile, 'w', encoding='utf-8') as outfile:
+            json.dump(records, outfile, ensure_ascii=False)
@@ -0,0 +1,220 @@
+import math
+import socket
+import threading
+import paramiko
+import boto3
+from botocore.client import Config
+
+
+class S3Connection:
+    """
+    Connection-pooled S3 client for one credentials target. boto3 clients are thread-safe, so a
+    single instance is created per upload run and shared by all workers, instead of a new
+    session, resource and TLS handshake per file.
+    """
+    def __init__(self, cred: dict, max_pool_connections: int):
+        self.bucket = cred['bucket']
+        self.endpoint = cred['endpoint']
+        self.max_pool_connections = max(10, max_pool_connections)
+
+        session = boto3.session.Session(aws_access_key_id=cred['aws_access_key_id'],
+                                        aws_secret_access_key=cred['aws_secret_access_key'])
+
+        s3_config = Config(s3={'addressing_style': 'path', 'payload_signing_enabled': True},
+                           signature_version='s3v4',
+                           max_pool_connections=self.max_pool_connections)
+
+        self.client = session.client('s3',
+                                     endpoint_url=self.endpoint,
+                                     verify=False,  # Checks for SLL certificate. Disables because of already "secure" solution.
+                                     config=s3_config)
+
+    def close(self):
+        self.client.close()
+
+
+class _SFTPConnection:
+    """
+    One authenticated transport and the SFTP channels opened on it. The connection is made outside
+    the pool lock: transport is None until then, and ready is set once it is made or has failed,
+    with the error in error.
+    """
+    def __init__(self):
+        self.transport = None
+        self.error = None
+        self.ready = threading.Event()
+        self.idle = []
+        self.in_use = 0
+
+    def load(self) -> int:
+        return self.in_use + len(self.idle)
+
+    def alive(self) -> bool:
+        if not self.ready.is_set():
+            return True
+
+        return self.transport is not None and self.transport.is_active()
+
+
+class SFTPConnectionPool:
+    """
+    Pool of long-lived authenticated SSH transports for one credentials target and tag. Each
+    transport carries up to 'sftp_channels_per_connection' SFTP channels (credentials json,
+    default 4), and channels are kept open between files, so key exchange and authentication
+    happen once per connection instead of once per file. The SSH window and packet size can be
+    tuned with 'sftp_window_size' and 'sftp_max_packet_size' (bytes).
+
+    A slot on a connection is reserved under the pool lock; connecting, opening the channel and
+    creating the tag directory happen outside it, so a slow or unreachable host only holds up the
+    callers waiting for that connection. Connecting, the SSH banner, key exchange and
+    authentication each time out after 'sftp_connect_timeout' seconds (default 15).
+    """
+    def __init__(self, cred: dict, tag: str, max_channels: int):
+        self.cred = cred
+        self.host = cred['target_host']
+        self.port = int(cred.get('port', 22))
+        self.target_path = cred['base_path'] + "/" + tag
+        self.connect_timeout = float(cred.get('sftp_connect_timeout', 15))
+
+        self.channels_per_connection = max(1, int(cred.get('sftp_channels_per_connection', 4)))
+        self.max_connections = max(1, math.ceil(max_channels / self.channels_per_connection))
+
+        self.transport_options = {}
+        if 'sftp_window_size' in cred:
+            self.transport_options['default_window_size'] = int(cred['sftp_window_size'])
+        if 'sftp_max_packet_size' in cred:
+            self.transport_options['default_max_packet_size'] = int(cred['sftp_max_packet_size'])
+
+        self._connections = []
+        self._owner = {}
+        self._target_path_created = False
+        self._lock = threading.Lock()
+        self._target_path_lock = threading.Lock()
+
+    def _connect(self, conn: _SFTPConnection):
+        """ Connects conn, without the pool lock held. Sets conn.ready either way """
+        sock = None
+        t = None
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+            t = paramiko.Transport(sock, **self.transport_options)
+            t.banner_timeout = self.connect_timeout
+            t.handshake_timeout = self.connect_timeout
+            t.auth_timeout = self.connect_timeout
+            t.connect(username=self.cred['usr'], password=self.cred['psw'])
+        except Exception as e:
+            if t is not None:
+                t.close()
+            elif sock is not None:
+                sock.close()
+            conn.error = e
+            conn.ready.set()
+            raise
+
+        conn.transport = t
+        conn.ready.set()
+
+    def _prune(self):
+        """ Drops connections whose transport has died or could not be made """
+        for conn in [c for c in self._connections if not c.alive()]:
+            self._connections.remove(conn)
+            for sftp in conn.idle:
+                self._owner.pop(sftp, None)
+
+    def _select_connection(self):
+        """
+        Connection with an idle channel, else the least loaded one with room, else a new one.
+        :return: connection, True if it is new and still has to be connected
+        """
+        for conn in self._connections:
+            if conn.idle:
+                return conn, False
+
+        candidates = [c for c in self._connections if c.load() < self.channels_per_connection]
+        if not candidates and len(self._connections) < self.max_connections:
+            conn = _SFTPConnection()
+            self._connections.append(conn)
+            return conn, True
+
+        if not candidates:
+            candidates = self._connections
+
+        return min(candidates, key=lambda c: c.load()), False
+
+    def acquire(self) -> paramiko.SFTPClient:
+        """
+        Returns an open SFTP channel, with the tag directory created on the target. If the
+        connection can not be made the slot is given back and the error raised.
+        :return: paramiko.SFTPClient
+        """
+        with self._lock:
+            self._prune()
+            conn, new = self._select_connection()
+            sftp = conn.idle.pop() if conn.idle else None
+            conn.in_use += 1
+
+        try:
+            if new:
+                self._connect(conn)
+            else:
+                conn.ready.wait()
+                if conn.error is not None:
+                    raise conn.error
+
+            if sftp is None:
+                sftp = paramiko.SFTPClient.from_transport(conn.transport)
+                with self._lock:
+                    self._owner[sftp] = conn
+
+            self._create_target_path(sftp)
+        except Exception:
+            with self._lock:
+                conn.in_use -= 1
+                if sftp is not None:
+                    self._owner.pop(sftp, None)
+                    sftp.close()
+                if not conn.alive() and conn in self._connections:
+                    self._connections.remove(conn)
+            raise
+
+        return sftp
+
+    def release(self, sftp: paramiko.SFTPClient, broken=False):
+        """
+        Returns a channel to the pool. Broken channels are closed instead of reused.
+        :param sftp: channel from acquire()
+        :param broken: True if the channel failed during use
+        """
+        with self._lock:
+            conn = self._owner.get(sftp)
+            if conn is None:
+                return
+
+            conn.in_use -= 1
+
+            if broken or not conn.transport.is_active():
+                self._owner.pop(sftp)
+                sftp.close()
+            else:
+                conn.idle.append(sftp)
+
+    def _create_target_path(self, sftp: paramiko.SFTPClient):
+        with self._target_path_lock:
+            if self._target_path_created:
+                return
+
+            try:
+                sftp.stat(self.target_path)
+            except FileNotFoundError:
+                sftp.mkdir(self.target_path)
+
+            self._target_path_created = True
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                if conn.transport is not None:
+                    conn.transport.close()
+
+            self._connections = []
+            self._owner = {}
@@ -0,0 +1,744 @@
+import json
+import queue
+import threading
+import time
+from pathlib import Path
+import pandas as pd
+from gms_uploader.modules.upload.support_classes import ParamikoFileUploadWorker, Boto3FileUploadWorker, \
+    ParamikoBundleUploadWorker, Boto3BundleUploadWorker, S3_PART_CONCURRENCY
+from gms_uploader.modules.upload.connections import S3Connection, SFTPConnectionPool
+from gms_uploader.modules.upload.multipart import MultipartJournal, abort_stale_uploads
+from gms_uploader.modules.upload.tuning import S3TransferTuner
+from gms_uploader.modules.upload.sync import RemoteIndex
+from gms_uploader.modules.upload.checksums import ChecksumStore
+from gms_uploader.modules.upload.progress import ProgressAggregator, UploadTelemetry
+from gms_uploader.modules.upload.runners import ThreadRunner
+from gms_uploader.modules.upload.throttle import RateLimiter
+from gms_uploader.modules.upload.bundle import Bundle, get_bundle_mode
+from gms_uploader.modules.upload.retry import Retrier, RetryBudget
+from gms_uploader.modules.upload.journal import UploadJournal, get_journal_path, RUN_RUNNING, RUN_INTERRUPTED, \
+    RUN_FAILED, RUN_COMPLETE, FILE_PENDING, FILE_IN_PROGRESS, FILE_DONE, FILE_SKIPPED, FILE_FAILED, ResumeError
+
+
+def pid_number(pid: str) -> int:
+    """ Number part of a pseudo_id, e.g. 12 for SE100-00000012 """
+    return int(str(pid).rsplit('-', 1)[-1])
+
+
+class Item:
+    def __init__(self, lid: str, pseudo_id: str, files: list):
+        self.lid = lid
+        self.pseudo_id = pseudo_id
+        self.files = files
+        self.fnames = self._get_filenames()
+        self.uploaded = self._get_uploaded_defaults()
+
+    def _get_filenames(self):
+        return [file.name for file in self.files]
+
+    def contains_filename(self, fname: str) -> bool:
+        if fname in self.fnames:
+            return True
+
+        return False
+
+    def _get_uploaded_defaults(self) -> dict:
+        uploaded = {}
+        for fname in self.fnames:
+            uploaded[fname] = False
+
+        return uploaded
+
+    def set_file_uploaded(self, fname: str):
+        self.uploaded[fname] = True
+
+    def upload_complete(self) -> bool:
+        res = list(self.uploaded.values())
+        if all(res):
+            return True
+
+        return False
+
+
+class UploadEngine:
+    """
+    Schedules and runs the upload of one tag without any Qt dependency, shared by the Uploader
+    dialog and the command line. Up to 'max_concurrent_files' workers run at a time, on a thread
+    pool kept for the whole run (see runners.py); each worker reports back through a thread-safe
+    queue, and all scheduling happens in process_events(), on the thread that owns the engine.
+
+    process_events() returns the events since the last call as tuples:
+    ('finished', filename, error), error being None on success, ('retry', filename, error, delay)
+    when a failed file is sent again after delay seconds, ('paused',) once a stopped run has no
+    files in flight, and ('complete', all_done) once nothing more can be uploaded.
+
+    A file failing with a transient error (see retry.py) is put back in the queue with a jittered
+    exponential backoff, 'retry_attempts' times in all (credentials json, default 3), while the other
+    files carry on. Requests within a file are retried first, 'part_retry_attempts' times (default
+    5). All retries of a run are taken from a budget of 'retry_budget' (default 50), so that a target
+    that is down fails the run instead of retrying every file.
+
+    The run and the state of each file are kept in the UploadJournal in the metadata output path.
+    An engine created with resume=True for a tag in the journal takes its options from there and
+    only sends the files that were not done.
+    """
+    # sent after all sequence files, in this order
+    TAIL_ITEMS = ['metafile', 'manifestfile', 'completefile']
+    # orders of the sequence files, see set_order()
+    QUEUE_ORDERS = ['dataframe', 'largest', 'sample']
+
+    def __init__(self, cred: dict,
+                 tag: str,
+                 df: pd.DataFrame,
+                 metafile: Path,
+                 completefile: Path,
+                 pidm,
+                 sync_mode: bool = None,
+                 order: str = None,
+                 bundle_mode: str = None,
+                 resume: bool = False):
+
+        self.cred = cred
+        self.tag = tag
+        self.df = df.copy(deep=True)
+        self.metafile = metafile
+        self.completefile = completefile
+        self.manifestfile = Path(metafile.parent, tag + "_manifest.json")
+        self.pidm = pidm
+
+        self.upload_journal = UploadJournal(get_journal_path(metafile.parent))
+        if resume:
+            options = self.upload_journal.get_run(tag)['options']
+            sync_mode = options['sync_mode'] if sync_mode is None else sync_mode
+            order = options['order'] if order is None else order
+            bundle_mode = options['bundle_mode'] if bundle_mode is None else bundle_mode
+
+        if sync_mode is None:
+            sync_mode = bool(cred.get('sync_mode', False))
+        self.sync_mode = sync_mode
+
+        self.bundle_mode = bundle_mode if bundle_mode is not None else get_bundle_mode(cred)
+        self.bundle_min_files = max(1, int(cred.get('bundle_min_files', 20)))
+
+        # the manifest is written in full by write_checksums before it is sent; until then an empty
+        # one stands in, unless a resumed run already has one
+        self.checksums = ChecksumStore()
+        if not (resume and self.manifestfile.exists()):
+            self.checksums.write_manifest(self.manifestfile, tag, [], {})
+
+        self.items = self._create_items()
+        self.fname2lid = {}
+        self.filesizes = {}
+        self.bundles = {}
+        self.units = []
+        self.seqfiles = []
+        self.allfiles = []
+        self.tailfiles = []
+        self.active = set()
+        self.failed = {}
+        self.committed = set()
+        self.max_concurrent = self.get_max_concurrent(cred)
+        self.connection = None
+        self.connection_lock = threading.Lock()
+        self.tuner = None
+        self.remote_index = None
+        self.journal_dir = Path(metafile.parent, '.multipart')
+        self.journal = MultipartJournal(Path(self.journal_dir, tag + ".json"))
+        self.limiter = RateLimiter.from_cred(cred)
+
+        self.retry_budget = RetryBudget(int(cred.get('retry_budget', 50)))
+        self.file_retrier = Retrier.from_cred(cred, 'retry_attempts', 3, self.retry_budget)
+        self.part_retrier = Retrier.from_cred(cred, 'part_retry_attempts', 5, self.retry_budget)
+        self.attempts = {}
+        self.backoff = []
+
+        self.progress = ProgressAggregator()
+        self.telemetry = UploadTelemetry(self.progress)
+        self.summaryfile = Path(metafile.parent, tag + "_upload_summary.json")
+
+        self.events = queue.Queue()
+        self.runner = ThreadRunner(self.events, self.max_concurrent, "upload-" + tag)
+
+        self.is_paused = True
+        self.complete = False
+        self.closed = False
+
+        for lid in self.items:
+            bundle = self._get_bundle(lid)
+            if bundle is not None:
+                self.bundles[bundle.name] = bundle
+                self.fname2lid[bundle.name] = lid
+                self.filesizes[bundle.name] = bundle.size
+                self.progress.register(bundle.name, bundle.size)
+                self.units.append(bundle)
+                self.allfiles.append(bundle)
+
+            for file in self.items[lid].files:
+                fname = str(file.name)
+                self.fname2lid[fname] = self.items[lid].lid
+                self.filesizes[fname] = file.stat().st_size
+                if lid in self.TAIL_ITEMS:
+                    self.progress.register(fname, self.filesizes[fname])
+                    self.tailfiles.append(file)
+                else:
+                    self.seqfiles.append(file)
+                    if bundle is None:
+                        self.progress.register(fname, self.filesizes[fname])
+                        self.units.append(file)
+                        self.allfiles.append(file)
+
+        if order is None:
+            order = cred.get('queue_order', 'dataframe')
+            if order not in self.QUEUE_ORDERS:
+                order = 'dataframe'
+
+        self.name2file = {file.name: file for file in self.units + self.tailfiles}
+
+        self.order = None
+        self.journaled = resume
+        self.set_order(order)
+        self.checksums_written = False
+
+        if resume:
+            self._restore()
+
+    def _restore(self):
+        """
+        Takes over the committed samples and the done and skipped files, with their checksums, of
+        the run in the journal. Everything else is sent again. Raises ResumeError if pseudo_ids of
+        the run were stored for other samples in the meantime.
+        """
+        self.upload_journal.reset_unfinished(self.tag)
+        self.committed.update(self.upload_journal.get_run(self.tag)['committed'])
+
+        # the pseudo_ids of the samples not stored yet are only in the journal; another submission
+        # since the interruption may have been given the same numbers
+        pidlids = self._get_pidlids()
+        if pidlids:
+            stored, taken = self.pidm.check_pidlids(pidlids, self.tag)
+            if taken:
+                self.upload_journal.close()
+                raise ResumeError(f"the pseudo_ids {', '.join(taken)} of this upload have been stored for other "
+                                  f"samples since it was interrupted. Discard it and submit the samples again.")
+            self.committed.update(stored)
+            self.upload_journal.set_committed(self.tag, self.committed)
+
+        for name, entry in self.upload_journal.files(self.tag).items():
+            if name not in self.name2file or entry['state'] not in [FILE_DONE, FILE_SKIPPED]:
+                continue
+
+            for fname, checksums in entry['checksums'].items():
+                self.checksums.add(fname, checksums)
+
+            self._set_uploaded(name)
+            if entry['state'] == FILE_SKIPPED:
+                self.progress.skip(name)
+            else:
+                self.progress.complete(name)
+
+            file = self.name2file[name]
+            if file in self.allfiles:
+                self.allfiles.remove(file)
+            if file in self.tailfiles:
+                self.tailfiles.remove(file)
+
+    def _set_uploaded(self, name):
+        lid = self.fname2lid[name]
+        if name in self.bundles:
+            for file in self.bundles[name].files:
+                self.items[lid].set_file_uploaded(file.name)
+        else:
+            self.items[lid].set_file_uploaded(name)
+
+    def _unit_checksums(self, name) -> dict:
+        """ Checksums reported for a file, or for the members of a bundle, by filename """
+        fnames = [file.name for file in self.bundles[name].files] if name in self.bundles else [name]
+        return {fname: self.checksums.get(fname) for fname in fnames if self.checksums.get(fname) is not None}
+
+    def files(self) -> list:
+        """
+        :return: list of all files and bundles in the run, in dataframe order
+        """
+        return self.units + [file for lid in self.TAIL_ITEMS for file in self.items[lid].files]
+
+    def _get_bundle(self, lid):
+        """
+        Returns a Bundle for the files of a sample if bundle mode is on ('bundle_mode' in the
+        credentials json: 'off', 'tar' or 'tar.gz') and the sample has at least 'bundle_min_files'
+        files (default 20), otherwise None.
+        """
+        if self.bundle_mode == 'off' or lid in self.TAIL_ITEMS:
+            return None
+
+        files = self.items[lid].files
+        if len(files) < self.bundle_min_files:
+            return None
+
+        return Bundle(lid, files, self.bundle_mode)
+
+    def _get_pidlids(self):
+        """ :return: (pseudo_id, internal_lab_id) of the samples not committed yet, in pseudo_id order """
+        pidlids = []
+        for lid in self.items:
+            if self.items[lid].pseudo_id is not None and lid not in self.committed:
+                pidlids.append((self.items[lid].pseudo_id, lid))
+
+        return sorted(pidlids, key=lambda pidlid: pid_number(pidlid[0]))
+
+    def commit_items(self):
+        """
+        Stores the pseudo_ids of the samples whose files are all uploaded, in pseudo_id order: a
+        sample is held back until every sample with a lower pseudo_id is stored, as the pseudo_id
+        file must stay in number order for the next numbers to be handed out correctly.
+        """
+        pidlids = []
+        for pid, lid in self._get_pidlids():
+            if not self.items[lid].upload_complete():
+                break
+            pidlids.append((pid, lid))
+
+        if not pidlids:
+            return
+
+        self.pidm.write_pidlids_to_csv(pidlids, self.tag)
+        self.committed.update(lid for _, lid in pidlids)
+        self.upload_journal.set_committed(self.tag, self.committed)
+
+    def _create_items(self) -> dict:
+        items = {}
+        for _, row in self.df.iterrows():
+            _files = []
+            _lid = row['internal_lab_id']
+            _pseudo_id = row['pseudo_id']
+
+            if row['fastq']:
+                _list = row["fastq"]
+                for filename in _list:
+                    _files.append(Path(row["seq_path"], filename))
+
+            if row['fast5']:
+                _list = row["fast5"]
+                for filename in _list:
+                    _files.append(Path(row["seq_path"], filename))
+
+            items[row['internal_lab_id']] = Item(_lid, _pseudo_id, _files)
+
+        items['metafile'] = Item('metafile', None, [self.metafile])
+        items['manifestfile'] = Item('manifestfile', None, [self.manifestfile])
+        items['completefile'] = Item('completefile', None, [self.completefile])
+
+        return items
+
+    @staticmethod
+    def get_max_concurrent(cred: dict) -> int:
+        """
+        Number of files uploaded in parallel, set per target with 'max_concurrent_files' in the
+        credentials json. Defaults to 4.
+        :param cred: credentials dict
+        :return: int
+        """
+        try:
+            value = int(cred.get('max_concurrent_files', 4))
+        except (TypeError, ValueError):
+            return 4
+
+        return max(1, value)
+
+    def set_order(self, order: str):
+        """
+        Orders the sequence files not yet started. 'dataframe' keeps the order of the samples,
+        'largest' starts the largest files first (LPT), so that the run does not end with one large
+        file uploading alone. 'sample' sends the samples one after another, each largest file first,
+        and stores the pseudo_ids of the samples as soon as all their files are uploaded, in pseudo_id
+        order, so that an interrupted run keeps what it completed. Can be changed during a run. The meta file, the
+        manifest and the upload complete file are always sent last.
+        :param order: one of QUEUE_ORDERS
+        """
+        if order not in self.QUEUE_ORDERS:
+            raise ValueError(f"Unknown queue order '{order}', expected one of {self.QUEUE_ORDERS}.")
+
+        self.order = order
+        rank = {file: i for i, file in enumerate(self.units)}
+
+        if order == 'largest':
+            self.allfiles.sort(key=lambda file: (-self.filesizes[file.name], rank[file]))
+        elif order == 'sample':
+            sample_rank = {lid: i for i, lid in enumerate(self.items)}
+            self.allfiles.sort(key=lambda file: (sample_rank[self.fname2lid[file.name]],
+                                                 -self.filesizes[file.name], rank[file]))
+        else:
+            self.allfiles.sort(key=lambda file: rank[file])
+
+        if self.journaled:
+            self.upload_journal.set_run_options(self.tag, self.options())
+
+    def options(self) -> dict:
+        """ :return: the run options a resumed run is started with """
+        return {'sync_mode': self.sync_mode, 'order': self.order, 'bundle_mode': self.bundle_mode}
+
+    def _next_file(self):
+        """
+        Returns the next file to upload, or None if nothing can be started right now. Files whose
+        backoff has run out go first. The meta file, the manifest and the upload complete file are
+        held back until all sequence files are uploaded and are then sent one at a time, in
+        TAIL_ITEMS order. They are not sent at all if any file of the run failed.
+        :return: Path or None
+        """
+        now = time.monotonic()
+        for i, (due, file) in enumerate(self.backoff):
+            if due <= now:
+                return self.backoff.pop(i)[1]
+
+        if len(self.allfiles) > 0:
+            return self.allfiles.pop(0)
+
+        if len(self.tailfiles) > 0 and len(self.active) == 0 and not self.backoff and not self.failed:
+            if not self.checksums_written:
+                self.write_checksums()
+                self.checksums_written = True
+
+            return self.tailfiles.pop(0)
+
+        return None
+
+    def write_checksums(self):
+        """
+        Adds the checksums computed by the workers to the meta file and writes the manifest, just
+        before they are uploaded.
+        """
+        seq_fname2lid = {file.name: self.fname2lid[file.name] for file in self.seqfiles}
+        fname2bundle = {file.name: bundle.name for bundle in self.bundles.values() for file in bundle.files}
+
+        self.checksums.add_to_metafile(self.metafile, seq_fname2lid)
+        self.checksums.write_manifest(self.manifestfile, self.tag, self.seqfiles, seq_fname2lid, fname2bundle)
+
+        for file in [self.metafile, self.manifestfile]:
+            self.progress.register(file.name, file.stat().st_size)
+
+    def _queue_empty(self):
+        return len(self.allfiles) == 0 and len(self.tailfiles) == 0 and len(self.backoff) == 0
+
+    def _run_finished(self):
+        """ True when no file is in flight and no further file can be started """
+        if len(self.active) > 0 or len(self.allfiles) > 0 or len(self.backoff) > 0:
+            return False
+
+        return len(self.tailfiles) == 0 or bool(self.failed)
+
+    def start(self):
+        """
+        Starts, or resumes, the run. The run is recorded in the upload journal when it is first
+        started, with the options set by then, e.g. sync_mode.
+        """
+        if self.complete:
+            return
+
+        if not self.journaled:
+            self.upload_journal.add_run(self.tag, self.cred, self.metafile, self.completefile, self.df,
+                                        self.options(),
+                                        [(name, self.fname2lid[name], self.filesizes[name]) for name in self.name2file])
+            self.journaled = True
+        else:
+            self.upload_journal.set_run_options(self.tag, self.options())
+
+        self.is_paused = False
+        self.upload_journal.set_run_state(self.tag, RUN_RUNNING)
+        self.telemetry.start()
+        self.upload_file()
+
+        if self._run_finished():
+            self.events.put(('complete', self.finish()))
+
+    def stop(self):
+        """
+        Stops starting new files. Files already in flight are completed; a ('paused',) event is
+        returned by process_events() once the last of them has finished.
+        """
+        self.is_paused = True
+
+        if len(self.active) == 0:
+            self.telemetry.pause()
+            self.upload_journal.set_run_state(self.tag, RUN_INTERRUPTED)
+            self.events.put(('paused',))
+
+    def is_running(self) -> bool:
+        return len(self.active) > 0
+
+    def upload_file(self):
+        """
+        Starts uploads until max_concurrent files are in flight or the queue is empty.
+        :return: None
+        """
+        while not self.is_paused and len(self.active) < self.max_concurrent:
+            file = self._next_file()
+            if file is None:
+                break
+
+            self._start_worker(file)
+
+    def _start_worker(self, file):
+        """
+        Hands a file to the runner. The worker is created on the runner's thread, as creating the
+        first one connects to the target (see get_connection); errors while creating it, e.g. a
+        local file removed since the submission or an unreachable target, are reported as a
+        'finished' event for the file, and so retried or failed like transfer errors.
+        """
+        filename = file.name
+        self.active.add(filename)
+        self.progress.start(filename)
+        self.upload_journal.set_file_state(self.tag, filename, FILE_IN_PROGRESS,
+                                           attempts=self.attempts.get(filename, 1))
+        self.runner.submit(filename, lambda: self.create_worker(file))
+
+    def create_worker(self, file):
+        """ Runs on the runner's thread. :return: worker for file """
+        worker = self.get_worker(self.cred, self.tag, file)
+        if worker is None:
+            raise ValueError(f"Unknown protocol '{self.cred['protocol']}'.")
+
+        return worker
+
+    def process_events(self, timeout: float = None) -> list:
+        """
+        Handles the events reported by the workers since the last call and starts new files in the
+        freed slots, and files whose backoff has run out. Must be called regularly from the thread
+        that owns the engine.
+        :param timeout: seconds to wait for the first event, None returns immediately
+        :return: list of event tuples
+        """
+        events = []
+        try:
+            if timeout is None:
+                events.append(self.events.get_nowait())
+            else:
+                events.append(self.events.get(timeout=timeout))
+
+            while True:
+                events.append(self.events.get_nowait())
+        except queue.Empty:
+            pass
+
+        handled = []
+        for event in events:
+            if event[0] == 'finished':
+                handled.extend(self.on_finished(event[1], event[2]))
+            else:
+                handled.append(event)
+
+        if self.backoff and not self.is_paused:
+            self.upload_file()
+
+        return handled
+
+    def on_finished(self, filename, error=None) -> list:
+        """
+        :return: the event for the file, ('finished', ...) or ('retry', ...), followed by
+                 ('complete', ...) or ('paused',) if the run ended or stopped with it
+        """
+        self.active.discard(filename)
+        events = [('finished', filename, error)]
+
+        if error is None:
+            state = FILE_SKIPPED if self.progress.is_skipped(filename) else FILE_DONE
+            self.progress.complete(filename)
+            self._set_uploaded(filename)
+            self.upload_journal.set_file_state(self.tag, filename, state, checksums=self._unit_checksums(filename))
+            if self.order == 'sample':
+                self.commit_items()
+        else:
+            delay = self.schedule_retry(filename, error)
+            if delay is None:
+                self.failed[filename] = str(error)
+                self.upload_journal.set_file_state(self.tag, filename, FILE_FAILED, error=str(error))
+            else:
+                self.upload_journal.set_file_state(self.tag, filename, FILE_PENDING, error=str(error))
+                events = [('retry', filename, error, delay)]
+
+        if not self.is_paused:
+            self.upload_file()
+
+        if len(self.active) > 0:
+            return events
+
+        if self._run_finished():
+            return events + [('complete', self.finish())]
+
+        if self.is_paused:
+            self.telemetry.pause()
+            self.upload_journal.set_run_state(self.tag, RUN_INTERRUPTED)
+            return events + [('paused',)]
+
+        return events
+
+    def schedule_retry(self, filename, error: Exception):
+        """
+        Puts a failed file back in the queue after a backoff, if the error is transient and the
+        file has attempts and the run has budget left.
+        :return: delay in seconds, or None if the file has failed for good
+        """
+        attempt = self.attempts.get(filename, 1)
+        delay = self.file_retrier.next_delay(error, attempt)
+        if delay is None:
+            return None
+
+        self.attempts[filename] = attempt + 1
+        file = self.name2file[filename]
+        try:
+            size = file.size if isinstance(file, Bundle) else file.stat().st_size
+        except OSError:
+            size = self.filesizes[filename]
+        self.progress.register(filename, size)
+        self.backoff.append((time.monotonic() + delay, file))
+
+        return delay
+
+    def finish(self) -> bool:
+        """
+        Ends the run: writes the summary and, if every file was uploaded, stores the pseudo_ids not
+        stored yet.
+        :return: True if all files were uploaded
+        """
+        self.complete = True
+        self.telemetry.stop()
+        self.write_summary()
+
+        if self.all_uploads_done():
+            pidlids = self._get_pidlids()
+            if pidlids:
+                self.pidm.write_pidlids_to_csv(pidlids, self.tag)
+                self.committed.update(lid for _, lid in pidlids)
+                self.upload_journal.set_committed(self.tag, self.committed)
+            self.upload_journal.set_run_state(self.tag, RUN_COMPLETE)
+            return True
+
+        self.upload_journal.set_run_state(self.tag, RUN_FAILED)
+        return False
+
+    def all_uploads_done(self):
+        res = []
+        for name in self.items:
+            res.append(self.items[name].upload_complete())
+
+        if all(res):
+            return True
+
+        return False
+
+    def write_summary(self):
+        """
+        Writes throughput figures for the run to <tag>_upload_summary.json next to the meta file.
+        """
+        summary = {'tag': self.tag,
+                   'target_label': self.cred['target_label'],
+                   'protocol': self.cred['protocol'],
+                   'max_concurrent_files': self.max_concurrent,
+                   'failed': self.failed,
+                   'retried': {name: attempt - 1 for name, attempt in self.attempts.items()},
+                   'retry_budget_left': self.retry_budget.left,
+                   'committed_samples': sorted(self.committed),
+                   'bundle_mode': self.bundle_mode,
+                   'bundles': {name: len(bundle.files) for name, bundle in self.bundles.items()}}
+        summary.update(self.telemetry.summary())
+
+        with open(self.summaryfile, 'w', encoding='utf-8') as outfile:
+            json.dump(summary, outfile, indent=2)
+
+    def get_connection(self, cred):
+        """
+        Returns the connection shared by all workers in this run, created on first use, by the
+        first worker; the others wait for it. On S3, stale multipart uploads are aborted first. If
+        that fails, the next worker tries again.
+        :param cred: credentials dict
+        :return: S3Connection, SFTPConnectionPool or None
+        """
+        with self.connection_lock:
+            if self.connection is None and cred['protocol'] == "S3":
+                connection = S3Connection(cred, self.max_concurrent * S3_PART_CONCURRENCY)
+                try:
+                    self.abort_stale_multipart_uploads(cred, connection)
+                except Exception:
+                    connection.close()
+                    raise
+                self.tuner = S3TransferTuner(cred, connection.max_pool_connections, S3_PART_CONCURRENCY)
+                self.connection = connection
+            elif self.connection is None and cred['protocol'] == "SFTP":
+                self.connection = SFTPConnectionPool(cred, self.tag, self.max_concurrent)
+
+            return self.connection
+
+    def abort_stale_multipart_uploads(self, cred, connection: S3Connection):
+        """
+        Aborts journaled multipart uploads on this target that were started more than
+        'multipart_stale_hours' ago (credentials json, default one week) and never completed.
+        :param cred: credentials dict
+        :param connection: the run's S3 connection
+        """
+        max_age = float(cred.get('multipart_stale_hours', 168)) * 3600
+        abort_stale_uploads(connection.client,
+                            connection.bucket,
+                            connection.endpoint,
+                            self.journal_dir,
+                            max_age,
+                            skip=self.journal.path)
+
+    def close(self):
+        """
+        Waits for files in flight, records them in the journal and closes the connection. The
+        engine can not be restarted.
+        """
+        if self.closed:
+            return
+
+        self.is_paused = True
+        self.runner.shutdown()
+        self.process_events()
+        if not self.complete:
+            self.upload_journal.set_run_state(self.tag, RUN_INTERRUPTED)
+        self.upload_journal.close()
+        self.closed = True
+
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def get_remote_index(self, cred, file):
+        """
+        Returns the remote listing used to skip already uploaded files, or None if sync mode is off.
+        The meta file, the manifest and the upload complete file are always sent.
+        """
+        if not self.sync_mode or file not in self.seqfiles:
+            return None
+
+        connection = self.get_connection(cred)
+        with self.connection_lock:
+            if self.remote_index is None:
+                self.remote_index = RemoteIndex(cred, connection, self.tag)
+
+        return self.remote_index
+
+    def get_worker(self, cred, tag, file):
+        if isinstance(file, Bundle):
+            return self.get_bundle_worker(cred, tag, file)
+
+        if cred['protocol'] == "SFTP":
+            return ParamikoFileUploadWorker(cred, tag, file, self.progress, self.checksums,
+                                            self.get_connection(cred), self.get_remote_index(cred, file),
+                                            self.limiter, self.part_retrier)
+        elif cred['protocol'] == "S3":
+            connection = self.get_connection(cred)
+            return Boto3FileUploadWorker(cred, tag, file, self.progress, self.checksums, connection,
+                                         self.journal, self.tuner, self.get_remote_index(cred, file),
+                                         self.limiter, self.part_retrier)
+        else:
+            return None
+
+    def get_bundle_worker(self, cred, tag, bundle: Bundle):
+        if cred['protocol'] == "SFTP":
+            return ParamikoBundleUploadWorker(cred, bundle, self.progress, self.checksums,
+                                              self.get_connection(cred), self.limiter, self.part_retrier)
+        elif cred['protocol'] == "S3":
+            connection = self.get_connection(cred)
+            return Boto3BundleUploadWorker(tag, bundle, self.progress, self.checksums, connection,
+                                           self.tuner, self.limiter, self.part_retrier)
+        else:
+            return None
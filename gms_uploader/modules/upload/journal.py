@@ -0,0 +1,186 @@
+import json
+import pickle
+import sqlite3
+import time
+from pathlib import Path
+import pandas as pd
+
+
+JOURNAL_NAME = ".upload_journal.sqlite"
+
+# run states; runs in RESUMABLE_STATES still have work to do
+RUN_RUNNING = 'running'
+RUN_INTERRUPTED = 'interrupted'
+RUN_FAILED = 'failed'
+RUN_COMPLETE = 'complete'
+RUN_DISCARDED = 'discarded'
+RESUMABLE_STATES = [RUN_RUNNING, RUN_INTERRUPTED, RUN_FAILED]
+
+# file states
+FILE_PENDING = 'pending'
+FILE_IN_PROGRESS = 'in_progress'
+FILE_DONE = 'done'
+FILE_SKIPPED = 'skipped'
+FILE_FAILED = 'failed'
+
+
+
+class ResumeError(Exception):
+    """ A run in the upload journal can not be resumed """
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    tag TEXT PRIMARY KEY,
+    target_label TEXT NOT NULL,
+    protocol TEXT NOT NULL,
+    state TEXT NOT NULL,
+    metafile TEXT NOT NULL,
+    completefile TEXT NOT NULL,
+    options TEXT NOT NULL,
+    committed TEXT NOT NULL DEFAULT '[]',
+    df BLOB NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    tag TEXT NOT NULL REFERENCES runs(tag) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    internal_lab_id TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    checksums TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (tag, name)
+);
+"""
+
+
+def get_journal_path(metadata_dir: Path) -> Path:
+    return Path(metadata_dir, JOURNAL_NAME)
+
+
+class UploadJournal:
+    """
+    SQLite record of upload runs, in the metadata output path, so that a run survives closing the
+    dialog or a crash. Per tag it holds the submitted dataframe, the target and run options, the
+    samples whose pseudo_ids are stored, and for every file or bundle of the run its state (pending,
+    in_progress, done, skipped or failed), attempts and checksums. Multipart upload ids and parts
+    stay in the per-tag MultipartJournal, which is what lets a resumed S3 file continue from its
+    last part; an SFTP file in progress is sent again from the start, as a file written by several
+    streams has no contiguous part that is known to be complete.
+
+    Not thread-safe: used from the thread that owns the UploadEngine, and from the main window.
+    """
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(path))
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def add_run(self, tag: str, cred: dict, metafile: Path, completefile: Path, df: pd.DataFrame,
+                options: dict, files: list):
+        """
+        Records a new run with all its files pending.
+        :param tag: upload tag
+        :param cred: credentials dict, only target_label and protocol are stored
+        :param metafile: meta json path
+        :param completefile: upload complete file path
+        :param df: metadata dataframe, with pseudo_ids
+        :param options: run options (sync_mode, order, bundle_mode) to resume with
+        :param files: list of (name, internal_lab_id, size)
+        """
+        now = time.time()
+        with self.db:
+            self.db.execute("DELETE FROM runs WHERE tag = ?", (tag,))
+            self.db.execute("INSERT INTO runs (tag, target_label, protocol, state, metafile, completefile, "
+                            "options, df, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (tag, cred['target_label'], cred['protocol'], RUN_INTERRUPTED, str(metafile),
+                             str(completefile), json.dumps(options), pickle.dumps(df), now, now))
+            self.db.executemany("INSERT INTO files (tag, name, internal_lab_id, size, state, updated) "
+                                "VALUES (?, ?, ?, ?, ?, ?)",
+                                [(tag, name, str(lid), size, FILE_PENDING, now) for name, lid, size in files])
+
+    def get_run(self, tag: str) -> dict:
+        """
+        Raises ResumeError if the stored dataframe can not be read, e.g. a journal written with
+        another pandas version, or a damaged one.
+        :return: dict with the columns of the run, options and committed decoded and df unpickled,
+                 or None if the tag is not in the journal
+        """
+        row = self.db.execute("SELECT * FROM runs WHERE tag = ?", (tag,)).fetchone()
+        if row is None:
+            return None
+
+        run = dict(row)
+        run['options'] = json.loads(run['options'])
+        run['committed'] = json.loads(run['committed'])
+        try:
+            run['df'] = pickle.loads(run['df'])
+        except Exception as e:
+            raise ResumeError(f"the submitted metadata stored in the upload journal can not be read ({e}).") from e
+        run['metafile'] = Path(run['metafile'])
+        run['completefile'] = Path(run['completefile'])
+        return run
+
+    def resumable_runs(self) -> list:
+        """
+        :return: list of dicts with tag, target_label, protocol, state, updated and number of files
+                 and of finished files, for runs with work left, oldest first
+        """
+        rows = self.db.execute("SELECT r.tag, r.target_label, r.protocol, r.state, r.updated, "
+                               "COUNT(f.name) AS files, "
+                               "SUM(f.state IN (?, ?)) AS finished "
+                               "FROM runs r LEFT JOIN files f ON f.tag = r.tag "
+                               "WHERE r.state IN (?, ?, ?) GROUP BY r.tag ORDER BY r.created",
+                               (FILE_DONE, FILE_SKIPPED, *RESUMABLE_STATES)).fetchall()
+        return [dict(row) for row in rows]
+
+    def set_run_state(self, tag: str, state: str):
+        with self.db:
+            self.db.execute("UPDATE runs SET state = ?, updated = ? WHERE tag = ?", (state, time.time(), tag))
+
+    def set_run_options(self, tag: str, options: dict):
+        with self.db:
+            self.db.execute("UPDATE runs SET options = ?, updated = ? WHERE tag = ?",
+                            (json.dumps(options), time.time(), tag))
+
+    def set_committed(self, tag: str, lids):
+        with self.db:
+            self.db.execute("UPDATE runs SET committed = ?, updated = ? WHERE tag = ?",
+                            (json.dumps(sorted(str(lid) for lid in lids)), time.time(), tag))
+
+    def files(self, tag: str) -> dict:
+        """
+        :return: dict of name to dict with state, attempts, error and checksums (dict of
+                 filename to checksums, for a bundle one entry per member)
+        """
+        files = {}
+        for row in self.db.execute("SELECT * FROM files WHERE tag = ?", (tag,)):
+            entry = dict(row)
+            entry['checksums'] = json.loads(entry['checksums']) if entry['checksums'] else {}
+            files[row['name']] = entry
+
+        return files
+
+    def set_file_state(self, tag: str, name: str, state: str, attempts: int = None, error: str = None,
+                       checksums: dict = None):
+        with self.db:
+            self.db.execute("UPDATE files SET state = ?, attempts = COALESCE(?, attempts), error = ?, "
+                            "checksums = COALESCE(?, checksums), updated = ? WHERE tag = ? AND name = ?",
+                            (state, attempts, error, json.dumps(checksums) if checksums is not None else None,
+                             time.time(), tag, name))
+
+    def reset_unfinished(self, tag: str):
+        """ Puts the files of a resumed run that were in progress or failed back to pending """
+        with self.db:
+            self.db.execute("UPDATE files SET state = ?, error = NULL, updated = ? WHERE tag = ? AND state IN (?, ?)",
+                            (FILE_PENDING, time.time(), tag, FILE_IN_PROGRESS, FILE_FAILED))
@@ -0,0 +1,326 @@
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from botocore.exceptions import ClientError
+from gms_uploader.modules.upload.checksums import MultiHasher
+
+
+MB = 1024 * 1024
+MAX_PARTS = 10000
+MIN_PART_SIZE = 5 * MB
+
+
+class MultipartJournal:
+    """
+    On-disk record of in-progress S3 multipart uploads for one tag. For each object key the upload
+    id, part size, source file size/mtime and the ETags of completed parts are stored, so that an
+    interrupted upload can be resumed from the last completed part. A completed upload keeps its
+    entry, with the checksums of the file, until the caller is done with the object.
+    """
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    def _load(self) -> dict:
+        if not self.path.is_file():
+            return {}
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        if not self._entries:
+            if self.path.is_file():
+                self.path.unlink()
+            return
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, 'w', encoding='utf-8') as fh:
+            json.dump(self._entries, fh)
+        os.replace(tmp, self.path)
+
+    def keys(self) -> list:
+        with self._lock:
+            return list(self._entries.keys())
+
+    def get(self, key: str) -> dict:
+        with self._lock:
+            entry = self._entries.get(key)
+            return json.loads(json.dumps(entry)) if entry is not None else None
+
+    def start(self, key: str, upload_id: str, bucket: str, endpoint: str, part_size: int, file: Path):
+        stat = file.stat()
+        with self._lock:
+            self._entries[key] = {'upload_id': upload_id,
+                                  'bucket': bucket,
+                                  'endpoint': endpoint,
+                                  'part_size': part_size,
+                                  'file_size': stat.st_size,
+                                  'file_mtime': stat.st_mtime,
+                                  'created': time.time(),
+                                  'parts': {}}
+            self._save()
+
+    def add_part(self, key: str, part_number: int, etag: str):
+        with self._lock:
+            if key in self._entries:
+                self._entries[key]['parts'][str(part_number)] = etag
+                self._save()
+
+    def complete(self, key: str, checksums: dict):
+        with self._lock:
+            if key in self._entries:
+                self._entries[key]['checksums'] = checksums
+                self._save()
+
+    def remove(self, key: str):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._save()
+
+
+def abort_stale_uploads(client, bucket: str, endpoint: str, journal_dir: Path, max_age: float,
+                        skip: Path = None):
+    """
+    Aborts journaled multipart uploads older than max_age seconds on this bucket, and removes
+    them from their journals. Only uploads started by this application are touched.
+    :param client: boto3 s3 client
+    :param bucket: bucket name
+    :param endpoint: endpoint url
+    :param journal_dir: directory with per-tag journal files
+    :param max_age: age in seconds after which an unfinished upload is stale
+    :param skip: journal file to leave alone (the one of the current run)
+    :return: number of aborted uploads
+    """
+    if not journal_dir.is_dir():
+        return 0
+
+    now = time.time()
+    aborted = 0
+
+    for path in journal_dir.glob('*.json'):
+        if skip is not None and path == skip:
+            continue
+
+        journal = MultipartJournal(path)
+        for key in journal.keys():
+            entry = journal.get(key)
+            if entry['bucket'] != bucket or entry['endpoint'] != endpoint:
+                continue
+
+            if now - entry['created'] < max_age:
+                continue
+
+            try:
+                client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=entry['upload_id'])
+            except ClientError:
+                pass
+
+            journal.remove(key)
+            aborted += 1
+
+    return aborted
+
+
+def get_part_size(filesize: int, part_size: int) -> int:
+    """ Smallest multiple of 1 MB, not below part_size, that keeps the upload within MAX_PARTS """
+    min_size = math.ceil(filesize / MAX_PARTS / MB) * MB
+    return max(part_size, min_size, MIN_PART_SIZE)
+
+
+class ResumableMultipartUpload:
+    """
+    Multipart upload of a single file. The upload id and each completed part are written to the
+    journal, and if the journal already holds an upload for the same key and unchanged file, the
+    parts still present on the server are reused and only the remaining ones are sent.
+
+    The file is read once, in order, by the calling thread, which hashes each part before handing
+    it to the part uploaders, so that the checksums of the exact bytes sent are available in
+    self.checksums afterwards. At most max_concurrency parts are held in memory. With a limiter
+    (RateLimiter), each part waits for its bytes before it is sent. With a retrier (Retrier), a part
+    that fails with a transient error is sent again after a backoff; the other parts carry on.
+
+    After the upload is completed the journal entry is marked complete rather than removed, and
+    the caller removes it with finish() once it no longer needs the object (e.g. after setting
+    its metadata). Running a completed upload again for the unchanged file only restores
+    self.checksums.
+    """
+    def __init__(self, connection, key: str, file: Path, part_size: int, max_concurrency: int,
+                 journal: MultipartJournal, metadata: dict, callback=None, tuner=None, limiter=None,
+                 retrier=None):
+        self.client = connection.client
+        self.bucket = connection.bucket
+        self.endpoint = connection.endpoint
+        self.key = key
+        self.file = file
+        self.filesize = file.stat().st_size
+        self.part_size = get_part_size(self.filesize, part_size)
+        self.max_concurrency = max(1, max_concurrency)
+        self.journal = journal
+        self.metadata = metadata
+        self.callback = callback
+        self.tuner = tuner
+        self.limiter = limiter
+        self.retrier = retrier
+        self.checksums = None
+
+    def run(self):
+        entry = self.journal.get(self.key)
+        if entry is not None and entry.get('checksums') is not None and self._unchanged(entry):
+            self.checksums = entry['checksums']
+            if self.callback is not None:
+                self.callback(self.filesize)
+            return
+
+        upload_id, parts = self._resume_or_create()
+
+        if self.callback is not None and parts:
+            self.callback(sum(self._part_length(num) for num in parts))
+
+        hasher = MultiHasher()
+        slots = threading.BoundedSemaphore(self.max_concurrency)
+        errors = []
+        futures = []
+
+        def part_done(future):
+            if future.exception() is not None:
+                errors.append(future.exception())
+            slots.release()
+
+        with open(self.file, 'rb') as fh, ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            for num in range(1, self._part_count() + 1):
+                data = fh.read(self._part_length(num))
+                hasher.update(data)
+
+                if num in parts:
+                    continue
+
+                slots.acquire()
+                if errors:
+                    slots.release()
+                    break
+
+                future = executor.submit(self._upload_part, upload_id, num, data)
+                future.add_done_callback(part_done)
+                futures.append(future)
+
+            for future in as_completed(futures):
+                num, etag = future.result()
+                parts[num] = etag
+
+        self.checksums = hasher.hexdigests()
+
+        self.client.complete_multipart_upload(Bucket=self.bucket,
+                                              Key=self.key,
+                                              UploadId=upload_id,
+                                              MultipartUpload={'Parts': [{'PartNumber': num, 'ETag': parts[num]}
+                                                                         for num in sorted(parts)]})
+        self.journal.complete(self.key, self.checksums)
+
+    def finish(self):
+        """ Removes the journal entry of the completed upload """
+        self.journal.remove(self.key)
+
+    def _part_count(self) -> int:
+        return max(1, math.ceil(self.filesize / self.part_size))
+
+    def _part_length(self, num: int) -> int:
+        start = (num - 1) * self.part_size
+        return min(self.part_size, self.filesize - start)
+
+    def _create(self):
+        resp = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key, Metadata=self.metadata)
+        upload_id = resp['UploadId']
+        self.journal.start(self.key, upload_id, self.bucket, self.endpoint, self.part_size, self.file)
+        return upload_id, {}
+
+    def _abort(self, upload_id: str):
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=upload_id)
+        except ClientError:
+            pass
+
+        self.journal.remove(self.key)
+
+    def _resume_or_create(self):
+        """
+        Resumes the journaled upload for this key if the source file is unchanged and the upload
+        still exists on the server, otherwise starts a new one.
+        :return: upload id, dict of completed part number to ETag
+        """
+        entry = self.journal.get(self.key)
+        if entry is None:
+            return self._create()
+
+        if not self._unchanged(entry):
+            self._abort(entry['upload_id'])
+            return self._create()
+
+        self.part_size = entry['part_size']
+        upload_id = entry['upload_id']
+
+        try:
+            server_parts = self._list_parts(upload_id)
+        except ClientError:
+            self.journal.remove(self.key)
+            return self._create()
+
+        parts = {}
+        for num, (etag, size) in server_parts.items():
+            if num <= self._part_count() and size == self._part_length(num):
+                parts[num] = etag
+
+        return upload_id, parts
+
+    def _unchanged(self, entry: dict) -> bool:
+        """ True if the journal entry is for this bucket and the source file is unchanged """
+        stat = self.file.stat()
+        return entry['file_size'] == stat.st_size and entry['file_mtime'] == stat.st_mtime \
+            and entry['bucket'] == self.bucket and entry['endpoint'] == self.endpoint
+
+    def _list_parts(self, upload_id: str) -> dict:
+        parts = {}
+        paginator = self.client.get_paginator('list_parts')
+        for page in paginator.paginate(Bucket=self.bucket, Key=self.key, UploadId=upload_id):
+            for part in page.get('Parts', []):
+                parts[part['PartNumber']] = (part['ETag'], part['Size'])
+
+        return parts
+
+    def _upload_part(self, upload_id: str, num: int, data: bytes):
+        if self.retrier is not None:
+            etag = self.retrier.call(self._send_part, upload_id, num, data)
+        else:
+            etag = self._send_part(upload_id, num, data)
+
+        self.journal.add_part(self.key, num, etag)
+
+        if self.callback is not None:
+            self.callback(len(data))
+
+        return num, etag
+
+    def _send_part(self, upload_id: str, num: int, data: bytes) -> str:
+        if self.limiter is not None:
+            self.limiter.acquire(len(data))
+
+        t0 = time.monotonic()
+        resp = self.client.upload_part(Bucket=self.bucket,
+                                       Key=self.key,
+                                       UploadId=upload_id,
+                                       PartNumber=num,
+                                       Body=data)
+
+        if self.tuner is not None:
+            self.tuner.record(len(data), time.monotonic() - t0)
+
+        return resp['ETag']
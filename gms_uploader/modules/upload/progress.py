@@ -0,0 +1,266 @@
+import threading
+import time
+from datetime import datetime
+
+
+MB = 1024 * 1024
+
+
+class ProgressAggregator:
+    """
+    Byte counters for all files in an upload run. Workers update them from their transfer
+    callbacks, which only takes a lock and an addition, and the GUI polls take_changes() on a timer
+    to apply all progress bar updates in one batch, instead of receiving one cross-thread signal
+    per transferred chunk.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sizes = {}
+        self._transferred = {}
+        self._started = {}
+        self._finished = {}
+        self._skipped = set()
+        self._changed = set()
+
+    def register(self, name: str, size: int):
+        """ Adds a file, or resets one that is sent again """
+        with self._lock:
+            self._sizes[name] = size
+            self._transferred[name] = 0
+            self._started.pop(name, None)
+            self._finished.pop(name, None)
+            self._changed.add(name)
+
+    def start(self, name: str):
+        with self._lock:
+            self._started[name] = time.monotonic()
+            self._finished.pop(name, None)
+
+    def skip(self, name: str):
+        """
+        Marks a file that was not transferred because it already exists on the target. Skipped
+        files count as done but are left out of byte totals and rates.
+        :param name: filename
+        """
+        with self._lock:
+            self._skipped.add(name)
+            self._started.pop(name, None)
+            self._transferred[name] = self._sizes[name]
+            self._changed.add(name)
+
+    def is_skipped(self, name: str) -> bool:
+        with self._lock:
+            return name in self._skipped
+
+    def add(self, name: str, nbytes: int):
+        with self._lock:
+            self._transferred[name] += nbytes
+            self._changed.add(name)
+
+    def set(self, name: str, nbytes: int):
+        with self._lock:
+            self._transferred[name] = nbytes
+            self._changed.add(name)
+
+    def complete(self, name: str):
+        with self._lock:
+            self._transferred[name] = self._sizes[name]
+            self._finished[name] = time.monotonic()
+            self._changed.add(name)
+
+    def callback(self, name: str):
+        """
+        Returns a boto3 style callback, called with the number of bytes sent since the last call.
+        :param name: filename
+        :return: callable
+        """
+        def _callback(nbytes):
+            self.add(name, nbytes)
+
+        return _callback
+
+    def percentage(self, name: str) -> int:
+        with self._lock:
+            return self._percentage(name)
+
+    def _percentage(self, name: str) -> int:
+        size = self._sizes[name]
+        if size == 0:
+            return 100 if self._transferred[name] > 0 else 0
+
+        return min(100, int((self._transferred[name] / size) * 100))
+
+    def file_rate(self, name: str) -> float:
+        """
+        Average rate of a started file, in bytes/s, up to now or to when it completed.
+        :param name: filename
+        :return: float, or None if the file has not been started
+        """
+        with self._lock:
+            return self._file_rate(name, time.monotonic())
+
+    def _file_rate(self, name: str, now: float):
+        if name not in self._started:
+            return None
+
+        elapsed = self._finished.get(name, now) - self._started[name]
+        if elapsed <= 0:
+            return None
+
+        return self._transferred[name] / elapsed
+
+    def totals(self):
+        """
+        :return: (bytes transferred, bytes in total) over all registered files
+        """
+        with self._lock:
+            transferred = sum(v for k, v in self._transferred.items() if k not in self._skipped)
+            total = sum(v for k, v in self._sizes.items() if k not in self._skipped)
+            return transferred, total
+
+    def file_stats(self) -> list:
+        """
+        :return: list of dicts with size, transferred bytes, seconds and rate for each started file
+        """
+        now = time.monotonic()
+        stats = []
+        with self._lock:
+            for name in self._started:
+                finished = self._finished.get(name)
+                stats.append({'file': name,
+                              'size': self._sizes[name],
+                              'transferred': self._transferred[name],
+                              'complete': finished is not None,
+                              'seconds': round((finished or now) - self._started[name], 3),
+                              'bytes_per_s': self._file_rate(name, now)})
+
+        return stats
+
+    def take_changes(self) -> dict:
+        """
+        Returns percentages of files updated since the previous call.
+        :return: dict of filename to percentage
+        """
+        with self._lock:
+            changes = {name: self._percentage(name) for name in self._changed}
+            self._changed = set()
+
+        return changes
+
+
+class UploadTelemetry:
+    """
+    Throughput and ETA for an upload run, computed from a ProgressAggregator. tick() is called
+    from the GUI timer; the moving average rate is an exponential average over ticks with a time
+    constant of 'smoothing' seconds.
+    """
+    def __init__(self, progress: ProgressAggregator, smoothing: float = 5.0):
+        self.progress = progress
+        self.smoothing = smoothing
+
+        self.started = None
+        self.finished = None
+        self.rate = 0.0
+        self.avg_rate = None
+        self.peak_rate = 0.0
+
+        self._t_start = None
+        self._t_last = None
+        self._bytes_last = 0
+        self._active_seconds = 0.0
+
+    def start(self):
+        if self.started is None:
+            self.started = datetime.now()
+
+        self._t_last = time.monotonic()
+        self._bytes_last, _ = self.progress.totals()
+
+    def pause(self):
+        self.tick()
+        self._t_last = None
+
+    def stop(self):
+        self.tick()
+        self._t_last = None
+        self.finished = datetime.now()
+
+    def tick(self) -> dict:
+        """
+        Updates rates and returns the current figures.
+        :return: dict with rate, avg_rate and mean_rate in bytes/s, transferred, total and
+                 remaining bytes, and eta in seconds (None if unknown)
+        """
+        transferred, total = self.progress.totals()
+        now = time.monotonic()
+
+        if self._t_last is not None:
+            dt = now - self._t_last
+            if dt > 0:
+                self.rate = max(0, transferred - self._bytes_last) / dt
+                weight = min(1.0, dt / self.smoothing)
+                if self.avg_rate is None:
+                    self.avg_rate = self.rate
+                else:
+                    self.avg_rate += weight * (self.rate - self.avg_rate)
+                self.peak_rate = max(self.peak_rate, self.rate)
+                self._active_seconds += dt
+
+            self._t_last = now
+
+        self._bytes_last = transferred
+
+        remaining = total - transferred
+        eta = None
+        if self.avg_rate:
+            eta = remaining / self.avg_rate
+
+        return {'rate': self.rate,
+                'avg_rate': self.avg_rate or 0.0,
+                'mean_rate': self.mean_rate(),
+                'transferred': transferred,
+                'total': total,
+                'remaining': remaining,
+                'eta': eta}
+
+    def mean_rate(self) -> float:
+        transferred, _ = self.progress.totals()
+        if self._active_seconds <= 0:
+            return 0.0
+
+        return transferred / self._active_seconds
+
+    def summary(self) -> dict:
+        transferred, total = self.progress.totals()
+        files = self.progress.file_stats()
+        for file in files:
+            rate = file.pop('bytes_per_s')
+            file['mb_per_s'] = round(rate / MB, 3) if rate else None
+
+        return {'started': self.started.isoformat() if self.started else None,
+                'finished': self.finished.isoformat() if self.finished else None,
+                'active_seconds': round(self._active_seconds, 3),
+                'total_bytes': total,
+                'transferred_bytes': transferred,
+                'mean_mb_per_s': round(self.mean_rate() / MB, 3),
+                'peak_mb_per_s': round(self.peak_rate / MB, 3),
+                'files': files}
+
+
+def format_rate(rate: float) -> str:
+    return f"{rate / MB:.1f} MB/s"
+
+
+def format_bytes(nbytes: float) -> str:
+    if nbytes >= 1024 * MB:
+        return f"{nbytes / (1024 * MB):.2f} GB"
+
+    return f"{nbytes / MB:.1f} MB"
+
+
+def format_eta(seconds) -> str:
+    if seconds is None:
+        return "--:--:--"
+
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{(seconds % 3600) // 60:02d}:{seconds % 60:02d}"
@@ -0,0 +1,124 @@
+import errno
+import random
+import socket
+import threading
+import time
+import paramiko
+from botocore.exceptions import ClientError, BotoCoreError, ConnectionError as BotoConnectionError, \
+    HTTPClientError, ResponseStreamingError
+
+# S3 error codes worth another attempt
+TRANSIENT_S3_CODES = {'RequestTimeout', 'RequestTimeTooSkewed', 'SlowDown', 'Throttling', 'ThrottlingException',
+                      'InternalError', 'ServiceUnavailable', 'OperationAborted', 'BadDigest', 'IncompleteBody'}
+
+TRANSIENT_ERRNOS = {errno.ECONNRESET, errno.ECONNREFUSED, errno.ECONNABORTED, errno.ETIMEDOUT, errno.EPIPE,
+                    errno.ENETUNREACH, errno.ENETDOWN, errno.EHOSTUNREACH}
+
+
+def is_transient(error: Exception) -> bool:
+    """
+    Classifies an upload error. Transient errors (lost or refused connections, timeouts, throttling
+    and 5xx responses, a size mismatch after a put) are retried; everything else, e.g. denied access,
+    a missing bucket, bad credentials or a missing local file, is fatal.
+    :param error: exception raised by a transfer
+    :return: True if the transfer may succeed on another attempt
+    """
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code', '')
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return code in TRANSIENT_S3_CODES or status >= 500 or status == 429
+
+    if isinstance(error, (BotoConnectionError, socket.timeout, TimeoutError, ConnectionError, EOFError)):
+        return True
+
+    # read timeouts and connections closed mid-request, once botocore's own retries are used up
+    if isinstance(error, (HTTPClientError, ResponseStreamingError)):
+        return True
+
+    if isinstance(error, BotoCoreError):
+        return False
+
+    if isinstance(error, paramiko.AuthenticationException):
+        return False
+
+    if isinstance(error, paramiko.SSHException):
+        return True
+
+    if isinstance(error, (FileNotFoundError, PermissionError, IsADirectoryError)):
+        return False
+
+    if isinstance(error, OSError):
+        return error.errno in TRANSIENT_ERRNOS or error.errno is None
+
+    return False
+
+
+class RetryBudget:
+    """ Number of retries left for a whole run, shared by file and part retries """
+    def __init__(self, retries: int):
+        self._lock = threading.Lock()
+        self.left = max(0, retries)
+
+    def take(self) -> bool:
+        with self._lock:
+            if self.left <= 0:
+                return False
+
+            self.left -= 1
+            return True
+
+
+class Retrier:
+    """
+    Retry policy with jittered exponential backoff: attempt n (from 1) waits a random 50-100% of
+    min(max_delay, base_delay * 2 ** (n - 1)) seconds. Only transient errors are retried, at most
+    attempts - 1 times, and each retry is taken from the run's RetryBudget.
+    """
+    def __init__(self, attempts: int, base_delay: float, max_delay: float, budget: RetryBudget):
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+
+    @classmethod
+    def from_cred(cls, cred: dict, attempts_key: str, default_attempts: int, budget: RetryBudget):
+        """
+        :param cred: credentials dict, with optional 'retry_base_seconds' (default 2) and
+                     'retry_max_seconds' (default 120)
+        :param attempts_key: credentials key of the number of attempts
+        :param default_attempts: number of attempts if the key is not set
+        :param budget: RetryBudget of the run
+        :return: Retrier
+        """
+        return cls(int(cred.get(attempts_key, default_attempts)),
+                   float(cred.get('retry_base_seconds', 2)),
+                   float(cred.get('retry_max_seconds', 120)),
+                   budget)
+
+    def next_delay(self, error: Exception, attempt: int):
+        """
+        :param error: error of the failed attempt
+        :param attempt: number of the failed attempt, from 1
+        :return: seconds to wait before the next attempt, or None to give up
+        """
+        if attempt >= self.attempts or not is_transient(error) or not self.budget.take():
+            return None
+
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def call(self, func, *args, **kwargs):
+        """
+        Calls func until it succeeds, sleeping between attempts. Raises the last error when giving up.
+        """
+        attempt = 1
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                delay = self.next_delay(e, attempt)
+                if delay is None:
+                    raise
+
+            time.sleep(delay)
+            attempt += 1
@@ -0,0 +1,30 @@
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+
+def run_worker(events: queue.Queue, filename: str, make_worker):
+    """
+    Creates a worker with make_worker, runs it and reports ('finished', filename, error) on the
+    events queue, error being None on success. Creating the worker may connect to the target, so it
+    happens here, on the runner's thread, and its errors are reported the same way.
+    """
+    try:
+        make_worker().run()
+    except Exception as e:
+        events.put(('finished', filename, e))
+        return
+
+    events.put(('finished', filename, None))
+
+
+class ThreadRunner:
+    """ Runs each worker on a thread of a pool of max_concurrent threads """
+    def __init__(self, events: queue.Queue, max_concurrent: int, name: str):
+        self.events = events
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix=name)
+
+    def submit(self, filename: str, make_worker):
+        self.executor.submit(run_worker, self.events, filename, make_worker)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
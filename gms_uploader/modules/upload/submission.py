@@ -0,0 +1,79 @@
+from datetime import datetime
+from pathlib import Path
+import pandas as pd
+from gms_uploader.modules.validate.validate import validate
+
+
+class SubmissionError(Exception):
+    """ Raised when settings or metadata do not allow a submission. errors holds validation messages. """
+    def __init__(self, msg: str, errors: list = None):
+        super().__init__(msg)
+        self.errors = errors
+
+
+def prepare_submission(df: pd.DataFrame, conf: dict, settm, pidm, confirm=None):
+    """
+    Validates the metadata, generates pseudo_ids and writes <tag>_meta.json to the metadata output
+    path. Columns lab, host, seq_technology, lab_code, region_code and pseudo_id are set on df in
+    place.
+    :param df: metadata dataframe
+    :param conf: config dict
+    :param settm: SettingsManager
+    :param pidm: PseudoIDManager
+    :param confirm: function taking a question and returning True to continue, used when
+                    internal_lab_ids are already in the pseudo_id file. None declines.
+    :return: (tag, meta json path), or None if declined or no pseudo_ids could be generated
+    """
+    metadata_dir = settm.get_valid_metadata_dir()
+    if metadata_dir is None:
+        raise SubmissionError("Metadata output path is not valid.")
+
+    pseudo_id_file = pidm.get_file()
+    if pseudo_id_file is None:
+        raise SubmissionError("Path for pseudo_id file is not valid.")
+
+    if not pidm.validate_lab_code():
+        raise SubmissionError("pseudo_id file is not empty and lab_code does not "
+                              "exist in pseudo_id file. lab_code has been changed. "
+                              "Exiting.")
+
+    df['lab'] = settm.get_value('select_single', 'lab')
+    df['host'] = settm.get_value('select_single', 'host')
+    df['seq_technology'] = settm.get_value('select_single', 'seq_technology')
+
+    df2 = df.fillna('')
+    errors = validate(df2)
+
+    if errors:
+        raise SubmissionError("Metadata did not pass validation.", errors)
+
+    df['lab_code'] = df['lab'].apply(lambda x: conf['tr']['lab_to_code'][x])
+    df['region_code'] = df['region'].apply(lambda x: conf['tr']['region_to_code'][x])
+
+    lids = list(df['internal_lab_id'])
+
+    if not pidm.validate_lids(lids):
+        text = ("internal_lab_id(s) already stored in pseudo_id file.\n"
+                "Continue to upload anyway?")
+        if confirm is None or not confirm(text):
+            return None
+
+    pseudo_ids = pidm.generate_pids_from_lids(df['internal_lab_id'].tolist())
+
+    if pseudo_ids is None:
+        return None
+
+    df['pseudo_id'] = pseudo_ids
+
+    meta_fields = [field for field in conf['model_fields'] if conf['model_fields'][field]['to_meta']]
+    df_submit = df[meta_fields]
+
+    now = datetime.now()
+    tag = now.strftime("%Y-%m-%dT%H.%M.%S")
+
+    json_file = Path(metadata_dir, tag + "_meta.json")
+
+    with open(json_file, 'w', encoding='utf-8') as outfile:
+        df_submit.to_json(outfile, orient="records", force_ascii=False)
+
+    return tag, json_file
@@ -1,137 +1,412 @@
 import os
+import queue
 import threading
-import paramiko
-from PySide6.QtCore import QObject, Signal
-from PySide6.QtWidgets import QMessageBox
-from PySide6.QtGui import QIcon
 from pathlib import Path
-import boto3
-from botocore.exceptions import ClientError
-from botocore.client import Config
 from boto3.s3.transfer import TransferConfig
-
-
-class Boto3CallbackPercentage(object):
-    def __init__(self, file, progress):
+from gms_uploader.modules.upload.connections import S3Connection, SFTPConnectionPool
+from gms_uploader.modules.upload.multipart import MultipartJournal, ResumableMultipartUpload
+from gms_uploader.modules.upload.tuning import S3TransferTuner
+from gms_uploader.modules.upload.progress import ProgressAggregator
+from gms_uploader.modules.upload.sync import RemoteIndex
+from gms_uploader.modules.upload.checksums import ChecksumStore, HashingReader, MultiHasher
+from gms_uploader.modules.upload.throttle import RateLimiter, ThrottledReader
+from gms_uploader.modules.upload.retry import Retrier
+from gms_uploader.modules.upload.bundle import Bundle, S3StreamWriter, write_bundle, index_to_bytes, \
+    add_member_checksums
+
+
+# Default upper limit of parts of a single file uploaded in parallel by the S3 worker
+S3_PART_CONCURRENCY = 15
+
+
+def acquire_channel(pool: SFTPConnectionPool, retrier: Retrier = None):
+    """ Takes a channel from the pool, retrying transient connection errors if a retrier is given """
+    if retrier is None:
+        return pool.acquire()
+
+    return retrier.call(pool.acquire)
+
+
+class Boto3FileUploadWorker:
+    """
+    Uploads one file to S3 with the run's shared client. run() is called from the runner of the
+    UploadEngine and raises on failure. With a retrier, each request sending data (a small file, a
+    part) is retried on its own before the file fails.
+    """
+    def __init__(self, cred, tag, file, progress: ProgressAggregator, checksums: ChecksumStore,
+                 connection: S3Connection, journal: MultipartJournal, tuner: S3TransferTuner,
+                 remote_index: RemoteIndex = None, limiter: RateLimiter = None, retrier: Retrier = None):
+        self.tag = tag
         self.file = str(file)
         self.filename = file.name
-        self._size = float(os.path.getsize(self.file))
-        self._seen_so_far = 0
-        self._lock = threading.Lock()
-        self.progress = progress
+        self.filesize = float(os.path.getsize(self.file))
 
-    def __call__(self, bytes_amount):
-        with self._lock:
-            self._seen_so_far += bytes_amount
-            percentage = int((self._seen_so_far / self._size) * 100)
-            self.progress.emit(self.filename, percentage)
+        self.progress = progress
+        self.checksums = checksums
+        self.connection = connection
+        self.journal = journal
+        self.tuner = tuner
+        self.remote_index = remote_index
+        self.limiter = limiter
+        self.retrier = retrier
+        self.s3 = connection.client
+        self.bucket = connection.bucket
+        self.checksum_metadata = bool(cred.get('s3_checksum_metadata', False))
 
+        self.target = tag + "/" + self.filename
 
-class Boto3FileUploadWorker(QObject):
-    finished = Signal(str)
-    progress = Signal(str, int)
+    def run(self):
+        if self.remote_index is not None and self.remote_index.is_uploaded(Path(self.file), self.checksums):
+            self.progress.skip(self.filename)
+        else:
+            self.upload_file()
 
-    def __init__(self, cred, tag, file):
-        super(Boto3FileUploadWorker, self).__init__()
+    def upload_file(self):
+        callback = self.progress.callback(self.filename)
+
+        if not self.tuner.use_multipart(self.filesize):
+            with open(self.file, 'rb') as fh:
+                data = fh.read()
+
+            hasher = MultiHasher()
+            hasher.update(data)
+            checksums = hasher.hexdigests()
+
+            metadata = {"tag": self.tag}
+            metadata.update(checksums)
+            self.put_object(data, metadata)
+            callback(len(data))
+        else:
+            self.tuner.file_started()
+            try:
+                part_size, concurrency = self.tuner.plan(int(self.filesize))
+                upload = ResumableMultipartUpload(self.connection,
+                                                  self.target,
+                                                  Path(self.file),
+                                                  part_size=part_size,
+                                                  max_concurrency=concurrency,
+                                                  journal=self.journal,
+                                                  metadata={"tag": self.tag},
+                                                  callback=callback,
+                                                  tuner=self.tuner,
+                                                  limiter=self.limiter,
+                                                  retrier=self.retrier)
+                upload.run()
+                checksums = upload.checksums
+                if self.checksum_metadata:
+                    self.set_checksum_metadata(checksums, upload.part_size)
+                upload.finish()
+            finally:
+                self.tuner.file_finished()
+
+        self.checksums.add(self.filename, checksums)
 
-        self.tag = tag
+        if self.filesize == 0:
+            self.progress.complete(self.filename)
+
+    def put_object(self, data: bytes, metadata: dict):
+        def put():
+            if self.limiter is not None:
+                self.limiter.acquire(len(data))
+            self.s3.put_object(Bucket=self.bucket, Key=self.target, Body=data, Metadata=metadata)
+
+        if self.retrier is not None:
+            self.retrier.call(put)
+        else:
+            put()
+
+    def set_checksum_metadata(self, checksums: dict, part_size: int):
+        """
+        Adds the checksums to the metadata of a multipart-uploaded object, only with
+        's3_checksum_metadata' set in the credentials. Metadata is fixed when a multipart upload is
+        created, before the checksums are known, so the object is copied onto itself server-side
+        with replaced metadata; no data passes through the client, but the storage reads and writes
+        the whole object a second time. Without the option the checksums of such objects are kept
+        in the manifest and meta.json only. Objects over 5 GB are copied in
+        parts of the original part size, which keeps the ETag layout. The copy is retried like a
+        part; until it succeeds the upload stays in the journal, marked complete, so that a retry
+        or resumed run only repeats the copy.
+        """
+        metadata = {"tag": self.tag}
+        metadata.update(checksums)
+
+        config = TransferConfig(multipart_threshold=5 * 1024 * 1024 * 1024,
+                                multipart_chunksize=part_size)
+
+        def copy():
+            self.s3.copy({'Bucket': self.bucket, 'Key': self.target},
+                         self.bucket,
+                         self.target,
+                         ExtraArgs={'Metadata': metadata, 'MetadataDirective': 'REPLACE'},
+                         Config=config)
+
+        if self.retrier is not None:
+            self.retrier.call(copy)
+        else:
+            copy()
+
+
+class ParamikoFileUploadWorker:
+    """
+    Uploads one file over SFTP using a channel from the run's connection pool. With
+    'sftp_transfer_mode': 'pipelined' in the credentials json, the file is written with pipelined
+    requests from a large read buffer ('sftp_read_buffer_kb', default 1024), optionally split over
+    several channels ('sftp_streams', default 1), each writing its own byte range. run() is called
+    from the runner of the UploadEngine and raises on failure. With a retrier, opening a channel is
+    retried; a failed write fails the file, which the engine may then send again as a whole.
+    """
+
+    def __init__(self, cred, tag, file, progress: ProgressAggregator, checksums: ChecksumStore,
+                 pool: SFTPConnectionPool, remote_index: RemoteIndex = None, limiter: RateLimiter = None,
+                 retrier: Retrier = None):
         self.file = str(file)
         self.filename = file.name
         self.filesize = float(os.path.getsize(self.file))
 
-        print(cred)
-
-        session = boto3.session.Session(aws_access_key_id=cred['aws_access_key_id'],
-                                        aws_secret_access_key=cred['aws_secret_access_key'])
-
-        s3_config = Config(s3={'addressing_style': 'path', 'payload_signing_enabled': True},
-                           signature_version='s3v4')
+        self.progress = progress
+        self.checksums = checksums
+        self.pool = pool
+        self.remote_index = remote_index
+        self.limiter = limiter
+        self.retrier = retrier
+        self.sftp = None
+        self.target = pool.target_path + "/" + self.filename
+
+        self.transfer_mode = cred.get('sftp_transfer_mode', 'default')
+        self.read_buffer = max(32, int(cred.get('sftp_read_buffer_kb', 1024))) * 1024
+        self.streams = max(1, int(cred.get('sftp_streams', 1)))
 
-        self.s3 = session.resource('s3',
-                                   endpoint_url=cred['endpoint'],
-                                   verify=False,  # Checks for SLL certificate. Disables because of already "secure" solution.
-                                   config=s3_config)
+    def run(self):
+        if self.remote_index is not None and self.remote_index.is_uploaded(Path(self.file), self.checksums):
+            self.progress.skip(self.filename)
+            return
 
-        self.bucket = self.s3.Bucket(cred['bucket'])
+        self.sftp = acquire_channel(self.pool, self.retrier)
+        try:
+            self.upload_file()
+            self.set_remote_mtime()
+        except Exception:
+            self.pool.release(self.sftp, broken=True)
+            raise
 
-        self.transfer_config = TransferConfig(multipart_threshold=10000000,
-                                              max_concurrency=15,
-                                              multipart_chunksize=10000000)
+        self.pool.release(self.sftp)
 
-        self.target = tag + "/" + self.filename
+    def upload_file(self):
 
-    def run(self):
-        self.upload_file()
-        self.finished.emit(self.filename)
+        if self.transfer_mode == 'pipelined':
+            checksums = self.upload_file_pipelined()
+        else:
+            with open(self.file, 'rb') as fh:
+                reader = HashingReader(fh if self.limiter is None else ThrottledReader(fh, self.limiter))
+                self.sftp.putfo(reader, self.target, file_size=int(self.filesize),
+                                callback=self.percentage_transferred)
+            checksums = reader.hexdigests()
 
-    def upload_file(self):
-        self.bucket.upload_file(self.file,
-                                self.target,
-                                ExtraArgs={'Metadata': {"tag": self.tag}},
-                                Config=self.transfer_config,
-                                Callback=Boto3CallbackPercentage(Path(self.file), self.progress))
+        self.checksums.add(self.filename, checksums)
 
         if self.filesize == 0:
-            self.progress.emit(self.filename, 100)
+            self.progress.complete(self.filename)
+
+    def set_remote_mtime(self):
+        """ Copies the local modification time to the uploaded file, used to recognise it in sync mode """
+        stat = os.stat(self.file)
+        self.sftp.utime(self.target, (stat.st_atime, stat.st_mtime))
+
+    def upload_file_pipelined(self) -> dict:
+        """
+        Reads the file once, in order, hashing each block before it is written. With several
+        streams, block k is written by stream k % streams, each on its own channel.
+        :return: checksums of the bytes sent
+        """
+        size = int(self.filesize)
+        hasher = MultiHasher()
+
+        if self.streams == 1 or size < self.streams * self.read_buffer:
+            with open(self.file, 'rb') as local, \
+                    self.sftp.open(self.target, 'wb', bufsize=self.read_buffer) as remote:
+                remote.set_pipelined(True)
+                for data in iter(lambda: local.read(self.read_buffer), b''):
+                    hasher.update(data)
+                    if self.limiter is not None:
+                        self.limiter.acquire(len(data))
+                    remote.write(data)
+                    self.progress.add(self.filename, len(data))
+        else:
+            self._put_streams(hasher)
+
+        remote_size = self.sftp.stat(self.target).st_size
+        if remote_size != size:
+            raise IOError(f"size mismatch in put!  {remote_size} != {size}")
+
+        return hasher.hexdigests()
+
+    def _put_streams(self, hasher: MultiHasher):
+        with self.sftp.open(self.target, 'wb'):
+            pass
+
+        channels = [self.sftp]
+        queues = []
+        threads = []
+        errors = []
+
+        def write_blocks(sftp, blocks):
+            try:
+                with sftp.open(self.target, 'r+b', bufsize=self.read_buffer) as remote:
+                    remote.set_pipelined(True)
+                    for offset, data in iter(blocks.get, None):
+                        if self.limiter is not None:
+                            self.limiter.acquire(len(data))
+                        remote.seek(offset)
+                        remote.write(data)
+                        self.progress.add(self.filename, len(data))
+            except Exception as e:
+                errors.append(e)
+                for _ in iter(blocks.get, None):
+                    pass
+
+        # whatever fails, on this thread or a writer, the writers are stopped and joined and the
+        # channels taken from the pool are given back
+        try:
+            for _ in range(self.streams - 1):
+                channels.append(acquire_channel(self.pool, self.retrier))
 
-        # self.hcpm.upload_file(self.file,
-        #                       self.target,
-        #                       metadata={'tag': self.tag},
-        #                       callback=NGPIrisCallbackPercentage(Path(self.file), self.progress))
+            for sftp in channels:
+                queues.append(queue.Queue(maxsize=4))
+                threads.append(threading.Thread(target=write_blocks, args=(sftp, queues[-1])))
+                threads[-1].start()
 
+            offset = 0
+            with open(self.file, 'rb') as local:
+                for k, data in enumerate(iter(lambda: local.read(self.read_buffer), b'')):
+                    if errors:
+                        break
 
-class ParamikoFileUploadWorker(QObject):
-    finished = Signal(str)
-    progress = Signal(str, int)
+                    hasher.update(data)
+                    queues[k % len(queues)].put((offset, data))
+                    offset += len(data)
+        finally:
+            for blocks in queues:
+                blocks.put(None)
 
-    def __init__(self, cred, tag, file):
-        super(ParamikoFileUploadWorker, self).__init__()
+            for thread in threads:
+                thread.join()
 
-        self.file = str(file)
-        self.filename = file.name
-        self.filesize = float(os.path.getsize(self.file))
+            for sftp in channels[1:]:
+                self.pool.release(sftp, broken=bool(errors))
 
-        self.t = paramiko.Transport((cred['target_host'], 22))
-        self.t.banner_timeout = 10
-        self.t.connect(username=cred['usr'], password=cred['psw'])
-        self.sftp = paramiko.SFTPClient.from_transport(self.t)
+        if errors:
+            raise errors[0]
 
-        target_path = cred['base_path'] + "/" + tag
-        self.target = target_path + "/" + self.filename
+    def percentage_transferred(self, bytes_transferred, bytes_total):
 
-        if not self.sftp_exists(target_path):
-            self.sftp.mkdir(target_path)
+        self.progress.set(self.filename, bytes_transferred)
 
-    def run(self):
-        self.upload_file()
-        self.t.close()
-        self.finished.emit(self.filename)
 
-    def upload_file(self):
+class Boto3BundleUploadWorker:
+    """
+    Streams the files of one sample to S3 as a single tar object (see bundle.py), followed by its
+    member index. run() is called from the runner of the UploadEngine and raises on failure.
+    """
+    def __init__(self, tag, bundle: Bundle, progress: ProgressAggregator, checksums: ChecksumStore,
+                 connection: S3Connection, tuner: S3TransferTuner, limiter: RateLimiter = None,
+                 retrier: Retrier = None):
+        self.tag = tag
+        self.bundle = bundle
+        self.filename = bundle.name
 
-        self.sftp.put(self.file, self.target, callback=self.percentage_transferred)
+        self.progress = progress
+        self.checksums = checksums
+        self.connection = connection
+        self.tuner = tuner
+        self.limiter = limiter
+        self.retrier = retrier
+        self.s3 = connection.client
+        self.bucket = connection.bucket
 
-        if self.filesize == 0:
-            self.progress.emit(self.filename, 100)
+        self.target = tag + "/" + bundle.name
+        self.index_target = tag + "/" + bundle.index_name
 
-    def percentage_transferred(self, bytes_transferred, bytes_total):
+    def run(self):
+        self.tuner.file_started()
+        try:
+            part_size, concurrency = self.tuner.plan(self.bundle.size)
+            writer = S3StreamWriter(self.connection,
+                                    self.target,
+                                    self.bundle.max_archive_size(),
+                                    part_size=part_size,
+                                    max_concurrency=concurrency,
+                                    metadata={"tag": self.tag},
+                                    tuner=self.tuner,
+                                    retrier=self.retrier)
+            try:
+                index = write_bundle(self.bundle, writer, self.member_read)
+            except Exception:
+                writer.abort()
+                raise
+
+            writer.close()
+        finally:
+            self.tuner.file_finished()
+
+        def put_index():
+            self.s3.put_object(Bucket=self.bucket, Key=self.index_target, Body=index_to_bytes(index),
+                               Metadata={"tag": self.tag})
+
+        if self.retrier is not None:
+            self.retrier.call(put_index)
+        else:
+            put_index()
+
+        add_member_checksums(self.checksums, index)
+
+    def member_read(self, nbytes):
+        if self.limiter is not None:
+            self.limiter.acquire(nbytes)
+        self.progress.add(self.filename, nbytes)
+
+
+class ParamikoBundleUploadWorker:
+    """
+    Streams the files of one sample over SFTP as a single tar file (see bundle.py), written with
+    pipelined requests, followed by its member index. run() is called from the runner of the
+    UploadEngine and raises on failure.
+    """
+    def __init__(self, cred, bundle: Bundle, progress: ProgressAggregator, checksums: ChecksumStore,
+                 pool: SFTPConnectionPool, limiter: RateLimiter = None, retrier: Retrier = None):
+        self.bundle = bundle
+        self.filename = bundle.name
+
+        self.progress = progress
+        self.checksums = checksums
+        self.pool = pool
+        self.limiter = limiter
+        self.retrier = retrier
+        self.target = pool.target_path + "/" + bundle.name
+        self.index_target = pool.target_path + "/" + bundle.index_name
 
-        pct = int((bytes_transferred / bytes_total) * 100)
-        self.progress.emit(self.filename, pct)
+        self.write_buffer = max(32, int(cred.get('sftp_read_buffer_kb', 1024))) * 1024
 
-    def sftp_exists(self, path):
+    def run(self):
+        sftp = acquire_channel(self.pool, self.retrier)
         try:
-            self.sftp.stat(path)
-            return True
-        except FileNotFoundError:
-            return False
-
-
-class MsgUploadComplete(QMessageBox):
-    def __init__(self, msg):
-        super().__init__()
-        self.setMinimumWidth(700)
-        self.setIcon(QMessageBox.Information)
-        self.setText(msg)
-        self.setWindowTitle("Upload Complete")
-        self.setWindowIcon(QIcon('icons/arrow-up.png'))
+            with sftp.open(self.target, 'wb', bufsize=self.write_buffer) as remote:
+                remote.set_pipelined(True)
+                index = write_bundle(self.bundle, remote, self.member_read)
+
+            remote_size = sftp.stat(self.target).st_size
+            if remote_size != index['size']:
+                raise IOError(f"size mismatch in put!  {remote_size} != {index['size']}")
+
+            with sftp.open(self.index_target, 'wb') as remote:
+                remote.write(index_to_bytes(index))
+        except Exception:
+            self.pool.release(sftp, broken=True)
+            raise
+
+        self.pool.release(sftp)
+        add_member_checksums(self.checksums, index)
+
+    def member_read(self, nbytes):
+        if self.limiter is not None:
+            self.limiter.acquire(nbytes)
+        self.progress.add(self.filename, nbytes)
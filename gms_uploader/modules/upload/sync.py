@@ -0,0 +1,166 @@
+import hashlib
+import math
+import threading
+from pathlib import Path
+from botocore.exceptions import ClientError
+from gms_uploader.modules.upload.multipart import MB
+from gms_uploader.modules.upload.checksums import MultiHasher, hash_file
+
+
+class RemoteIndex:
+    """
+    Listing of what already exists under the tag on the target, used to skip files that are
+    already uploaded. The listing is made once per run with a single bulk request (paginated
+    list_objects_v2 under the tag prefix on S3, one listdir_attr of the tag directory on SFTP),
+    on first use, from whichever worker gets there first.
+
+    S3 objects match on size and ETag. The ETag of a single part upload is the MD5 of the file;
+    for multipart uploads it is the MD5 of the part MD5s, and the part size is recovered from the
+    part count, since the uploader only uses part sizes that are multiples of 1 MB.
+    SFTP files match on size and modification time, which the SFTP worker copies from the local
+    file after each upload.
+    """
+    def __init__(self, cred: dict, connection, tag: str):
+        self.protocol = cred['protocol']
+        self.connection = connection
+        self.tag = tag
+        self._remote = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._remote is None:
+                if self.protocol == "S3":
+                    self._remote = self._list_s3()
+                elif self.protocol == "SFTP":
+                    self._remote = self._list_sftp()
+                else:
+                    self._remote = {}
+
+        return self._remote
+
+    def _list_s3(self) -> dict:
+        remote = {}
+        prefix = self.tag + "/"
+        paginator = self.connection.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.connection.bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                name = obj['Key'][len(prefix):]
+                remote[name] = {'size': obj['Size'], 'etag': obj['ETag'].strip('"')}
+
+        return remote
+
+    def _list_sftp(self) -> dict:
+        remote = {}
+        sftp = self.connection.acquire()
+        try:
+            for attr in sftp.listdir_attr(self.connection.target_path):
+                remote[attr.filename] = {'size': attr.st_size, 'mtime': attr.st_mtime}
+        except FileNotFoundError:
+            pass
+        finally:
+            self.connection.release(sftp)
+
+        return remote
+
+    def is_uploaded(self, file: Path, checksums=None) -> bool:
+        """
+        True if the file exists on the target with the same size and checksum (S3) or
+        modification time (SFTP).
+        :param file: local file
+        :param checksums: ChecksumStore, receives the checksums of files found to be uploaded
+        :return: bool
+        """
+        try:
+            remote = self._load().get(file.name)
+        except (ClientError, OSError):
+            return False
+
+        if remote is None:
+            return False
+
+        stat = file.stat()
+        if remote['size'] != stat.st_size:
+            return False
+
+        if self.protocol == "SFTP":
+            if int(remote['mtime']) != int(stat.st_mtime):
+                return False
+
+            if checksums is not None:
+                checksums.add(file.name, hash_file(file))
+
+            return True
+
+        etags, digests = local_etags(file, stat.st_size, remote['etag'])
+        if remote['etag'] not in etags:
+            return False
+
+        if checksums is not None:
+            checksums.add(file.name, digests)
+
+        return True
+
+
+def multipart_part_sizes(filesize: int, parts: int) -> list:
+    """
+    Part sizes, in multiples of 1 MB, that split filesize into exactly the given number of parts.
+    :param filesize: size in bytes
+    :param parts: number of parts
+    :return: list of part sizes
+    """
+    if parts < 1 or filesize == 0:
+        return []
+
+    low = math.ceil(filesize / parts / MB) * MB
+    if parts == 1:
+        return [low]
+
+    high = math.ceil(filesize / (parts - 1))
+    return list(range(low, high, MB))
+
+
+def local_etags(file: Path, filesize: int, etag: str, max_candidates: int = 8) -> set:
+    """
+    ETags the file would get on S3, for the upload layouts consistent with a remote ETag. All
+    candidates are computed in one read of the file.
+    :param file: local file
+    :param filesize: size in bytes
+    :param etag: remote ETag, without quotes
+    :param max_candidates: give up (no match) if more part sizes than this are possible
+    :return: set of ETags, dict of whole-file checksums (see checksums.CHECKSUM_ALGORITHMS)
+    """
+    part_sizes = []
+    if '-' in etag:
+        parts = int(etag.split('-')[-1])
+        part_sizes = multipart_part_sizes(filesize, parts)
+        if not part_sizes or len(part_sizes) > max_candidates:
+            return set(), None
+
+    hasher = MultiHasher()
+    part_md5 = {size: hashlib.md5() for size in part_sizes}
+    part_digests = {size: [] for size in part_sizes}
+    offset = 0
+
+    with open(file, 'rb') as fh:
+        while True:
+            block = fh.read(MB)
+            if not block:
+                break
+
+            hasher.update(block)
+            offset += len(block)
+
+            for size in part_sizes:
+                part_md5[size].update(block)
+                if offset % size == 0 or offset == filesize:
+                    part_digests[size].append(part_md5[size].digest())
+                    part_md5[size] = hashlib.md5()
+
+    checksums = hasher.hexdigests()
+    etags = {checksums['md5']}
+    for size in part_sizes:
+        digests = part_digests[size]
+        etags.add(f"{hashlib.md5(b''.join(digests)).hexdigest()}-{len(digests)}")
+
+    return etags, checksums
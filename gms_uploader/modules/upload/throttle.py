@@ -0,0 +1,144 @@
+import threading
+import time
+from datetime import datetime
+
+# bytes/s per Mbit/s
+MBIT = 1000 * 1000 / 8
+
+
+class BandwidthSchedule:
+    """
+    Bandwidth limit by time of day, from the credentials json:
+
+        "bandwidth_limit_mbps": 200,
+        "bandwidth_schedule": [{"start": "22:00", "end": "06:00", "mbps": 0}]
+
+    'bandwidth_limit_mbps' applies outside the schedule windows. A window ending before it starts
+    runs past midnight. A limit of 0 means no limit. Limits are in Mbit/s.
+    """
+    def __init__(self, default_mbps: float = 0, windows: list = None):
+        self.default_mbps = max(0.0, float(default_mbps))
+        self.windows = []
+
+        for window in windows or []:
+            self.windows.append((self._minutes(window['start']),
+                                 self._minutes(window['end']),
+                                 max(0.0, float(window.get('mbps', 0)))))
+
+    @classmethod
+    def from_cred(cls, cred: dict):
+        return cls(cred.get('bandwidth_limit_mbps', 0), cred.get('bandwidth_schedule', []))
+
+    @staticmethod
+    def _minutes(hhmm: str) -> int:
+        hours, minutes = str(hhmm).split(':')
+        return int(hours) * 60 + int(minutes)
+
+    def limit_at(self, now: datetime) -> float:
+        """
+        :param now: local time
+        :return: limit in Mbit/s, 0 for no limit
+        """
+        minute = now.hour * 60 + now.minute
+        for start, end, mbps in self.windows:
+            if start <= end and start <= minute < end:
+                return mbps
+            if start > end and (minute >= start or minute < end):
+                return mbps
+
+        return self.default_mbps
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all transfers of a run. acquire() blocks until the bytes may be sent. A
+    request larger than the bucket is granted when the bucket is not in debt and leaves it in debt,
+    so whole S3 parts can be admitted while the average rate still holds.
+
+    The limit comes from the schedule, re-read every few seconds, unless set_limit() has been
+    called, which overrides the schedule for the rest of the run.
+    """
+    SCHEDULE_INTERVAL = 10
+
+    def __init__(self, schedule: BandwidthSchedule = None, burst_seconds: float = 1.0):
+        self.schedule = schedule if schedule is not None else BandwidthSchedule()
+        self.burst_seconds = burst_seconds
+        self.override = None
+
+        self._lock = threading.Lock()
+        self._rate = None
+        self._rate_checked = None
+        self._tokens = 0.0
+        self._last = time.monotonic()
+
+    @classmethod
+    def from_cred(cls, cred: dict):
+        return cls(BandwidthSchedule.from_cred(cred))
+
+    def set_limit(self, mbps):
+        """
+        :param mbps: limit in Mbit/s, 0 for no limit, None to return to the schedule
+        """
+        with self._lock:
+            self.override = None if mbps is None else max(0.0, float(mbps))
+            self._rate_checked = None
+
+    def limit(self) -> float:
+        """
+        :return: current limit in Mbit/s, 0 for no limit
+        """
+        with self._lock:
+            return self._current_rate(time.monotonic()) / MBIT
+
+    def _current_rate(self, now: float) -> float:
+        if self._rate_checked is None or now - self._rate_checked >= self.SCHEDULE_INTERVAL:
+            if self.override is not None:
+                mbps = self.override
+            else:
+                mbps = self.schedule.limit_at(datetime.now())
+
+            rate = mbps * MBIT
+            if rate != self._rate:
+                self._rate = rate
+                self._tokens = min(self._tokens, rate * self.burst_seconds)
+            self._rate_checked = now
+
+        return self._rate
+
+    def acquire(self, nbytes: int):
+        """
+        Blocks until nbytes may be sent.
+        :param nbytes: number of bytes
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                rate = self._current_rate(now)
+                if rate <= 0:
+                    self._last = now
+                    return
+
+                self._tokens = min(rate * self.burst_seconds, self._tokens + (now - self._last) * rate)
+                self._last = now
+
+                if self._tokens >= 0:
+                    self._tokens -= nbytes
+                    return
+
+                wait = -self._tokens / rate
+
+            # re-checked at least twice a second so that a changed limit applies promptly
+            time.sleep(min(wait, 0.5))
+
+
+class ThrottledReader:
+    """ File-like wrapper that takes every read through a RateLimiter """
+    def __init__(self, fh, limiter: RateLimiter):
+        self.fh = fh
+        self.limiter = limiter
+
+    def read(self, size=-1) -> bytes:
+        data = self.fh.read(size)
+        if data:
+            self.limiter.acquire(len(data))
+        return data
@@ -0,0 +1,117 @@
+import math
+import threading
+import time
+from gms_uploader.modules.upload.multipart import MB, MAX_PARTS, MIN_PART_SIZE
+
+
+class S3TransferTuner:
+    """
+    Picks multipart part size and per-file part concurrency for S3 uploads in a run, from the file
+    size, the number of files in flight and the throughput measured on completed parts.
+
+    Part concurrency is shared out from a run-wide budget of connections. The budget is adjusted
+    by hill climbing on the aggregate throughput: it grows while throughput improves and backs off
+    when it drops. Part size aims at parts that take about 's3_target_part_seconds' each at the
+    measured per-connection rate. New files pick up the current values; files already in flight
+    keep theirs.
+
+    Per target overrides (credentials json): s3_multipart_threshold_mb, s3_part_size_mb (fixed
+    part size), s3_min_part_size_mb, s3_max_part_size_mb, s3_max_concurrency (per file),
+    s3_target_part_seconds.
+    """
+    def __init__(self, cred: dict, max_connections: int, default_concurrency: int):
+        self.multipart_threshold = int(float(cred.get('s3_multipart_threshold_mb', 10)) * MB)
+        self.fixed_part_size = self._mb_or_none(cred.get('s3_part_size_mb'))
+        self.min_part_size = max(MIN_PART_SIZE, int(float(cred.get('s3_min_part_size_mb', 8)) * MB))
+        self.max_part_size = max(self.min_part_size, int(float(cred.get('s3_max_part_size_mb', 512)) * MB))
+        self.max_concurrency = max(1, int(cred.get('s3_max_concurrency', default_concurrency)))
+        self.target_part_seconds = float(cred.get('s3_target_part_seconds', 4))
+
+        self.max_connections = max(1, max_connections)
+        self.budget = self.max_connections
+        self.window_seconds = 10.0
+
+        self._files_in_flight = 0
+        self._conn_rate = None
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._last_rate = None
+        self._step = -max(1, self.max_connections // 8)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _mb_or_none(value):
+        if value is None:
+            return None
+
+        return int(float(value) * MB)
+
+    def file_started(self):
+        with self._lock:
+            self._files_in_flight += 1
+
+    def file_finished(self):
+        with self._lock:
+            self._files_in_flight = max(0, self._files_in_flight - 1)
+
+    def use_multipart(self, filesize: int) -> bool:
+        return filesize >= self.multipart_threshold
+
+    def plan(self, filesize: int):
+        """
+        Part size and part concurrency for a file about to be uploaded.
+        :param filesize: size in bytes
+        :return: (part_size, concurrency)
+        """
+        with self._lock:
+            files = max(1, self._files_in_flight)
+            concurrency = max(1, min(self.max_concurrency, self.budget // files))
+
+            if self.fixed_part_size is not None:
+                part_size = self.fixed_part_size
+            elif self._conn_rate is None:
+                part_size = self.min_part_size
+            else:
+                part_size = self._conn_rate * self.target_part_seconds
+
+        if self.fixed_part_size is None:
+            # enough parts to keep all part slots of this file busy
+            part_size = min(part_size, filesize / concurrency)
+            part_size = min(max(part_size, self.min_part_size), self.max_part_size)
+
+        part_size = max(part_size, filesize / MAX_PARTS)
+        part_size = int(math.ceil(part_size / MB) * MB)
+
+        parts = max(1, math.ceil(filesize / part_size))
+
+        return part_size, min(concurrency, parts)
+
+    def record(self, nbytes: int, seconds: float):
+        """
+        Records a completed part.
+        :param nbytes: part size in bytes
+        :param seconds: time spent sending the part
+        """
+        with self._lock:
+            if seconds > 0:
+                rate = nbytes / seconds
+                if self._conn_rate is None:
+                    self._conn_rate = rate
+                else:
+                    self._conn_rate = 0.8 * self._conn_rate + 0.2 * rate
+
+            self._window_bytes += nbytes
+            now = time.monotonic()
+            elapsed = now - self._window_start
+
+            if elapsed >= self.window_seconds:
+                self._adjust_budget(self._window_bytes / elapsed)
+                self._window_start = now
+                self._window_bytes = 0
+
+    def _adjust_budget(self, rate: float):
+        if self._last_rate is not None and rate < self._last_rate * 0.95:
+            self._step = -self._step
+
+        self._last_rate = rate
+        self.budget = min(self.max_connections, max(1, self.budget + self._step))
@@ -1,13 +1,15 @@
 import pandas as pd
-from PySide6.QtGui import QIcon, Qt
-from PySide6.QtCore import QThread
-from PySide6.QtWidgets import QProgressBar, QDialog, QHeaderView, QTableWidgetItem
+from PySide6.QtGui import QIcon
+from PySide6.QtCore import QTimer
+from PySide6.QtWidgets import QDialog, QHeaderView, QLabel, QCheckBox, QMessageBox, QSpinBox, QComboBox
 from gms_uploader.ui.uploader_dialog import Ui_Dialog as UI_Dialog_Uploader
-from gms_uploader.modules.upload.support_classes import ParamikoFileUploadWorker, Boto3FileUploadWorker, \
-    MsgUploadComplete
+from gms_uploader.modules.upload.engine import UploadEngine
+from gms_uploader.modules.upload.progress import format_rate, format_bytes, format_eta
+from gms_uploader.modules.models.uploadmodel import UploadTableModel
+from gms_uploader.modules.delegates.delegates import ProgressBarDelegate
+from gms_uploader.modules.dialogs.dialogs import MsgAlert
 import paramiko
 import boto3
-from botocore.exceptions import ClientError
 from gms_uploader.modules.pseudo_id.pseudo_id import PseudoIDManager
 from pathlib import Path
 import json
@@ -37,49 +39,19 @@ class ConnectionTester:
             )
 
 
-class Item:
-    def __init__(self, lid: str, pseudo_id: str, files: list):
-        self.lid = lid
-        self.pseudo_id = pseudo_id
-        self.dir = dir
-        self.files = files
-        self.fnames = self._get_filenames()
-        self.uploaded = self._get_uploaded_defaults()
-
-    def _get_filenames(self):
-        return [file.name for file in self.files]
-
-    def contains_filename(self, fname: str) -> bool:
-        if fname in self.fnames:
-            return True
-
-        return False
-
-    def _get_uploaded_defaults(self) -> dict:
-        uploaded = {}
-        for fname in self.fnames:
-            uploaded[fname] = False
-
-        return uploaded
-
-    def set_file_uploaded(self, fname: str):
-        self.uploaded[fname] = True
-
-    def upload_complete(self) -> bool:
-        res = list(self.uploaded.values())
-        if all(res):
-            return True
-
-        return False
-
-
 class Uploader(QDialog, UI_Dialog_Uploader):
+    """
+    Dialog front end of the UploadEngine. The engine's events and the workers' progress are polled
+    by progress_timer (10 Hz). With resume=True, an interrupted run of the tag is continued from the
+    upload journal.
+    """
     def __init__(self, cred: dict,
                  tag: str,
                  df: pd.DataFrame,
                  metafile: Path,
                  completefile: Path,
-                 pidm: PseudoIDManager):
+                 pidm: PseudoIDManager,
+                 resume: bool = False):
 
         super(Uploader, self).__init__()
         self.setupUi(self)
@@ -88,20 +60,9 @@ class Uploader(QDialog, UI_Dialog_Uploader):
 
         self.cred = cred
         self.tag = tag
-        self.df = df.copy(deep=True)
-        self.metafile = metafile
-        self.completefile = completefile
-        self.pidm = pidm
-
-        self.items = self._create_items()
-        self.fname2lid = {}
-        self.allfiles = []
-
-        self.progress_bars = {}
-        self.workers = {}
-        self.threads = {}
-
-        self.is_paused = False
+        self.engine = UploadEngine(cred, tag, df, metafile, completefile, pidm, resume=resume)
+        self.progress = self.engine.progress
+        self.telemetry = self.engine.telemetry
 
         self.pushButton_stop.setDisabled(True)
         self.pushButton_delete_upload.setDisabled(True)
@@ -113,39 +74,62 @@ class Uploader(QDialog, UI_Dialog_Uploader):
         self.lineEdit_target.setText(cred['target_label'])
         self.lineEdit_protocol.setText(cred['protocol'])
 
-        self.tableWidget.setColumnCount(3)
-        self.tableWidget.setHorizontalHeaderLabels(["file", "size", "progress"])
-
-        header = self.tableWidget.horizontalHeader()
-        header.setSectionResizeMode(0, QHeaderView.ResizeToContents)
-        header.setSectionResizeMode(1, QHeaderView.ResizeToContents)
-        header.setSectionResizeMode(2, QHeaderView.Stretch)
-
-        row_no = 0
-        for lid in self.items:
-            for file in self.items[lid].files:
-                fname = str(file.name)
-                fsize = str(round(self.bytes_to_megabytes(file.stat().st_size), 2)) + " MB"
-
-                self.fname2lid[fname] = self.items[lid].lid
-                self.allfiles.append(file)
-
-                self.progress_bars[fname] = QProgressBar()
-                self.progress_bars[fname].setRange(0, 100)
-                self.progress_bars[fname].setValue(0)
-                self.progress_bars[fname].setAlignment(Qt.AlignRight)
-
-                self.tableWidget.insertRow(row_no)
-
-                name_item = QTableWidgetItem(fname)
-                name_item.setFlags(Qt.ItemIsEnabled)
-                size_item = QTableWidgetItem(fsize)
-                size_item.setFlags(Qt.ItemIsEnabled)
-                self.tableWidget.setItem(row_no, 0, name_item)
-                self.tableWidget.setItem(row_no, 1, size_item)
-                self.tableWidget.setCellWidget(row_no, 2, self.progress_bars[fname])
-
-                row_no += 1
+        files = self.engine.files()
+        self.model = UploadTableModel([file.name for file in files],
+                                      [self.engine.filesizes[file.name] for file in files])
+        self.tableView.setModel(self.model)
+        self.tableView.setItemDelegateForColumn(UploadTableModel.PROGRESS_COLUMN, ProgressBarDelegate(self.tableView))
+
+        # fixed row heights and column widths measured once, on a sample of rows, keep layout
+        # independent of the number of files
+        self.tableView.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.tableView.verticalHeader().setDefaultSectionSize(self.tableView.fontMetrics().height() + 8)
+        header = self.tableView.horizontalHeader()
+        header.setResizeContentsPrecision(500)
+        self.tableView.resizeColumnsToContents()
+        header.setSectionResizeMode(0, QHeaderView.Interactive)
+        header.setSectionResizeMode(1, QHeaderView.Interactive)
+        header.setSectionResizeMode(2, QHeaderView.Interactive)
+        header.setSectionResizeMode(3, QHeaderView.Stretch)
+        header.resizeSection(2, max(header.sectionSize(2), self.tableView.fontMetrics().horizontalAdvance("000.0 MB/s") + 12))
+
+        self.label_stats = QLabel()
+        self.verticalLayout.insertWidget(self.verticalLayout.indexOf(self.tableView) + 1, self.label_stats)
+
+        self.checkBox_sync = QCheckBox("skip files already at target")
+        self.checkBox_sync.setToolTip("Lists the tag on the target once before upload and skips files\n"
+                                      "with matching size and checksum (S3) or size and mtime (SFTP).")
+        self.checkBox_sync.setChecked(self.engine.sync_mode)
+        self.horizontalLayout.insertWidget(0, self.checkBox_sync)
+
+        self.spinBox_limit = QSpinBox()
+        self.spinBox_limit.setRange(0, 100000)
+        self.spinBox_limit.setSuffix(" Mbit/s")
+        self.spinBox_limit.setSpecialValueText("no limit")
+        self.spinBox_limit.setToolTip("Bandwidth limit for all files of this upload, applied immediately.\n"
+                                      "Set from 'bandwidth_limit_mbps' and 'bandwidth_schedule' in the\n"
+                                      "credentials json; a value entered here replaces the schedule.")
+        self.spinBox_limit.setValue(round(self.engine.limiter.limit()))
+        self.spinBox_limit.valueChanged.connect(self.set_bandwidth_limit)
+        self.horizontalLayout.insertWidget(1, QLabel("limit"))
+        self.horizontalLayout.insertWidget(2, self.spinBox_limit)
+
+        self.comboBox_order = QComboBox()
+        self.comboBox_order.addItem("dataframe order", 'dataframe')
+        self.comboBox_order.addItem("largest first", 'largest')
+        self.comboBox_order.addItem("sample by sample", 'sample')
+        self.comboBox_order.setToolTip("Order of the sequence files. Largest first shortens runs with a few\n"
+                                       "large files. Sample by sample stores each pseudo_id as soon as\n"
+                                       "the files of the sample are uploaded. Meta, manifest and upload\n"
+                                       "complete files always go last.")
+        self.comboBox_order.setCurrentIndex(self.comboBox_order.findData(self.engine.order))
+        self.comboBox_order.currentIndexChanged.connect(self.set_order)
+        self.horizontalLayout.insertWidget(3, self.comboBox_order)
+
+        self.progress_timer = QTimer(self)
+        self.progress_timer.setInterval(100)
+        self.progress_timer.timeout.connect(self.poll)
+        self.progress_timer.start()
 
         self.pushButton_start.clicked.connect(self.start)
         self.pushButton_close.clicked.connect(self.close)
@@ -154,125 +138,123 @@ class Uploader(QDialog, UI_Dialog_Uploader):
     def verify_connection(self):
         pass
 
-    def _get_pidlids(self):
-        pidlids = []
-        for lid in self.items:
-            if self.items[lid].pseudo_id is not None:
-                pidlids.append((self.items[lid].pseudo_id, lid))
-
-        return pidlids
-
-    def _create_items(self) -> dict:
-        items = {}
-        for _, row in self.df.iterrows():
-            _files = []
-            _lid = row['internal_lab_id']
-            _pseudo_id = row['pseudo_id']
-
-            if row['fastq']:
-                _list = row["fastq"]
-                for filename in _list:
-                    _files.append(Path(row["seq_path"], filename))
-
-            if row['fast5']:
-                _list = row["fast5"]
-                for filename in _list:
-                    _files.append(Path(row["seq_path"], filename))
-
-            items[row['internal_lab_id']] = Item(_lid, _pseudo_id, _files)
-
-        items['metafile'] = Item('metafile', None, [self.metafile])
-        items['completefile'] = Item('completefile', None, [self.completefile])
-
-        return items
-
-    def upload_file(self):
-        if len(self.allfiles) > 0:
-            file = self.allfiles.pop(0)
-            filename = file.name
-
-            self.workers[filename] = self.get_worker(self.cred, self.tag, file)
-            if self.workers[filename] is not None:
-                self.threads[filename] = QThread()
-                self.workers[filename].moveToThread(self.threads[filename])
-                self.threads[filename].started.connect(self.workers[filename].run)
-                self.workers[filename].progress.connect(self.report_progress)
-                self.workers[filename].finished.connect(self.on_finished)
-                self.threads[filename].start()
-
-    def pause(self):
-        self.is_paused = True
-
-    def resume(self):
-        self.is_paused = False
-
-    def on_finished(self, filename):
-        self.threads[filename].quit()
-        self.workers[filename].deleteLater()
-        self.threads[filename].deleteLater()
+    def poll(self):
+        """
+        Handles engine events and applies progress changes. Called by progress_timer.
+        """
+        for event in self.engine.process_events():
+            if event[0] == 'finished' and event[2] is not None:
+                self.model.set_status(event[1], "failed", str(event[2]))
+            elif event[0] == 'retry':
+                self.model.set_status(event[1], f"retry in {event[3]:.0f} s", str(event[2]))
+            elif event[0] == 'paused':
+                self.on_paused()
+            elif event[0] == 'complete':
+                self.on_complete(event[1])
+
+        self.update_progress()
+
+    def on_paused(self):
+        self.pushButton_start.setDisabled(False)
+        self.pushButton_close.setDisabled(False)
 
-        if not self.is_paused and len(self.allfiles) > 0:
-            lid = self.fname2lid[filename]
-            self.items[lid].set_file_uploaded(filename)
-            self.upload_file()
+    def on_complete(self, all_done: bool):
+        self.pushButton_stop.setDisabled(True)
+        self.pushButton_start.setDisabled(True)
+        self.pushButton_close.setDisabled(False)
 
-        elif len(self.allfiles) == 0:
-            lid = self.fname2lid[filename]
-            self.items[lid].set_file_uploaded(filename)
+        self.update_progress()
 
-            self.pushButton_stop.setDisabled(True)
-            self.pushButton_close.setDisabled(False)
+        if all_done:
+            msg = MsgUploadComplete(f"Upload of data with tag {self.tag} is complete.\n "
+                                    f"Pseudo_ids are stored in the pseudo_id_file.")
 
-            if self._all_uploads_done():
-                pidlids = self._get_pidlids()
-                self.pidm.write_pidlids_to_csv(pidlids, self.tag)
-                msg = MsgUploadComplete(f"Upload of data with tag {self.tag} is complete.\n "
-                                        f"Pseudo_ids are stored in the pseudo_id_file.")
+            msg.exec()
 
-                msg.exec()
+        elif self.engine.committed:
+            msg = MsgUploadComplete(f"Upload of data with tag {self.tag} is complete \n "
+                                    f"but files were not listed as uploaded. Pseudo_ids of the \n"
+                                    f"{len(self.engine.committed)} completed samples are stored in the pseudo_id_file.")
 
-            else:
-                msg = MsgUploadComplete(f"Upload of data with tag {self.tag} is complete \n "
-                                        f"but files were not listed as uploaded. The pseudo_id_file \n"
-                                        f"was not updated.")
+            msg.exec()
 
-                msg.exec()
+        else:
+            msg = MsgUploadComplete(f"Upload of data with tag {self.tag} is complete \n "
+                                    f"but files were not listed as uploaded. The pseudo_id_file \n"
+                                    f"was not updated.")
 
-    def _all_uploads_done(self):
-        res = []
-        for name in self.items:
-            res.append(self.items[name].upload_complete())
+            msg.exec()
 
-        if all(res):
-            return True
+    def set_order(self, index: int):
+        self.engine.set_order(self.comboBox_order.itemData(index))
 
-        return False
+    def set_bandwidth_limit(self, mbps: int):
+        self.engine.limiter.set_limit(mbps)
 
     def stop(self):
-        self.pushButton_start.setDisabled(False)
+        """
+        Stops starting new files. Files already in flight are completed, start/close are
+        enabled once the last of them has finished.
+        """
         self.pushButton_stop.setDisabled(True)
-        self.pushButton_close.setDisabled(False)
-        self.pause()
+        self.engine.stop()
 
     def start(self):
         self.pushButton_stop.setDisabled(False)
         self.pushButton_start.setDisabled(True)
         self.pushButton_delete_upload.setDisabled(True)
         self.pushButton_close.setDisabled(True)
-        self.resume()
-        self.upload_file()
-
-    def report_progress(self, filename, pct):
-        print(f"report_progress {filename} {pct}")
-        self.progress_bars[filename].setValue(pct)
-
-    def bytes_to_megabytes(self, bytes):
-        return bytes/(1024*1024)
-
-    def get_worker(self, cred, tag, file):
-        if cred['protocol'] == "SFTP":
-            return ParamikoFileUploadWorker(cred, tag, file)
-        elif cred['protocol'] == "S3":
-            return Boto3FileUploadWorker(cred, tag, file)
-        else:
-            return None
+        self.checkBox_sync.setDisabled(True)
+        self.engine.sync_mode = self.checkBox_sync.isChecked()
+        self.engine.start()
+
+    def update_progress(self):
+        """
+        Applies all progress changes reported by the workers since the last call in one batch.
+        """
+        changes = self.progress.take_changes()
+        if changes:
+            statuses = {}
+            for filename in changes:
+                rate = self.progress.file_rate(filename)
+                if self.progress.is_skipped(filename):
+                    statuses[filename] = "skipped"
+                elif rate is not None:
+                    statuses[filename] = format_rate(rate)
+            self.model.update_progress(changes, statuses)
+
+        if self.telemetry.started is not None:
+            self.show_stats(self.telemetry.tick())
+
+    def show_stats(self, stats: dict):
+        self.label_stats.setText(f"{format_rate(stats['rate'])}  "
+                                 f"(avg {format_rate(stats['avg_rate'])}, "
+                                 f"mean {format_rate(stats['mean_rate'])})   "
+                                 f"{format_bytes(stats['remaining'])} of {format_bytes(stats['total'])} remaining   "
+                                 f"ETA {format_eta(stats['eta'])}")
+
+    def reject(self):
+        """
+        Closes the dialog; the close button, Esc and the window's close button all end up here.
+        While files are in flight the dialog stays open, as closing would wait for them on the GUI
+        thread: the upload has to be stopped first.
+        """
+        if self.engine.is_running():
+            msg = MsgAlert("Files are still being uploaded. Press stop and wait for the files in\n"
+                           "flight to finish before closing; the upload can be resumed later.")
+            msg.exec()
+            return
+
+        self.progress_timer.stop()
+        self.engine.close()
+        super().reject()
+
+
+class MsgUploadComplete(QMessageBox):
+    def __init__(self, msg):
+        super().__init__()
+        self.setMinimumWidth(700)
+        self.setIcon(QMessageBox.Information)
+        self.setText(msg)
+        self.setWindowTitle("Upload Complete")
+        self.setWindowIcon(QIcon('icons/arrow-up.png'))
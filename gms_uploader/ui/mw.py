@@ -39,6 +39,11 @@ class Ui_MainWindow(object):
         self.action_upload_meta_seqs.setObjectName(u"action_upload_meta_seqs")
         self.action_select_seq_files = QAction(MainWindow)
         self.action_select_seq_files.setObjectName(u"action_select_seq_files")
+        self.action_browse_samples = QAction(MainWindow)
+        self.action_browse_samples.setObjectName(u"action_browse_samples")
+        self.action_watch_runs = QAction(MainWindow)
+        self.action_watch_runs.setObjectName(u"action_watch_runs")
+        self.action_watch_runs.setCheckable(True)
         self.action_import_csv = QAction(MainWindow)
         self.action_import_csv.setObjectName(u"action_import_csv")
         self.action_paste_fx = QAction(MainWindow)
@@ -334,6 +339,8 @@ class Ui_MainWindow(object):
         self.toolBar.addAction(self.action_save_meta)
         self.toolBar.addSeparator()
         self.toolBar.addAction(self.action_select_seq_files)
+        self.toolBar.addAction(self.action_browse_samples)
+        self.toolBar.addAction(self.action_watch_runs)
         self.toolBar.addSeparator()
         self.toolBar.addAction(self.action_import_csv)
         self.toolBar.addAction(self.action_import_fx)
@@ -385,6 +392,17 @@ class Ui_MainWindow(object):
 #if QT_CONFIG(shortcut)
         self.action_select_seq_files.setShortcut(QCoreApplication.translate("MainWindow", u"Ctrl+S", None))
 #endif // QT_CONFIG(shortcut)
+        self.action_browse_samples.setText(QCoreApplication.translate("MainWindow", u"browse_samples", None))
+#if QT_CONFIG(tooltip)
+        self.action_browse_samples.setToolTip(QCoreApplication.translate("MainWindow", u"browse samples in seq base path", None))
+#endif // QT_CONFIG(tooltip)
+#if QT_CONFIG(shortcut)
+        self.action_browse_samples.setShortcut(QCoreApplication.translate("MainWindow", u"Ctrl+B", None))
+#endif // QT_CONFIG(shortcut)
+        self.action_watch_runs.setText(QCoreApplication.translate("MainWindow", u"watch_runs", None))
+#if QT_CONFIG(tooltip)
+        self.action_watch_runs.setToolTip(QCoreApplication.translate("MainWindow", u"watch seq base path and import new runs when complete", None))
+#endif // QT_CONFIG(tooltip)
         self.action_import_csv.setText(QCoreApplication.translate("MainWindow", u"import_csv", None))
 #if QT_CONFIG(tooltip)
         self.action_import_csv.setToolTip(QCoreApplication.translate("MainWindow", u"import metadata from csv", None))
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+################################################################################
+## Form generated from reading UI file 'sample_browser_dialog.ui'
+##
+## Created by: Qt User Interface Compiler version 6.12.0
+##
+## WARNING! All changes made in this file will be lost when recompiling UI file!
+################################################################################
+
+from PySide6.QtCore import (QCoreApplication, QDate, QDateTime, QLocale,
+    QMetaObject, QObject, QPoint, QRect,
+    QSize, QTime, QUrl, Qt)
+from PySide6.QtGui import (QBrush, QColor, QConicalGradient, QCursor,
+    QFont, QFontDatabase, QGradient, QIcon,
+    QImage, QKeySequence, QLinearGradient, QPainter,
+    QPalette, QPixmap, QRadialGradient, QTransform)
+from PySide6.QtWidgets import (QApplication, QDialog, QHBoxLayout, QHeaderView,
+    QLabel, QLineEdit, QPushButton, QSizePolicy,
+    QSpacerItem, QTableView, QVBoxLayout, QWidget)
+
+class Ui_Dialog(object):
+    def setupUi(self, Dialog):
+        if not Dialog.objectName():
+            Dialog.setObjectName(u"Dialog")
+        Dialog.resize(900, 600)
+        self.verticalLayout = QVBoxLayout(Dialog)
+        self.verticalLayout.setObjectName(u"verticalLayout")
+        self.horizontalLayout_filter = QHBoxLayout()
+        self.horizontalLayout_filter.setObjectName(u"horizontalLayout_filter")
+        self.label_root = QLabel(Dialog)
+        self.label_root.setObjectName(u"label_root")
+
+        self.horizontalLayout_filter.addWidget(self.label_root)
+
+        self.lineEdit_filter = QLineEdit(Dialog)
+        self.lineEdit_filter.setObjectName(u"lineEdit_filter")
+        self.lineEdit_filter.setClearButtonEnabled(True)
+
+        self.horizontalLayout_filter.addWidget(self.lineEdit_filter)
+
+
+        self.verticalLayout.addLayout(self.horizontalLayout_filter)
+
+        self.tableView = QTableView(Dialog)
+        self.tableView.setObjectName(u"tableView")
+
+        self.verticalLayout.addWidget(self.tableView)
+
+        self.horizontalLayout = QHBoxLayout()
+        self.horizontalLayout.setObjectName(u"horizontalLayout")
+        self.label_status = QLabel(Dialog)
+        self.label_status.setObjectName(u"label_status")
+
+        self.horizontalLayout.addWidget(self.label_status)
+
+        self.horizontalSpacer = QSpacerItem(40, 20, QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Minimum)
+
+        self.horizontalLayout.addItem(self.horizontalSpacer)
+
+        self.pushButton_import = QPushButton(Dialog)
+        self.pushButton_import.setObjectName(u"pushButton_import")
+
+        self.horizontalLayout.addWidget(self.pushButton_import)
+
+        self.pushButton_close = QPushButton(Dialog)
+        self.pushButton_close.setObjectName(u"pushButton_close")
+
+        self.horizontalLayout.addWidget(self.pushButton_close)
+
+
+        self.verticalLayout.addLayout(self.horizontalLayout)
+
+
+        self.retranslateUi(Dialog)
+
+        QMetaObject.connectSlotsByName(Dialog)
+    # setupUi
+
+    def retranslateUi(self, Dialog):
+        Dialog.setWindowTitle(QCoreApplication.translate("Dialog", u"Dialog", None))
+        self.label_root.setText(QCoreApplication.translate("Dialog", u"root:", None))
+        self.lineEdit_filter.setPlaceholderText(QCoreApplication.translate("Dialog", u"filter samples", None))
+        self.label_status.setText("")
+        self.pushButton_import.setText(QCoreApplication.translate("Dialog", u"Import selected", None))
+        self.pushButton_close.setText(QCoreApplication.translate("Dialog", u"Close", None))
+    # retranslateUi
+